@@ -0,0 +1,253 @@
+# Batch extraction of many games
+#
+# main.py extracts the rooms of a single resource file. Here a whole library
+# of SCUMM v5 games is extracted at once, from:
+#
+# * a folder: every data file (*.001) found in it (and in its sub-folders)
+#   is a game, saved in OUTPUT_ROOT/<its folder>/<its name>;
+# * or a game list (JSON), for games needing their own settings:
+#
+#   [
+#     { "file": "atlantis/ATLANTIS.001", "output_dir": "out/foa" },
+#     { "file": "monkey2/MONKEY2.001", "xor_key": "0x69", "rooms": "1-20", "outputs": ["background"] }
+#   ]
+#
+#   ("file" is relative to the folder of the list; everything else is
+#   optional: "name", "xor_key", "output_dir", "rooms", "outputs")
+#
+# Every game is planned just like main.py does (block index, incremental
+# extraction, room names), then the rooms of all the games go to a single
+# pool of worker processes, the largest first: while the large rooms are
+# being decoded, the small ones fill the gaps, whatever game they come from,
+# and no core is left idle while another one still has a queue of rooms.
+# Progress is printed as the rooms are done, then the totals of every game.
+#
+# usage: python batch.py FOLDER_OR_LIST [-o OUTPUT_ROOT] [-j WORKERS] [-t TYPES] [--report REPORT]
+
+import argparse
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+import instrumentation
+from instrumentation import log, ERROR, INFO
+from xorfile import XorFileReader
+
+# extension of the data files looked for in a folder
+DATA_FILE_EXTENSION = ".001"
+
+# where the games are saved (every game in a sub-folder)
+OUTPUT_ROOT = "batch_output"
+
+# where `--report` writes the totals (JSON)
+BATCH_REPORT = "batch_report.json"
+
+Game = namedtuple("Game", "name file_path xor_key output_dir rooms outputs")
+
+# GAMES ************************************************************************
+def findGames( folder, output_root=OUTPUT_ROOT, xor_key=main.XOR_KEY, outputs=None ):
+	# every data file in `folder` (and in its sub-folders)
+	games = []
+	for root, dirs, files in os.walk( folder ):
+		dirs.sort()
+		for filename in sorted( files ):
+			name, extension = os.path.splitext( filename )
+			if extension.lower() != DATA_FILE_EXTENSION:
+				continue
+			relative_folder = os.path.relpath( root, folder )
+			game_name = os.path.normpath( os.path.join( relative_folder, name.lower() ) )
+			games.append( Game( game_name, os.path.join( root, filename ), xor_key, os.path.join( output_root, game_name ), None, outputs ) )
+	return games
+
+def loadGameList( path, output_root=OUTPUT_ROOT, xor_key=main.XOR_KEY, outputs=None ):
+	# the games of a JSON game list (see above)
+	with open(path, 'r') as f:
+		entries = json.load( f )
+	if isinstance( entries, dict ):
+		entries = entries.get("games", [])
+	folder = os.path.dirname( os.path.abspath( path ) )
+	games = []
+	for entry in entries:
+		file_path = os.path.join( folder, entry["file"] )
+		name = entry.get("name") or os.path.splitext( os.path.basename( file_path ) )[0].lower()
+		game_xor_key = entry.get("xor_key", xor_key)
+		if isinstance( game_xor_key, str ):
+			game_xor_key = int( game_xor_key, 0 )
+		rooms = entry.get("rooms")
+		if isinstance( rooms, str ):
+			rooms = main.parseRoomList( rooms )
+		games.append( Game( name, file_path, game_xor_key, entry.get("output_dir") or os.path.join( output_root, name ), rooms, entry.get("outputs", outputs) ) )
+	return games
+
+
+# EXTRACTION *******************************************************************
+class GameRun:
+	# a game being extracted: its open file, plan and totals
+	def __init__(self, game, output_settings):
+		self.game = game
+		self.output_dir = os.path.abspath( game.output_dir )
+		self.output_settings = output_settings
+		self.file = None
+		self.plan = None
+		self.room_names = {}
+		self.room_sizes = {}
+		self.done = []
+		self.failed_rooms = []
+		self.bytes = 0
+		self.seconds = 0.0
+		self.error = None
+
+	def totals(self):
+		plan = self.plan
+		return {
+			"game": self.game.name,
+			"file": self.game.file_path,
+			"output_dir": self.output_dir,
+			"rooms": len( self.done ),
+			"up_to_date": len( plan.up_to_date ) if plan is not None else 0,
+			"failed_rooms": sorted( self.failed_rooms ),
+			"missing_rooms": sorted( plan.missing_rooms ) if plan is not None else [],
+			"bytes": self.bytes,
+			"seconds": round( self.seconds, 3 ),
+			"error": self.error,
+		}
+
+def planGame( game, output_settings, force=False, incremental=None ):
+	# open the game and work out its rooms to be extracted
+	run = GameRun( game, output_settings )
+	try:
+		for settings in output_settings.values():
+			os.makedirs( os.path.join( run.output_dir, settings["folder"] ), exist_ok=True )
+		if main.ROOM_NAMES_IN_FILENAMES:
+			run.room_names = main.loadRoomNames( main.indexFilePath( game.file_path ), game.xor_key )
+		run.file = XorFileReader( game.file_path, game.xor_key )
+		incremental = main.INCREMENTAL_EXTRACTION if incremental is None else incremental
+		run.plan = main.planExtraction( run.file, game.file_path, run.output_dir, game.rooms, output_settings, incremental, force )
+		run.room_sizes = run.plan.roomSizes() or {}
+	except Exception as e:
+		log( ERROR, f"{game.name}: {e}" )
+		run.error = str(e)
+		if run.file is not None:
+			run.file.close()
+			run.file = None
+		run.plan = None
+	return run
+
+def runBatch( games, workers=0, outputs=None, scale=None, palette_scale=None, image_format=None, force=False, incremental=None ):
+	# extract all the games, returns the totals of every game
+	if workers <= 0:
+		workers = os.cpu_count() or 1
+
+	runs = []
+	for game in games:
+		output_settings = main.outputSettings( game.outputs or outputs, scale, palette_scale, image_format )
+		if "dataset" in output_settings:
+			# (written by a single process, see main.py)
+			log( ERROR, f"{game.name}: the packed dataset can't be written in batch mode, skipping it" )
+			del output_settings["dataset"]
+		run = planGame( game, output_settings, force, incremental )
+		runs.append( run )
+		if run.plan is not None:
+			log( INFO, f"{game.name}: {len(run.plan.tasks)} rooms to extract, {len(run.plan.up_to_date)} up to date" )
+
+	# the rooms of all the games, largest first
+	tasks = []
+	for run in runs:
+		if run.plan is None:
+			continue
+		for room_number, room_abs_offset, room_outputs in run.plan.tasks:
+			tasks.append( (run.room_sizes.get( room_number, 0 ), run, room_number, room_abs_offset, room_outputs) )
+	tasks.sort( key=lambda task: task[0], reverse=True )
+	total_rooms = len(tasks)
+
+	profile = instrumentation.profiler is not None
+	with ProcessPoolExecutor( max_workers=workers, initializer=main.initExtractionWorker, initargs=(None, instrumentation.log_level, profile) ) as pool:
+		futures = {}
+		for size, run, room_number, room_abs_offset, room_outputs in tasks:
+			game = run.game
+			future = pool.submit( main.extractGameRoom, game.file_path, game.xor_key, run.room_names, room_number, room_abs_offset, run.output_dir, room_outputs )
+			futures[ future ] = (run, room_number, size)
+
+		for done, future in enumerate( as_completed( futures ), 1 ):
+			run, room_number, size = futures[ future ]
+			try:
+				room_number, room_profile, store_stats, seconds = future.result()
+				if room_profile is not None:
+					instrumentation.profiler.merge( room_profile )
+				run.done.append( room_number )
+				run.bytes += size
+				run.seconds += seconds
+				log( INFO, f"[{done}/{total_rooms}] {run.game.name}: room {room_number} ({seconds:.2f} s)" )
+			except Exception as e:
+				log( ERROR, f"[{done}/{total_rooms}] {run.game.name}: error extracting room {room_number}: {e}" )
+				run.failed_rooms.append( room_number )
+
+	# every game remembers what has been extracted
+	for run in runs:
+		if run.plan is None:
+			continue
+		try:
+			run.plan.updateManifest( run.file, run.output_dir, run.output_settings, run.failed_rooms, [] )
+		except OSError as e:
+			log( ERROR, f"{run.game.name}: unable to save the manifest: {e}" )
+		run.file.close()
+
+	return [ run.totals() for run in runs ]
+
+def printTotals( totals ):
+	log( ERROR, f"{'game':24} {'rooms':>6} {'up to date':>10} {'failed':>6} {'missing':>7} {'MB':>8} {'seconds':>8}" )
+	for game in totals:
+		failed = "error" if game["error"] else len( game["failed_rooms"] )
+		log( ERROR, f"{game['game']:24} {game['rooms']:6} {game['up_to_date']:10} {failed:>6} {len(game['missing_rooms']):7} {game['bytes'] / (1 << 20):8.2f} {game['seconds']:8.2f}" )
+	log( ERROR, f"{'total':24} {sum( game['rooms'] for game in totals ):6} {sum( game['up_to_date'] for game in totals ):10} "
+		f"{sum( len( game['failed_rooms'] ) for game in totals ):6} {sum( len( game['missing_rooms'] ) for game in totals ):7} "
+		f"{sum( game['bytes'] for game in totals ) / (1 << 20):8.2f} {sum( game['seconds'] for game in totals ):8.2f}" )
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description="Extract the rooms of many SCUMM v5 games at once" )
+	parser.add_argument( "source", help=f"folder with the games (every *{DATA_FILE_EXTENSION} file), or a JSON game list" )
+	parser.add_argument( "-o", "--output-root", default=OUTPUT_ROOT, help=f"where the games are saved, one folder each (default: {OUTPUT_ROOT})" )
+	parser.add_argument( "-t", "--types", type=main.outputListArgument, help=f"what to extract, among {', '.join(main.OUTPUT_TYPES)} (default: {', '.join(main.defaultOutputs())})" )
+	parser.add_argument( "--xor-key", type=main.xorKeyArgument, default=main.XOR_KEY, help=f"XOR key of the games without their own (default: {main.XOR_KEY:#04x})" )
+	parser.add_argument( "--scale", type=int, help="scale factor of backgrounds, objects, z-planes and animations" )
+	parser.add_argument( "--palette-scale", type=int, help=f"scale factor of the palette images (default: {main.PALETTE_IMAGE_SCALE_FACTOR})" )
+	parser.add_argument( "--format", choices=main.IMAGE_FORMATS, help=f"image format (default: {main.IMAGE_FORMAT})" )
+	parser.add_argument( "-j", "--workers", type=int, default=0, help="worker processes (default: one per CPU)" )
+	parser.add_argument( "--force", action="store_true", help="extract everything again, even what is up to date" )
+	parser.add_argument( "--report", nargs="?", const=BATCH_REPORT, metavar="REPORT", help=f"write the totals of every game (default: {BATCH_REPORT})" )
+	parser.add_argument( "-v", "--verbose", action="count", default=0, help="print more (repeat for even more)" )
+	parser.add_argument( "-q", "--quiet", action="store_true", help="only print errors and totals" )
+	args = parser.parse_args()
+
+	instrumentation.setLogLevel( ERROR if args.quiet else main.LOG_LEVEL + args.verbose )
+	start_time = time.perf_counter()
+
+	if os.path.isdir( args.source ):
+		games = findGames( args.source, args.output_root, args.xor_key, args.types )
+	elif os.path.exists( args.source ):
+		try:
+			games = loadGameList( args.source, args.output_root, args.xor_key, args.types )
+		except (ValueError, KeyError, TypeError) as e:
+			log( ERROR, f"{args.source}: not a valid game list ({e})" )
+			raise SystemExit(1)
+	else:
+		log( ERROR, f"{args.source} not found." )
+		raise SystemExit(1)
+	if not games:
+		log( ERROR, f"no games found in {args.source}" )
+		raise SystemExit(1)
+
+	totals = runBatch( games, args.workers, args.types, args.scale, args.palette_scale, args.format, args.force )
+	printTotals( totals )
+	log( ERROR, f"{len(games)} games in {time.perf_counter() - start_time:.2f} s" )
+
+	if args.report:
+		with open(args.report, 'w') as f:
+			json.dump( { "games": totals }, f, indent=1 )
+
+	if any( game["error"] or game["failed_rooms"] or game["missing_rooms"] for game in totals ):
+		raise SystemExit(1)
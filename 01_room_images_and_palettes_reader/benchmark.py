@@ -0,0 +1,274 @@
+# Benchmarks
+#
+# Measures the main stages of the extractor on a synthetic resource file (see
+# synthetic.py): XOR decoding, walking the block tree, decoding strips (for
+# every method and direction), decoding z-planes, viewports and previews of a
+# wide room, writing PNG images, color cycling animations and many small
+# (sound) files.
+# Every run is appended to a history file, and every figure is compared with
+# the last run made with the same settings, so that a change which makes
+# things slower doesn't go unnoticed.
+#
+# usage: python benchmark.py [--rooms N] [--width W] [--height H] [--repeat R] [--fail-on-regression]
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+from xorfile import XorFileReader
+from blockindex import buildIndex
+from smap import DECODER_TABLE, METHOD_NONE, codecName, decodeStrip, decodeRegion, decodePreview
+from synthetic import COMPRESSION_IDS, block, generateResourceFile, makeRoomImage, makeSMAP, encodeStrip, makeZPlane
+from zplane import decodeZPlane
+from outputpipeline import OutputPipeline, BatchWriter, saveImage
+from colorcycle import cycleFrames, saveCycleAnimation
+from main import xor
+
+HISTORY_FILENAME = "benchmark_history.jsonl"
+
+# strips decoded for every codec group
+CODEC_STRIPS = 64
+CODEC_STRIP_HEIGHT = 144
+
+# viewports (side by side) into a wide, scrolling room, and its preview
+REGION_ROOM_WIDTH = 1280
+REGION_VIEWPORT_WIDTH = 320
+PREVIEW_STEP = 4
+
+# small files written in batches
+SOUND_FILES = 2000
+SOUND_FILE_SIZE = 1024
+
+# a figure this much lower than in the previous run is reported as a regression
+DEFAULT_TOLERANCE = 0.10
+
+def bestOf( repeat, function ):
+	# shortest time (in seconds) out of `repeat` runs
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best
+
+def codecGroups():
+	# compression IDs grouped by method and direction,
+	# e.g. "method1_vertical": [0x0E, 0x0F, ...]
+	groups = {}
+	for compression_id in range(1, 129):
+		if DECODER_TABLE[ compression_id ] & 3 != METHOD_NONE:
+			groups.setdefault( codecName( compression_id ), [] ).append( compression_id )
+	return groups
+
+
+# BENCHMARKS *******************************************************************
+def benchXor( file_path, repeat ):
+	size = os.path.getsize( file_path )
+
+	def readAll():
+		with XorFileReader( file_path ) as file:
+			while file.read( 1 << 16 ):
+				pass
+
+	return {
+		"xor_translate_mb_s": size / bestOf( repeat, lambda: xor( file_path ) ) / 1e6,
+		"xor_reader_mb_s": size / bestOf( repeat, readAll ) / 1e6,
+	}
+
+def benchBlockWalk( file_path, repeat ):
+	size = os.path.getsize( file_path )
+	with XorFileReader( file_path ) as file:
+		num_blocks = len( buildIndex( file ).blocks )
+		elapsed = bestOf( repeat, lambda: buildIndex( file ) )
+	return {
+		"block_walk_blocks_s": num_blocks / elapsed,
+		"block_walk_mb_s": size / elapsed / 1e6,
+	}
+
+def benchCodecs( repeat, seed ):
+	rng = random.Random( seed )
+	height = CODEC_STRIP_HEIGHT
+	image = makeRoomImage( 8 * CODEC_STRIPS, height, rng )
+	results = {}
+	for name, compression_ids in codecGroups().items():
+		strips = []
+		for i in range(CODEC_STRIPS):
+			compression_id = compression_ids[ i % len(compression_ids) ]
+			mask = 0xFF if name == "uncompressed" else (1 << (DECODER_TABLE[ compression_id ] >> 4)) - 1
+			indices = bytes( image[ y*8*CODEC_STRIPS + i*8 + x ] & mask for y in range(height) for x in range(8) )
+			strips.append( encodeStrip( indices, height, compression_id ) )
+
+		def decodeAll():
+			for strip in strips:
+				decodeStrip( strip, height )
+
+		results[ f"codec_{name}_px_s" ] = 8 * height * CODEC_STRIPS / bestOf( repeat, decodeAll )
+	return results
+
+def benchZPlanes( repeat, seed ):
+	rng = random.Random( seed )
+	width = 8 * CODEC_STRIPS
+	height = CODEC_STRIP_HEIGHT
+	zplanes = [ block( "ZP01", makeZPlane( width, height, rng )[0] ) for i in range(4) ]
+
+	def decodeAll():
+		for zplane in zplanes:
+			decodeZPlane( zplane, width, height )
+
+	return { "zplane_px_s": width * height * len(zplanes) / bestOf( repeat, decodeAll ) }
+
+def benchRegions( repeat, seed ):
+	# pixels of the viewports, and of the whole room for the preview, per second
+	rng = random.Random( seed )
+	width = REGION_ROOM_WIDTH
+	height = CODEC_STRIP_HEIGHT
+	strip_ids = [ COMPRESSION_IDS[ i % len(COMPRESSION_IDS) ] for i in range( width // 8 ) ]
+	smap_data = makeSMAP( makeRoomImage( width, height, rng ), width, height, strip_ids )
+	viewports = [ (x, 0, x + REGION_VIEWPORT_WIDTH, height) for x in range( 0, width, REGION_VIEWPORT_WIDTH ) ]
+
+	def decodeViewports():
+		for box in viewports:
+			decodeRegion( smap_data, width, height, box )
+
+	return {
+		"region_viewport_px_s": REGION_VIEWPORT_WIDTH * height * len(viewports) / bestOf( repeat, decodeViewports ),
+		f"preview_x{PREVIEW_STEP}_room_px_s": width * height / bestOf( repeat, lambda: decodePreview( smap_data, width, height, PREVIEW_STEP ) ),
+	}
+
+def benchPng( rooms, output_dir, repeat ):
+	# palettized images, saved as they are and scaled 2x
+	from PIL import Image
+	width, height = rooms[1].width, rooms[1].height
+	image = Image.frombytes("P", (width, height), bytes( rooms[1].indices ))
+	image.putpalette( bytes( range(256) ) * 3 )
+	filename = os.path.join( output_dir, "benchmark.png" )
+	results = {}
+	for scale_factor in (1, 2):
+		elapsed = bestOf( repeat, lambda: saveImage( filename, image, scale_factor ) )
+		results[ f"png_x{scale_factor}_px_s" ] = width * height * scale_factor * scale_factor / elapsed
+	return results
+
+def benchCycles( rooms, output_dir, repeat ):
+	# a 60 frame GIF animation of three ranges rotating at different speeds
+	width, height = rooms[1].width, rooms[1].height
+	cycles = [ { "delay": delay, "flags": 0, "start": start, "end": start + 15 } for delay, start in ((2, 16), (4, 64), (8, 128)) ]
+	frames = cycleFrames( bytes( range(256) ) * 3, cycles, 60 )
+	filename = os.path.join( output_dir, "benchmark.gif" )
+	elapsed = bestOf( repeat, lambda: saveCycleAnimation( filename, rooms[1].indices, width, height, frames ) )
+	return { "cycle_gif_frames_s": len(frames) / elapsed }
+
+def benchSoundWrites( output_dir, repeat ):
+	# every file is a small header and a slice of a bigger buffer
+	folder = os.path.join( output_dir, "sounds" )
+	os.makedirs( folder, exist_ok=True )
+	data = memoryview( bytes( range(256) ) * (SOUND_FILES * SOUND_FILE_SIZE // 256) )
+
+	def writeAll():
+		pipeline = OutputPipeline()
+		writer = BatchWriter( pipeline )
+		for i in range(SOUND_FILES):
+			writer.write( os.path.join( folder, f"{i}.raw" ), [ b"SOUND", data[ i * SOUND_FILE_SIZE : (i + 1) * SOUND_FILE_SIZE ] ] )
+		writer.flush()
+		pipeline.close()
+
+	return { "sound_files_s": SOUND_FILES / bestOf( repeat, writeAll ) }
+
+def runBenchmarks( num_rooms, width, height, repeat, seed=0 ):
+	with tempfile.TemporaryDirectory() as output_dir:
+		file_path = os.path.join( output_dir, "BENCHMARK.001" )
+		rooms = generateResourceFile( file_path, num_rooms, width, height, seed )
+		results = {}
+		results.update( benchXor( file_path, repeat ) )
+		results.update( benchBlockWalk( file_path, repeat ) )
+		results.update( benchCodecs( repeat, seed ) )
+		results.update( benchZPlanes( repeat, seed ) )
+		results.update( benchRegions( repeat, seed ) )
+		results.update( benchPng( rooms, output_dir, repeat ) )
+		results.update( benchCycles( rooms, output_dir, repeat ) )
+		results.update( benchSoundWrites( output_dir, repeat ) )
+	return results
+
+
+# HISTORY **********************************************************************
+def gitRevision():
+	try:
+		return subprocess.run( ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True ).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def loadHistory( path ):
+	history = []
+	try:
+		with open(path, 'r') as f:
+			for line in f:
+				if line.strip():
+					history.append( json.loads( line ) )
+	except OSError:
+		pass
+	return history
+
+def appendHistory( path, entry ):
+	with open(path, 'a') as f:
+		f.write( json.dumps( entry ) + "\n" )
+
+def report( results, previous, tolerance ):
+	# print every figure (all of them are "higher is better") next to the one
+	# of the previous run, and return the names of the regressions
+	regressions = []
+	for name, value in results.items():
+		line = f"{name:<36} {value:>16,.0f}"
+		if previous is not None and previous.get( name ):
+			change = value / previous[ name ] - 1
+			line += f"  {change:+7.1%}"
+			if change < -tolerance:
+				line += "  REGRESSION"
+				regressions.append( name )
+		print( line )
+	return regressions
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description="Benchmark the extractor on a synthetic resource file" )
+	parser.add_argument( "--rooms", type=int, default=8, help="number of rooms of the synthetic file" )
+	parser.add_argument( "--width", type=int, default=320, help="room width in pixels" )
+	parser.add_argument( "--height", type=int, default=144, help="room height in pixels" )
+	parser.add_argument( "--repeat", type=int, default=3, help="runs of every benchmark (the best one counts)" )
+	parser.add_argument( "--seed", type=int, default=0, help="random seed of the synthetic file" )
+	parser.add_argument( "--tolerance", type=float, default=DEFAULT_TOLERANCE, help="slowdown reported as a regression (0.1 = 10%%)" )
+	parser.add_argument( "--history", default=os.path.join( os.path.dirname( os.path.abspath(__file__) ), HISTORY_FILENAME ), help="history file" )
+	parser.add_argument( "--no-history", action="store_true", help="don't append this run to the history" )
+	parser.add_argument( "--fail-on-regression", action="store_true", help="exit with status 1 if something got slower" )
+	args = parser.parse_args()
+
+	settings = { "rooms": args.rooms, "width": args.width // 8 * 8, "height": args.height, "seed": args.seed }
+	results = runBenchmarks( settings["rooms"], settings["width"], settings["height"], args.repeat, args.seed )
+
+	# compare with the last run made with the same settings
+	previous = None
+	for entry in loadHistory( args.history ):
+		if entry.get("settings") == settings:
+			previous = entry
+	if previous is not None:
+		print(f"compared with the run of {previous['date']} (revision {previous.get('revision')})")
+	regressions = report( results, previous["results"] if previous else None, args.tolerance )
+
+	if not args.no_history:
+		appendHistory( args.history, {
+			"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+			"revision": gitRevision(),
+			"python": platform.python_version(),
+			"settings": settings,
+			"results": results,
+		})
+
+	if regressions:
+		print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+		if args.fail_on_regression:
+			raise SystemExit(1)
@@ -0,0 +1,272 @@
+# A persistent index of every block inside a SCUMM v5 resource file.
+#
+# The resource file is a tree of blocks (LECF > LFLF > ROOM > RMIM > IM00 >
+# SMAP ...) and every block starts with an 8 bytes header (4 bytes name, 4
+# bytes big endian size, header included). Walking that tree only requires to
+# read the headers and seek over the payloads, so we do it once, record name,
+# absolute offset, size and parent of every block and save the result on disk
+# next to the resource file.
+#
+# The saved index is keyed by size, modification time and SHA-1 of the
+# resource file: if size and mtime didn't change we trust it right away, if
+# only the mtime changed (e.g. the file has been copied) we compare the hash
+# before throwing it away.
+#
+# Once loaded, things like "the SMAP block of room 42" can be found with a
+# dictionary lookup instead of scanning the file.
+#
+# When only a few rooms are wanted and there is no saved index yet, only the
+# LFLF blocks of those rooms are walked (found through the LOFF table): such
+# a partial index costs about as much as the rooms themselves and is not saved.
+
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from blocks import walkBlocks, readBlock
+from instrumentation import log, phase, ERROR, INFO, DEBUG
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+
+# blocks whose payload is made of other blocks
+CONTAINER_BLOCKS = {"LECF", "LFLF", "ROOM", "RMIM", "OBIM", "OBCD"}
+
+# NOTE: SOUN blocks are not descended into: the size stored in their "SOU "
+#       sub-block doesn't take its own header into account (see readLFLF).
+
+# parent is the position of the parent block inside the index (-1 for roots)
+Block = namedtuple("Block", "name offset size parent")
+
+def isContainerBlock( name ):
+	if name in CONTAINER_BLOCKS:
+		return True
+	# IM00 (room image), IM01 .. IMnn (object image states)
+	return name[:2] == "IM" and all( c in "0123456789ABCDEF" for c in name[2:] )
+
+
+class BlockIndex:
+	def __init__(self, blocks, rooms, fingerprint=None):
+		self.blocks = blocks
+		# room number -> position of its LFLF block inside the index
+		self.rooms = rooms
+		self.fingerprint = fingerprint
+		# set when the fingerprint has been refreshed and should be saved again
+		self.mtime_updated = False
+
+		# (room number, block name) -> positions of all the blocks with that
+		# name found inside the LFLF of that room
+		self.room_blocks = {}
+		# position of a block -> positions of its children
+		self.children_of = {}
+
+		room_of_lflf = { lflf: room for room, lflf in rooms.items() }
+		room_of = [None] * len(blocks)
+		for i, block in enumerate(blocks):
+			if block.parent >= 0:
+				self.children_of.setdefault( block.parent, [] ).append( i )
+				room_of[i] = room_of[ block.parent ]
+			if block.name == "LFLF":
+				room_of[i] = room_of_lflf.get( i )
+			if room_of[i] is not None:
+				self.room_blocks.setdefault( (room_of[i], block.name), [] ).append( i )
+
+	def find(self, room_number, block_name):
+		# first block named `block_name` inside the given room (or None)
+		positions = self.room_blocks.get( (room_number, block_name) )
+		if not positions:
+			return None
+		return self.blocks[ positions[0] ]
+
+	def findAll(self, room_number, block_name):
+		return [ self.blocks[i] for i in self.room_blocks.get( (room_number, block_name), [] ) ]
+
+	def children(self, position):
+		return [ self.blocks[i] for i in self.children_of.get( position, [] ) ]
+
+	def roomNumberAndOffset(self):
+		# same content of the LOFF table: room number and absolute offset of
+		# the ROOM block (which comes right after the LFLF header)
+		return [ [room, self.blocks[lflf].offset + 8] for room, lflf in self.rooms.items() ]
+
+	def toDict(self):
+		return {
+			"version": INDEX_VERSION,
+			"file": self.fingerprint,
+			"rooms": { str(room): lflf for room, lflf in self.rooms.items() },
+			"blocks": [ list(block) for block in self.blocks ],
+		}
+
+	@classmethod
+	def fromDict(cls, data):
+		blocks = [ Block(*block) for block in data["blocks"] ]
+		rooms = { int(room): lflf for room, lflf in data["rooms"].items() }
+		return cls( blocks, rooms, data.get("file") )
+
+
+# LOFF *************************************************************************
+# info taken from internal documentation of ScummEX software:
+# The LOFF block contains the offsets to each LFLF block in the file
+# "LOFF" (dword) Block identifier
+# dwSize (dword) Size in bytes (BE)
+# nRooms (byte) Number of LFLF offsets
+# loop nRooms
+#	* nRoomNumber (byte) Room Number
+#	* dwOffset (dword) LFLF offset (LE)
+# enf of loop
+def readLOFF( file, loff_offset ):
+	room_number_and_offset = []
+	file.seek( loff_offset + 8, 0 )
+	nRoomsOffsets = int.from_bytes( file.read(1), 'little' )
+	entries = file.read( 5 * nRoomsOffsets )
+	for room in range(nRoomsOffsets):
+		entry = entries[ room*5 : room*5 + 5 ]
+		roomNumber = entry[0]
+		offset = int.from_bytes( entry[1:5], 'little' )
+		room_number_and_offset.append( [roomNumber, offset] )
+	return room_number_and_offset
+
+
+# building *********************************************************************
+def walkTree( blocks, parent, walker ):
+	# append to `blocks` every block yielded by `walker` and, recursively,
+	# their children
+	# stack of (position of the parent block inside the index, walker over
+	# its children)
+	stack = [ (parent, walker) ]
+	while stack:
+		parent, walker = stack[-1]
+		block = next( walker, None )
+		if block is None:
+			stack.pop()
+			continue
+		blocks.append( Block( block.name, block.offset, block.size, parent ) )
+		if isContainerBlock( block.name ):
+			stack.append( (len(blocks) - 1, block.children()) )
+
+def buildRoomsIndex( file, room_numbers ):
+	# partial index: the LFLF blocks of the given rooms only
+	loff = readBlock( file, 8 )
+	if loff.name != "LOFF":
+		raise ValueError(f"LOFF block expected at offset 8, found {loff.name!r}")
+	blocks = []
+	rooms = {}
+	for room_number, room_offset in readLOFF( file, loff.offset ):
+		if room_number not in room_numbers:
+			continue
+		lflf = readBlock( file, room_offset - 8 )
+		if lflf.name != "LFLF":
+			log( ERROR, f"room {room_number}: no LFLF block at offset {lflf.offset}" )
+			continue
+		rooms[ room_number ] = len(blocks)
+		walkTree( blocks, -1, iter( (lflf,) ) )
+	return BlockIndex( blocks, rooms )
+
+def buildIndex( file ):
+	file.seek(0, 2)
+	file_size = file.tell()
+
+	blocks = []
+	walkTree( blocks, -1, walkBlocks( file, 0, file_size ) )
+
+	# blocks are recorded in file order, parents before their children
+
+	# map rooms (as listed in the LOFF table) to their LFLF blocks
+	lflf_at = { block.offset: i for i, block in enumerate(blocks) if block.name == "LFLF" }
+	rooms = {}
+	for i, block in enumerate(blocks):
+		if block.name == "LOFF":
+			for room_number, room_offset in readLOFF( file, block.offset ):
+				lflf = lflf_at.get( room_offset - 8 )
+				if lflf is not None:
+					rooms[ room_number ] = lflf
+			break
+
+	return BlockIndex( blocks, rooms )
+
+
+# persistence ******************************************************************
+def fileHash( file_path ):
+	sha1 = hashlib.sha1()
+	with open(file_path, 'rb') as f:
+		while True:
+			chunk = f.read( 1 << 20 )
+			if not chunk:
+				break
+			sha1.update( chunk )
+	return sha1.hexdigest()
+
+def fileFingerprint( file_path, with_hash=True ):
+	stat = os.stat( file_path )
+	fingerprint = { "size": stat.st_size, "mtime_ns": stat.st_mtime_ns }
+	if with_hash:
+		fingerprint["sha1"] = fileHash( file_path )
+	return fingerprint
+
+def defaultIndexPath( file_path ):
+	return file_path + INDEX_SUFFIX
+
+def saveIndex( index, index_path ):
+	tmp_path = index_path + ".tmp"
+	with open(tmp_path, 'w') as f:
+		json.dump( index.toDict(), f, separators=(',', ':') )
+	os.replace( tmp_path, index_path )
+
+def loadIndex( index_path ):
+	with open(index_path, 'r') as f:
+		data = json.load( f )
+	if data.get("version") != INDEX_VERSION:
+		return None
+	return BlockIndex.fromDict( data )
+
+def isIndexValid( index, file_path ):
+	saved = index.fingerprint or {}
+	current = fileFingerprint( file_path, with_hash=False )
+	if saved.get("size") != current["size"]:
+		return False
+	if saved.get("mtime_ns") == current["mtime_ns"]:
+		return True
+	# same size, different mtime: only the content can tell
+	if saved.get("sha1") != fileHash( file_path ):
+		return False
+	# remember the new mtime so that next time the hash won't be needed
+	saved["mtime_ns"] = current["mtime_ns"]
+	index.mtime_updated = True
+	return True
+
+def loadOrBuildIndex( file, file_path, index_path=None, room_numbers=None ):
+	# `file` is the decoded view of the resource file at `file_path`; with
+	# `room_numbers`, a partial index of those rooms is enough
+	if index_path is None:
+		index_path = defaultIndexPath( file_path )
+
+	index = None
+	if os.path.exists( index_path ):
+		try:
+			index = loadIndex( index_path )
+		except (OSError, ValueError, KeyError, TypeError) as e:
+			log( ERROR, f"Unable to load block index {index_path}: {e}" )
+			index = None
+		if index is not None and isIndexValid( index, file_path ):
+			if index.mtime_updated:
+				try:
+					saveIndex( index, index_path )
+				except OSError:
+					pass
+			return index
+
+	if room_numbers is not None:
+		log( DEBUG, f"Indexing rooms {sorted(room_numbers)} of {file_path}" )
+		with phase("block_walk"):
+			return buildRoomsIndex( file, set( room_numbers ) )
+
+	log( INFO, f"Building block index for {file_path}" )
+	with phase("block_walk"):
+		index = buildIndex( file )
+	index.fingerprint = fileFingerprint( file_path )
+	try:
+		saveIndex( index, index_path )
+	except OSError as e:
+		log( ERROR, f"Unable to save block index {index_path}: {e}" )
+	return index
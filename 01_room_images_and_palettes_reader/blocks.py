@@ -0,0 +1,79 @@
+# Lazy, streaming access to the block tree of a SCUMM resource file.
+#
+# Every block starts with an 8 bytes header: 4 bytes for the name and 4 bytes
+# for the size (big endian, header included), so a reader only needs the
+# headers to move around: `walkBlocks` yields the blocks found in a range of
+# the file one at a time, reading nothing but their headers. Skipping a block
+# the caller is not interested in costs a single seek, its payload is only
+# read (and decoded) when the caller asks for it, and its children are only
+# parsed when the caller walks them.
+
+from instrumentation import log, ERROR
+
+class Block:
+	__slots__ = ("file", "name", "offset", "size", "_payload")
+
+	def __init__(self, file, name, offset, size):
+		self.file = file
+		self.name = name
+		self.offset = offset    # absolute offset of the block header
+		self.size = size        # block size, header included
+		self._payload = None
+
+	@property
+	def end(self):
+		return self.offset + self.size
+
+	@property
+	def payload(self):
+		# the block content (header excluded), as a memoryview
+		if self._payload is None:
+			self._payload = readView( self.file, self.offset + 8, self.size - 8 )
+		return self._payload
+
+	def children(self):
+		# walk the blocks stored inside this block
+		return walkBlocks( self.file, self.offset + 8, self.end )
+
+	def __iter__(self):
+		# allows `name, offset, size, payload = block`
+		return iter( (self.name, self.offset, self.size, self.payload) )
+
+	def __repr__(self):
+		return f"Block({self.name!r}, offset={self.offset}, size={self.size})"
+
+
+def isValidBlockName( name_bytes ):
+	return len(name_bytes) == 4 and all( 0x20 <= b <= 0x7E for b in name_bytes )
+
+def readView( file, offset, size ):
+	# decoded bytes of a range of the file, without moving the file pointer
+	if hasattr( file, "view" ):
+		return file.view( offset, size )
+	position = file.tell()
+	file.seek( offset, 0 )
+	data = file.read( size )
+	file.seek( position, 0 )
+	return memoryview( data )
+
+def walkBlocks( file, start, end ):
+	# Yield the blocks stored one after the other between `start` and `end`.
+	# The walk stops at the first header which doesn't look like a block
+	# header (or at a block which doesn't fit in the range).
+	position = start
+	while position + 8 <= end:
+		file.seek( position, 0 )
+		header = file.read(8)
+		name_bytes = header[:4]
+		size = int.from_bytes( header[4:8], 'big' )
+		if not isValidBlockName( name_bytes ) or size < 8 or position + size > end:
+			log( ERROR, f"walkBlocks: unexpected data at offset {position}, skipping the rest of the parent block" )
+			return
+		yield Block( file, name_bytes.decode('ascii'), position, size )
+		position += size
+
+def readBlock( file, offset ):
+	# the block whose header is at `offset`
+	file.seek( offset, 0 )
+	header = file.read(8)
+	return Block( file, header[:4].decode('ascii'), offset, int.from_bytes( header[4:8], 'big' ) )
@@ -0,0 +1,107 @@
+# Color cycling (CYCL)
+#
+# Water, fire, lights... are animated by rotating ranges of the room palette,
+# the pixels of the background never change. The CYCL block lists the ranges:
+#
+# cycles : variable length
+#   idx   : 8 (valid range is [1-16], 0 closes the block)
+#   unk   : 16
+#   freq  : 16be (delay = 16384/freq)
+#   flags : 16be (bit 1 set: the range rotates backwards)
+#   start : 8 (start/end entries in the palette)
+#   end   : 8
+#
+# The delay is in "jiffies" (1/60 of a second): every `delay` jiffies the
+# range is rotated by one entry.
+#ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Room_resources
+#
+# An animation is made of the very same palettized pixels (decoded once) and,
+# for every frame, a different palette.
+
+from outputpipeline import scaleImage
+import instrumentation
+
+JIFFIES_PER_SECOND = 60
+
+def parseCycles( data ):
+	# list of cycles (dicts) found in the payload of a CYCL block
+	cycles = []
+	position = 0
+	while position < len(data) and data[ position ] != 0:
+		entry = data[ position : position + 9 ]
+		if len(entry) < 9:
+			break
+		freq = int.from_bytes( entry[3:5], byteorder='big', signed=False)
+		cycles.append({
+			"idx"   : entry[0],
+			"unk"   : int.from_bytes( entry[1:3], byteorder='little', signed=False),
+			"freq"  : freq,
+			"flags" : int.from_bytes( entry[5:7], byteorder='big', signed=False),
+			"start" : entry[7],
+			"end"   : entry[8],
+			"delay" : 16384 // freq if freq else 0,
+		})
+		position += 9
+	return cycles
+
+def activeCycles( cycles ):
+	return [ cycle for cycle in cycles if cycle["delay"] > 0 and cycle["start"] < cycle["end"] ]
+
+def rotate( palette, start, end, forward ):
+	# rotate the palette entries start..end (RGB triplets) by one entry
+	a = start * 3
+	b = end * 3
+	if forward:
+		palette[ a : b + 3 ] = palette[ b : b + 3 ] + palette[ a : b ]
+	else:
+		palette[ a : b + 3 ] = palette[ a + 3 : b + 3 ] + palette[ a : a + 3 ]
+
+def cycleFrames( palette, cycles, max_frames ):
+	# [(palette, duration in ms)] of the animation: a new frame whenever at
+	# least one range rotates, until the palette is back to where it started
+	# (or `max_frames` frames)
+	cycles = activeCycles( cycles )
+	palette = bytearray( palette )
+	if not cycles:
+		return [ (bytes( palette ), 0) ]
+
+	first = bytes( palette )
+	next_step = [ cycle["delay"] for cycle in cycles ]
+	time = 0
+	frames = []
+	while len(frames) < max_frames:
+		step_time = min( next_step )
+		frames.append( (bytes( palette ), (step_time - time) * 1000 / JIFFIES_PER_SECOND) )
+		time = step_time
+		for i, cycle in enumerate(cycles):
+			if next_step[i] == step_time:
+				rotate( palette, cycle["start"], cycle["end"], not cycle["flags"] & 2 )
+				next_step[i] += cycle["delay"]
+		if palette == first:
+			break
+	return frames
+
+def saveCycleAnimation( filename, indices, width, height, frames, scale_factor=1 ):
+	# GIF or APNG (depending on the file name) of the color cycling animation
+	from PIL import Image
+	with instrumentation.phase("image_save"):
+		# pixels are scaled once, every frame shares them
+		base = scaleImage( Image.frombytes( "P", (width, height), bytes( indices ) ), scale_factor )
+		pixels = base.tobytes()
+
+		images = []
+		for palette, duration in frames:
+			image = Image.frombuffer( "P", base.size, pixels, "raw", "P", 0, 1 )
+			image.putpalette( palette )
+			images.append( image )
+
+		durations = [ max( 1, round( duration ) ) for palette, duration in frames ]
+		if filename.lower().endswith(".png"):
+			# an APNG has a single palette for all its frames: they are saved
+			# as RGB, three times the data, so compression is kept quick
+			images = [ image.convert("RGB") for image in images ]
+			images[0].save( filename, save_all=True, append_images=images[1:], duration=durations, loop=0, compress_level=1 )
+		else:
+			# every GIF frame keeps its own palette; there is nothing to gain
+			# from optimizing it (it is the room palette), only time to lose
+			images[0].save( filename, save_all=True, append_images=images[1:], duration=durations, loop=0, optimize=False )
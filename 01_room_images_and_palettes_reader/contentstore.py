@@ -0,0 +1,132 @@
+# Content-addressed store
+#
+# Many rooms share the very same palette (CLUT) and many strips are made of
+# the very same compressed bytes (solid black ones, above all). What has been
+# computed from some data (decoded strips, encoded palette images, ...) is
+# kept here, addressed by a hash of that data (and of whatever else the result
+# depends on), so that it is computed only once.
+#
+# Entries are kept in memory up to a byte budget, the least recently used ones
+# being evicted first. With a folder, entries are also saved on disk (one file
+# per entry, <folder>/<kind>/<2 hex digits>/<hash>) and found again by the
+# next runs.
+#
+# The store counts lookups and hits for every kind of entry, so that the
+# dedup ratio (how many results have been reused instead of recomputed) can be
+# reported.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_BYTE_BUDGET = 64 << 20
+
+class ContentStore:
+	def __init__(self, byte_budget=DEFAULT_BYTE_BUDGET, folder=None):
+		self.byte_budget = byte_budget
+		self.folder = folder
+		self.entries = OrderedDict()    # (kind, key) -> bytes, least recently used first
+		self.size = 0
+		self.lock = threading.Lock()
+		self.stats = {}                 # kind -> {"lookups", "hits", "bytes_reused"}
+
+	@staticmethod
+	def key( kind, data, *params ):
+		# hash of `data` and of the parameters the result depends on
+		h = hashlib.sha1( data )
+		h.update( repr( (kind,) + params ).encode('ascii') )
+		return h.hexdigest()
+
+	def _path(self, kind, key):
+		return os.path.join( self.folder, kind, key[:2], key )
+
+	def _stats(self, kind):
+		stats = self.stats.get( kind )
+		if stats is None:
+			stats = { "lookups": 0, "hits": 0, "bytes_reused": 0 }
+			self.stats[ kind ] = stats
+		return stats
+
+	def record(self, kind, lookups, hits, bytes_reused=0):
+		# lookups answered without going through `get`
+		with self.lock:
+			stats = self._stats( kind )
+			stats["lookups"] += lookups
+			stats["hits"] += hits
+			stats["bytes_reused"] += bytes_reused
+
+	def get(self, kind, key):
+		with self.lock:
+			stats = self._stats( kind )
+			stats["lookups"] += 1
+			value = self.entries.get( (kind, key) )
+			if value is not None:
+				self.entries.move_to_end( (kind, key) )
+				stats["hits"] += 1
+				stats["bytes_reused"] += len(value)
+				return value
+
+		if self.folder is None:
+			return None
+		try:
+			with open( self._path( kind, key ), 'rb' ) as f:
+				value = f.read()
+		except OSError:
+			return None
+		self._keep( kind, key, value )
+		self.record( kind, 0, 1, len(value) )
+		return value
+
+	def put(self, kind, key, value):
+		value = bytes( value )
+		self._keep( kind, key, value )
+		if self.folder is None:
+			return
+		path = self._path( kind, key )
+		if os.path.exists( path ):
+			return
+		try:
+			os.makedirs( os.path.dirname( path ), exist_ok=True )
+			# write and rename, so that a half written entry is never found
+			tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+			with open( tmp_path, 'wb' ) as f:
+				f.write( value )
+			os.replace( tmp_path, path )
+		except OSError:
+			pass
+
+	def _keep(self, kind, key, value):
+		if len(value) > self.byte_budget:
+			return
+		with self.lock:
+			old = self.entries.pop( (kind, key), None )
+			if old is not None:
+				self.size -= len(old)
+			self.entries[ (kind, key) ] = value
+			self.size += len(value)
+			while self.size > self.byte_budget:
+				_, evicted = self.entries.popitem( last=False )
+				self.size -= len(evicted)
+
+	# stats of worker processes are merged in the main one
+	def takeStats(self):
+		with self.lock:
+			stats, self.stats = self.stats, {}
+		return stats
+
+	def mergeStats(self, stats):
+		for kind, other in stats.items():
+			self.record( kind, other["lookups"], other["hits"], other["bytes_reused"] )
+
+	def dedupReport(self):
+		# for every kind: lookups, hits, distinct entries computed and the
+		# dedup ratio (share of lookups answered by the store)
+		report = {}
+		with self.lock:
+			for kind, stats in sorted( self.stats.items() ):
+				report[ kind ] = dict( stats,
+					computed=stats["lookups"] - stats["hits"],
+					dedup_ratio=stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0,
+				)
+		return report
@@ -0,0 +1,183 @@
+# Packed dataset of decoded rooms
+#
+# A single file with the decoded background (palette indices), CLUT, TRNS
+# index and z-planes of every room, meant to be memory-mapped: every plane is
+# raw uint8 data starting at a multiple of DATASET_ALIGNMENT, so any of them
+# is an array away, without decoding or copying anything.
+#
+# header  (64 bytes, little endian)
+#   magic        : 8 bytes ("SCUMMPAK")
+#   version      : 32
+#   entry size   : 32 (64)
+#   rooms        : 32 (number of entries)
+#   alignment    : 32
+#   index offset : 64 (where the entries are, at the end of the file)
+#   (padding up to 64 bytes)
+# planes  ...
+# entries (64 bytes each, little endian, by room number)
+#   room         : 32
+#   width        : 32
+#   height       : 32
+#   transparent  : 32 signed (TRNS palette index, -1 if none)
+#   z-planes     : 32 (number of z-planes)
+#   reserved     : 32
+#   clut         : 64 (offset of the 256 x 3 uint8 CLUT, 0 if none)
+#   pixels       : 64 (offset of the height x width uint8 palette indices, 0 if none)
+#   zplanes      : 64 (offset of the z-planes x height x width uint8 masks, 0 or 1)
+#   name         : 16 bytes (room name from the index file, NUL padded)
+#
+# With NumPy, a room is read without this module too:
+#   entries = numpy.memmap( path, dtype=DATASET_ENTRY_DTYPE, mode='r', offset=index_offset, shape=(rooms,) )
+#   pixels = numpy.memmap( path, dtype=numpy.uint8, mode='r', offset=entry["pixels"], shape=(entry["height"], entry["width"]) )
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+DATASET_MAGIC = b"SCUMMPAK"
+DATASET_VERSION = 1
+DATASET_ALIGNMENT = 64
+
+HEADER = struct.Struct("<8sIIIIQ32x")
+ENTRY = struct.Struct("<IIIiII QQQ 16s")
+
+DATASET_ENTRY_DTYPE = [
+	("room", "<u4"), ("width", "<u4"), ("height", "<u4"), ("transparent", "<i4"),
+	("num_zplanes", "<u4"), ("reserved", "<u4"),
+	("clut", "<u8"), ("pixels", "<u8"), ("zplanes", "<u8"),
+	("name", "S16"),
+]
+
+DatasetEntry = namedtuple("DatasetEntry", "room width height transparent num_zplanes clut pixels zplanes name")
+
+class DatasetWriter:
+	# Rooms are appended one after the other; the entries and the header are
+	# written by `close`, and only then the file takes its name.
+	def __init__(self, path, alignment=DATASET_ALIGNMENT):
+		self.path = path
+		self.alignment = alignment
+		self.entries = {}   # room number -> DatasetEntry
+		self.tmp_path = f"{path}.{os.getpid()}.tmp"
+		self.file = open(self.tmp_path, 'wb')
+		self.file.write( bytes( HEADER.size ) )
+
+	def _align(self):
+		padding = -self.file.tell() % self.alignment
+		if padding:
+			self.file.write( bytes( padding ) )
+		return self.file.tell()
+
+	def _writePlanes(self, planes):
+		# offset of the first of the planes, written one after the other
+		if not planes:
+			return 0
+		offset = self._align()
+		for plane in planes:
+			self.file.write( plane )
+		return offset
+
+	def addRoom(self, room_number, width, height, pixels=None, clut=None, transparent_index=None, zplanes=(), name=None):
+		# `pixels` and every z-plane are width x height bytes, row by row;
+		# `clut` is 768 bytes
+		for plane in ( [pixels] if pixels is not None else [] ) + list( zplanes ):
+			if len(plane) != width * height:
+				raise ValueError(f"room {room_number}: plane of {len(plane)} bytes, {width}x{height} expected")
+		self.entries[ room_number ] = DatasetEntry(
+			room_number, width, height,
+			-1 if transparent_index is None else transparent_index,
+			len(zplanes),
+			self._writePlanes( [clut] if clut is not None else [] ),
+			self._writePlanes( [pixels] if pixels is not None else [] ),
+			self._writePlanes( zplanes ),
+			(name or "").encode('ascii', 'replace')[:16],
+		)
+
+	def close(self):
+		index_offset = self._align()
+		for room_number in sorted( self.entries ):
+			entry = self.entries[ room_number ]
+			self.file.write( ENTRY.pack( entry.room, entry.width, entry.height, entry.transparent, entry.num_zplanes, 0, entry.clut, entry.pixels, entry.zplanes, entry.name ) )
+		self.file.seek(0)
+		self.file.write( HEADER.pack( DATASET_MAGIC, DATASET_VERSION, ENTRY.size, len(self.entries), self.alignment, index_offset ) )
+		self.file.close()
+		os.replace( self.tmp_path, self.path )
+
+	def abort(self):
+		self.file.close()
+		os.remove( self.tmp_path )
+
+
+class DatasetReader:
+	# The planes of a dataset file, as memoryviews (or NumPy arrays) over the
+	# mapped file: nothing is read until it's used, nothing is copied.
+	def __init__(self, path):
+		self._file = open(path, 'rb')
+		self._mm = mmap.mmap( self._file.fileno(), 0, access=mmap.ACCESS_READ )
+		magic, version, entry_size, num_rooms, self.alignment, index_offset = HEADER.unpack_from( self._mm, 0 )
+		if magic != DATASET_MAGIC:
+			raise ValueError(f"{path} is not a dataset file")
+		if version != DATASET_VERSION or entry_size != ENTRY.size:
+			raise ValueError(f"{path}: unsupported dataset version {version}")
+		self.rooms = {}
+		for i in range(num_rooms):
+			fields = ENTRY.unpack_from( self._mm, index_offset + i * entry_size )
+			room, width, height, transparent, num_zplanes, reserved, clut, pixels, zplanes, name = fields
+			self.rooms[ room ] = DatasetEntry( room, width, height, transparent, num_zplanes, clut, pixels, zplanes, name.rstrip(b"\x00").decode('ascii', 'replace') )
+
+	def _view(self, offset, size):
+		return memoryview( self._mm )[ offset : offset + size ] if offset else None
+
+	def pixels(self, room_number):
+		entry = self.rooms[ room_number ]
+		return self._view( entry.pixels, entry.width * entry.height )
+
+	def clut(self, room_number):
+		return self._view( self.rooms[ room_number ].clut, 768 )
+
+	def zplanes(self, room_number):
+		entry = self.rooms[ room_number ]
+		size = entry.width * entry.height
+		return [ self._view( entry.zplanes + i * size, size ) for i in range( entry.num_zplanes ) ]
+
+	# NumPy arrays (views of the mapped file) **********************************
+	def _array(self, offset, shape):
+		# (NumPy is only imported here, readers of plain views don't need it)
+		try:
+			import numpy
+		except ImportError:
+			raise ImportError("NumPy is needed for dataset arrays")
+		if not offset:
+			return None
+		count = 1
+		for n in shape:
+			count *= n
+		return numpy.frombuffer( self._mm, dtype=numpy.uint8, count=count, offset=offset ).reshape( shape )
+
+	def pixelsArray(self, room_number):
+		# (height, width) palette indices
+		entry = self.rooms[ room_number ]
+		return self._array( entry.pixels, (entry.height, entry.width) )
+
+	def clutArray(self, room_number):
+		# (256, 3) RGB
+		return self._array( self.rooms[ room_number ].clut, (256, 3) )
+
+	def zplanesArray(self, room_number):
+		# (z-planes, height, width) masks
+		entry = self.rooms[ room_number ]
+		return self._array( entry.zplanes, (entry.num_zplanes, entry.height, entry.width) )
+
+	def close(self):
+		# (arrays and views still around keep the mapping alive)
+		try:
+			self._mm.close()
+		except BufferError:
+			pass
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
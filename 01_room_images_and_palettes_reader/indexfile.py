@@ -0,0 +1,187 @@
+# The index file (ATLANTIS.000)
+#
+# Next to the data file (ATLANTIS.001) every SCUMM v5 game has an index file,
+# XOR encoded in the same way, made of a few top level blocks:
+#
+# RNAM  room names, until a 0 room number:
+#         room number (byte), name (9 bytes, every byte XORed with 0xFF)
+# MAXS  sizes of the game tables (LE words): variables, unknown, bit
+#       variables, local objects, unknown, charsets, unknown, unknown,
+#       inventory objects
+# DROO  directories of rooms, scripts, sounds, costumes and charsets:
+# DSCR    number of items (LE word), then the room of every item (bytes),
+# DSOU    then the offset of every item (LE dwords). Offsets are relative to
+# DCOS    the ROOM block of that room (the same offset found in the LOFF
+# DCHR    table). For rooms, the "room" of the item is the number of the
+#         data file holding it and the room itself is found through LOFF.
+# DOBJ  every object: number of objects (LE word), then owner (low nibble) and
+#       state (high nibble) of every object (bytes), then its class data
+#       (LE dwords)
+#
+#ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Index_File
+#
+# With the directories, any script, sound, costume or charset is found by its
+# global number with a single seek, without walking the LFLF blocks.
+#
+# usage: python indexfile.py ATLANTIS.000 [ATLANTIS.001 TYPE NUMBER OUTPUT_FILE]
+
+import argparse
+from collections import namedtuple
+
+from xorfile import XorFileReader
+from blocks import walkBlocks, readBlock
+from blockindex import readLOFF
+from instrumentation import log, ERROR
+
+# directory blocks and the resource type they list
+DIRECTORIES = {
+	"DROO": "room",
+	"DSCR": "script",
+	"DSOU": "sound",
+	"DCOS": "costume",
+	"DCHR": "charset",
+}
+
+# the block found at a resource offset, for every resource type
+RESOURCE_BLOCKS = {
+	"room": "ROOM",
+	"script": "SCRP",
+	"sound": "SOUN",
+	"costume": "COST",
+	"charset": "CHAR",
+}
+
+MAXS_FIELDS = ("variables", "unknown1", "bit_variables", "local_objects", "unknown2", "charsets", "unknown3", "unknown4", "inventory_objects")
+
+ROOM_NAME_LENGTH = 9
+
+# owner (actor number, 0x0F for "in the room") and state of an object
+GameObject = namedtuple("GameObject", "owner state class_data")
+
+class IndexFile:
+	def __init__(self):
+		self.room_names = {}    # room number -> name
+		self.maxs = {}
+		self.directories = {}   # resource type -> [(room number, offset)], by resource number
+		self.objects = []       # GameObject, by object number
+
+	def location(self, resource_type, number):
+		# (room number, offset from the ROOM block) of a resource, None if
+		# there's no such resource
+		directory = self.directories.get( resource_type, [] )
+		if not 0 <= number < len(directory):
+			return None
+		room_number, offset = directory[ number ]
+		if resource_type == "room":
+			# (the data file number, 0 if there's no such room)
+			return (number, 0) if room_number else None
+		if room_number == 0 and offset == 0:
+			return None
+		return room_number, offset
+
+	def count(self, resource_type):
+		return len( self.directories.get( resource_type, [] ) )
+
+	def toDict(self):
+		return {
+			"room_names": self.room_names,
+			"maxs": self.maxs,
+			"directories": { resource_type: [ list(entry) for entry in directory ] for resource_type, directory in self.directories.items() },
+			"objects": [ list(game_object) for game_object in self.objects ],
+		}
+
+
+# PARSING **********************************************************************
+def parseRNAM( data ):
+	room_names = {}
+	position = 0
+	while position < len(data) and data[ position ] != 0:
+		name = bytes( b ^ 0xFF for b in data[ position + 1 : position + 1 + ROOM_NAME_LENGTH ] )
+		room_names[ data[ position ] ] = name.split(b"\x00")[0].decode('ascii', 'replace')
+		position += 1 + ROOM_NAME_LENGTH
+	return room_names
+
+def parseMAXS( data ):
+	values = [ int.from_bytes( data[ 2*i : 2*i + 2 ], 'little' ) for i in range( len(data) // 2 ) ]
+	return dict( zip( MAXS_FIELDS, values ) )
+
+def parseDirectory( data ):
+	num_items = int.from_bytes( data[0:2], 'little' )
+	rooms = data[ 2 : 2 + num_items ]
+	offsets = data[ 2 + num_items : 2 + 5 * num_items ]
+	return [ (rooms[i], int.from_bytes( offsets[ 4*i : 4*i + 4 ], 'little' )) for i in range(num_items) ]
+
+def parseDOBJ( data ):
+	num_objects = int.from_bytes( data[0:2], 'little' )
+	owners = data[ 2 : 2 + num_objects ]
+	classes = data[ 2 + num_objects : 2 + 5 * num_objects ]
+	return [ GameObject( owners[i] & 0x0F, owners[i] >> 4, int.from_bytes( classes[ 4*i : 4*i + 4 ], 'little' ) ) for i in range(num_objects) ]
+
+def readIndexFile( file_path, xor_key=0x69 ):
+	index = IndexFile()
+	with XorFileReader( file_path, xor_key ) as file:
+		file.seek(0, 2)
+		for block in walkBlocks( file, 0, file.tell() ):
+			data = block.payload
+			if block.name == "RNAM":
+				index.room_names = parseRNAM( data )
+			elif block.name == "MAXS":
+				index.maxs = parseMAXS( data )
+			elif block.name in DIRECTORIES:
+				index.directories[ DIRECTORIES[ block.name ] ] = parseDirectory( data )
+			elif block.name == "DOBJ":
+				index.objects = parseDOBJ( data )
+	return index
+
+
+# LOOKUP ***********************************************************************
+def roomOffsets( file ):
+	# room number -> absolute offset of its ROOM block, from the LOFF table of
+	# the data file (LECF > LOFF, right at the beginning)
+	loff = readBlock( file, 8 )
+	if loff.name != "LOFF":
+		raise ValueError(f"LOFF block expected at offset 8, found {loff.name!r}")
+	return { room_number: offset for room_number, offset in readLOFF( file, loff.offset ) }
+
+def findResource( file, index, room_offsets, resource_type, number ):
+	# the block (see blocks.py) of a resource of the data file, found with a
+	# single seek; None if there's no such resource
+	location = index.location( resource_type, number )
+	if location is None:
+		return None
+	room_number, offset = location
+	room_offset = room_offsets.get( room_number )
+	if room_offset is None:
+		return None
+	block = readBlock( file, room_offset + offset )
+	if block.name != RESOURCE_BLOCKS[ resource_type ]:
+		log( ERROR, f"{resource_type} {number}: {RESOURCE_BLOCKS[ resource_type ]} block expected at offset {block.offset}, found {block.name!r}" )
+		return None
+	return block
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description="Print the content of a SCUMM v5 index file, or save a resource found through it" )
+	parser.add_argument( "index_file", help="index file (e.g. ATLANTIS.000)" )
+	parser.add_argument( "resource", nargs="*", metavar="DATA_FILE TYPE NUMBER OUTPUT_FILE", help="save a resource (room, script, sound, costume or charset) of the data file" )
+	args = parser.parse_args()
+
+	index = readIndexFile( args.index_file )
+	if not args.resource:
+		for room_number, name in sorted( index.room_names.items() ):
+			print(f"room {room_number:3}: {name}")
+		print( ", ".join( f"{key} {value}" for key, value in index.maxs.items() ) )
+		for resource_type, directory in index.directories.items():
+			print(f"{resource_type}s: {len(directory)}")
+		print(f"objects: {len(index.objects)}")
+	elif len(args.resource) != 4 or args.resource[1] not in RESOURCE_BLOCKS:
+		parser.error("expected DATA_FILE TYPE NUMBER OUTPUT_FILE, TYPE being one of " + ", ".join( RESOURCE_BLOCKS ))
+	else:
+		data_file, resource_type, number, output_file = args.resource
+		with XorFileReader( data_file ) as file:
+			block = findResource( file, index, roomOffsets( file ), resource_type, int( number ) )
+			if block is None:
+				raise SystemExit(f"no {resource_type} {number}")
+			with open(output_file, 'wb') as f:
+				f.write( file.view( block.offset, block.size ) )
+			print(f"{resource_type} {number}: {block.size} bytes at offset {block.offset} saved to {output_file}")
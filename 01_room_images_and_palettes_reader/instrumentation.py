@@ -0,0 +1,217 @@
+# Logging and profiling
+#
+# Messages have a level: errors are always printed, the others only up to the
+# chosen `log_level`. Messages printed for every strip (or more often) must be
+# guarded with `enabled(...)`, so that not even the message is built when
+# they are not going to be printed.
+#
+# The profiler is off unless `startProfiling` has been called: `profiler` is
+# None and `phase(...)` hands back a shared do-nothing context manager, so
+# the extractor doesn't pay for it. When it is on, it collects:
+# * the time spent in every phase (XOR decoding, block walking, CLUT parsing,
+#   strip decoding for every codec, image saving), overall and per room;
+# * per room counters: bits read, pixels written, bytes skipped, strips
+#   found in the strip cache;
+# * per codec counters: strips, pixels, bits read, time.
+# Phases may be nested (e.g. XOR decoding happens while walking blocks): the
+# time of a phase includes the time of the phases inside it.
+
+import csv
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+ERROR = 0
+INFO  = 1   # one line per room
+DEBUG = 2   # one line per block
+TRACE = 3   # one line per strip
+
+log_level = INFO
+
+def setLogLevel( level ):
+	global log_level
+	log_level = max( ERROR, min( TRACE, level ) )
+
+def enabled( level ):
+	return log_level >= level
+
+def log( level, message ):
+	if log_level >= level:
+		print( message )
+
+
+# PROFILER *********************************************************************
+profiler = None
+
+_NO_PHASE = nullcontext()
+
+def phase( name, room_number=None ):
+	# with phase("clut", room_number): ...
+	if profiler is None:
+		return _NO_PHASE
+	return profiler.phase( name, room_number )
+
+def count( room_number, counter, value ):
+	if profiler is not None:
+		profiler.count( room_number, counter, value )
+
+
+class _Phase:
+	__slots__ = ("profiler", "name", "room_number", "start")
+
+	def __init__(self, profiler, name, room_number):
+		self.profiler = profiler
+		self.name = name
+		self.room_number = room_number
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.profiler.addTime( self.name, time.perf_counter() - self.start, self.room_number )
+		return False
+
+
+class Profiler:
+	def __init__(self):
+		# images are saved by background threads
+		self.lock = threading.Lock()
+		self.phases = {}    # name -> [seconds, calls]
+		self.rooms = {}     # room number -> {"seconds": ..., "phases": {...}, counters...}
+		self.codecs = {}    # codec name -> {"strips", "pixels", "bits_read", "seconds"}
+
+	def phase(self, name, room_number=None):
+		return _Phase( self, name, room_number )
+
+	def _room(self, room_number):
+		room = self.rooms.get( room_number )
+		if room is None:
+			room = { "seconds": 0.0, "bits_read": 0, "pixels_written": 0, "bytes_skipped": 0, "strips": 0, "strip_cache_hits": 0, "phases": {} }
+			self.rooms[ room_number ] = room
+		return room
+
+	def addTime(self, name, seconds, room_number=None):
+		with self.lock:
+			total = self.phases.setdefault( name, [0.0, 0] )
+			total[0] += seconds
+			total[1] += 1
+			if room_number is not None:
+				room = self._room( room_number )
+				if name == "room":
+					room["seconds"] += seconds
+				else:
+					room["phases"][ name ] = room["phases"].get( name, 0.0 ) + seconds
+
+	def count(self, room_number, counter, value):
+		with self.lock:
+			self._room( room_number )[ counter ] += value
+
+	def addStrip(self, room_number, codec, pixels, bits_read, seconds):
+		with self.lock:
+			stats = self.codecs.get( codec )
+			if stats is None:
+				stats = { "strips": 0, "pixels": 0, "bits_read": 0, "seconds": 0.0 }
+				self.codecs[ codec ] = stats
+			stats["strips"] += 1
+			stats["pixels"] += pixels
+			stats["bits_read"] += bits_read
+			stats["seconds"] += seconds
+
+			room = self._room( room_number )
+			room["strips"] += 1
+			room["pixels_written"] += pixels
+			room["bits_read"] += bits_read
+			phase_name = f"decode_{codec}"
+			room["phases"][ phase_name ] = room["phases"].get( phase_name, 0.0 ) + seconds
+			total = self.phases.setdefault( phase_name, [0.0, 0] )
+			total[0] += seconds
+			total[1] += 1
+
+	# profiles collected by worker processes are merged in the main one
+	def toDict(self):
+		with self.lock:
+			return { "phases": self.phases, "rooms": self.rooms, "codecs": self.codecs }
+
+	def merge(self, data):
+		with self.lock:
+			for name, (seconds, calls) in data["phases"].items():
+				total = self.phases.setdefault( name, [0.0, 0] )
+				total[0] += seconds
+				total[1] += calls
+			for room_number, other in data["rooms"].items():
+				room = self._room( room_number )
+				for key, value in other.items():
+					if key == "phases":
+						for name, seconds in value.items():
+							room["phases"][ name ] = room["phases"].get( name, 0.0 ) + seconds
+					else:
+						room[ key ] += value
+			for codec, other in data["codecs"].items():
+				stats = self.codecs.setdefault( codec, { "strips": 0, "pixels": 0, "bits_read": 0, "seconds": 0.0 } )
+				for key, value in other.items():
+					stats[ key ] += value
+
+	# REPORT ***************************************************************
+	def report(self, total_seconds=None, extra=None):
+		# rooms and codecs are sorted slowest first, `extra` sections
+		# (e.g. the dedup ratios of the content store) are added as they are
+		rooms = [ dict( room=room_number, **room ) for room_number, room in self.rooms.items() ]
+		rooms.sort( key=lambda room: room["seconds"], reverse=True )
+		codecs = []
+		for codec, stats in self.codecs.items():
+			px_s = stats["pixels"] / stats["seconds"] if stats["seconds"] else 0.0
+			codecs.append( dict( codec=codec, pixels_per_second=px_s, **stats ) )
+		codecs.sort( key=lambda codec: codec["seconds"], reverse=True )
+		report = {
+			"total_seconds": total_seconds,
+			"phases": { name: { "seconds": seconds, "calls": calls } for name, (seconds, calls) in sorted( self.phases.items(), key=lambda item: -item[1][0] ) },
+			"rooms": rooms,
+			"codecs": codecs,
+		}
+		report.update( extra or {} )
+		return report
+
+	def save(self, path, total_seconds=None, extra=None):
+		# JSON, or CSV if `path` ends with .csv (one row per phase, room,
+		# codec and, if any, content store kind)
+		report = self.report( total_seconds, extra )
+		if not path.lower().endswith(".csv"):
+			with open(path, 'w') as f:
+				json.dump( report, f, indent=1 )
+			return report
+
+		columns = ["kind", "name", "seconds", "calls", "strips", "pixels", "bits_read", "bytes_skipped", "pixels_per_second", "lookups", "hits", "dedup_ratio"]
+		with open(path, 'w', newline='') as f:
+			writer = csv.DictWriter( f, columns, extrasaction='ignore' )
+			writer.writeheader()
+			for name, stats in report["phases"].items():
+				writer.writerow( dict( kind="phase", name=name, **stats ) )
+			for room in report["rooms"]:
+				writer.writerow( dict( kind="room", name=room["room"], seconds=room["seconds"], strips=room["strips"], pixels=room["pixels_written"], bits_read=room["bits_read"], bytes_skipped=room["bytes_skipped"] ) )
+			for codec in report["codecs"]:
+				writer.writerow( dict( kind="codec", name=codec["codec"], **{ key: codec[key] for key in ("seconds", "strips", "pixels", "bits_read", "pixels_per_second") } ) )
+			for name, stats in report.get( "dedup", {} ).items():
+				writer.writerow( dict( kind="dedup", name=name, **stats ) )
+		return report
+
+	def printSummary(self, top=5):
+		report = self.report()
+		print("slowest rooms:")
+		for room in report["rooms"][:top]:
+			print(f"  room {room['room']:>3}: {room['seconds']*1000:8.1f} ms, {room['strips']} strips, {room['pixels_written']} pixels, {room['bits_read']} bits read, {room['bytes_skipped']} bytes skipped")
+		print("slowest codecs:")
+		for codec in report["codecs"][:top]:
+			print(f"  {codec['codec']:<20} {codec['seconds']*1000:8.1f} ms, {codec['strips']} strips, {codec['pixels_per_second']:,.0f} px/s")
+
+
+def startProfiling():
+	global profiler
+	profiler = Profiler()
+	return profiler
+
+def stopProfiling():
+	global profiler
+	stopped, profiler = profiler, None
+	return stopped
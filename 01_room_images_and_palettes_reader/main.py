@@ -5,11 +5,47 @@
 
 # ref: a tool to extract all of LucasArts game resources is LucasRipper (downloadable from here: https://web.archive.org/web/20081222140420/http://scumm.mixnmojo.com/?page=downloads)
 
-from io import BytesIO
+import argparse
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import instrumentation
+from instrumentation import log, enabled, phase, ERROR, INFO, DEBUG, TRACE
+
+from xorfile import XorFileReader, xorTable
+from blockindex import loadOrBuildIndex
+from blocks import walkBlocks, readBlock, readView
+from outputpipeline import OutputPipeline, BatchWriter, saveImage, encodeImage, writeBytes
+from contentstore import ContentStore
+from manifest import ExtractionManifest, MANIFEST_FILENAME, hashRoom, hashBlocks
+from smap import DECODER_VERSION, getDecoderSettings, decodeStrips, stripSlices, shutdownStripPool, decodeRegion, decodePreview
+from zplane import ZPLANE_DECODER_VERSION, decodeZPlane, zplaneImage, zplanePixels
+from colorcycle import parseCycles, activeCycles, cycleFrames, saveCycleAnimation
+from sound import soundBlocks, soundFiles
+from indexfile import readIndexFile
+from streaming import streamRooms, writePNGRows
+from dataset import DatasetWriter
+from scan import scanFile, saveCatalogue, roomBackgroundBlock
+
+# Everything below is only the default of the command line (see --help) or
+# of `extract` when used as a library.
 
 # I'm actually placing my game files in the parent folder
-FILE_001 = "ATLANTIS.001"
+FILE_001 = os.path.join("..", "ATLANTIS.001")
+
+# every byte of the resource files is XORed with this key (0x69 for FOA and
+# the other SCUMM v5 games)
+XOR_KEY = 0x69
+
+# room names are read from the index file (ATLANTIS.000, next to the data
+# file, see indexfile.py) and added to the name of every output file
+ROOM_NAMES_IN_FILENAMES = True
+
+# image files (palettes, backgrounds, objects, z-planes) are saved in this
+# format: "png", "gif", "bmp" or "tiff"
+IMAGE_FORMAT = "png"
 
 PALETTE_FOLDER = "palettes"
 SAVE_PALLETES  = True
@@ -19,6 +55,78 @@ BACKGROUND_IMAGES_FOLDER = "backgrounds"
 SAVE_BACKGROUND_IMAGE = True
 BACKGROUND_IMAGE_SCALE_FACTOR = 2
 
+# object images (every state of every object in the room), saved with the
+# room palette and its transparent color
+OBJECT_IMAGES_FOLDER = "objects"
+SAVE_OBJECT_IMAGES = False
+OBJECT_IMAGE_SCALE_FACTOR = 2
+
+# rooms with color cycling (water, fire, lights...) are saved as animations
+# too, as GIF ("gif") or APNG ("png"), with at most that many frames
+CYCLE_ANIMATIONS_FOLDER = "cycles"
+SAVE_CYCLE_ANIMATIONS = False
+CYCLE_ANIMATION_FORMAT = "gif"
+CYCLE_ANIMATION_SCALE_FACTOR = 2
+CYCLE_MAX_FRAMES = 60
+
+# the music blocks of every SOUN block (ROL, ADL, SPK, SBL) are saved as they
+# are and, with SOUND_WRAPPERS, as standard files too (MIDI, VOC and WAV)
+SOUNDS_FOLDER = "sounds"
+SAVE_SOUNDS = False
+SOUND_WRAPPERS = True
+
+# z-plane masks are decoded and saved as 1 bit images
+ZPLANES_FOLDER = "zplanes"
+SAVE_ZPLANES = False
+ZPLANE_IMAGE_SCALE_FACTOR = 2
+
+# the resource file is read once, from start to end, a room at a time (see
+# streaming.py): memory doesn't depend on the size of the file, and it can be
+# a pipe ("-" for stdin). There's no block index, no incremental extraction
+# and no worker processes in this mode.
+STREAMING = False
+
+# backgrounds, palettes, transparent colors and z-planes of all the rooms are
+# also packed in a single file, ready to be memory-mapped (see dataset.py).
+# The file is written again as a whole on every run, by this process only.
+DATASET_FILENAME = "rooms.scummpak"
+SAVE_DATASET = False
+
+# number of worker processes extracting rooms in parallel
+# (1 means everything is done in this process, 0 means one per CPU)
+EXTRACTION_WORKERS = 1
+
+# number of worker processes decoding the strips of very wide rooms
+# (only used when rooms are extracted one at a time, 0 means one per CPU)
+STRIP_WORKERS = 1
+
+# number of threads scaling, encoding and writing images in the background,
+# and how many images may be waiting for them before decoding has to wait
+# (0 threads means every image is saved right away)
+OUTPUT_WORKERS = 2
+OUTPUT_QUEUE_SIZE = 8
+
+# skip rooms (and single outputs) whose data and settings didn't change since
+# the last run (see manifest.py)
+INCREMENTAL_EXTRACTION = True
+
+# decoded strips and encoded palette images are kept (up to this many bytes,
+# 0 to disable) and reused for every strip or palette made of the same bytes;
+# with a folder, they are also kept on disk for the next runs
+CONTENT_STORE_BUDGET = 64 << 20
+CONTENT_STORE_FOLDER = None    # e.g. ".content_store"
+
+# how much is printed: ERROR (errors only), INFO (one line per room),
+# DEBUG (one line per block) or TRACE (one line per strip)
+LOG_LEVEL = INFO
+
+# where `--profile` writes its report (JSON, or CSV if the name ends with .csv)
+PROFILE_REPORT = "profile_report.json"
+
+# where `--scan` writes the catalogue of the rooms (JSON, or CSV if the name
+# ends with .csv, see scan.py)
+SCAN_CATALOGUE = "room_catalogue.json"
+
 # don't touch below ************************************************************
 def intToHex( value, num_bytes=1):
 	return f"{value.to_bytes(num_bytes, byteorder='big').hex().upper()}"
@@ -29,7 +137,8 @@ def xor(file_path, xor_key=0x69):
 		with open(file_path, 'rb') as file:
 			content = file.read()
 		# Decode all the file content xoringit with 0x69
-		decoded = bytes([b ^ xor_key for b in content])
+		# (a single translate call using a 256-entry lookup table)
+		decoded = content.translate( xorTable( xor_key ) )
 		return decoded
 	except FileNotFoundError:
 		print(f"File {file_path} not found.")
@@ -49,190 +158,331 @@ def readBlockHeader(file, byteOrder='big'):
 	return block_name, block_size
 
 # ******************************************************************************
-from PIL import Image
-def drawCLUT( filename, COLOR_LIST, width, height, scale_factor):
-	image = Image.new("RGB", (width, height), "black")  # Default to black background
-	# Load the pixel map
-	pixels = image.load()
-	# Set pixel colors
-	for y in range(height):
-		for x in range(width):
-			index = x + (y*width)
-			pixels[x, y] = COLOR_LIST[ index ]
-
-	# Calculate new dimensions
-	new_width = image.width * scale_factor
-	new_height = image.height * scale_factor
-
-	# Resize using nearest neighbor (no antialiasing)
-	scaled_image = image.resize((new_width, new_height), Image.NEAREST)
-
-	# Save and show the scaled image
-	scaled_image.save( filename )
-	#scaled_image.show()
-
-
-"""
-#ref: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
-# IMAGE COMPRESSION TABLE ******************************************************
-IDs 			Method 			Rendering Direction 	Transparent 	Param Subtraction 	Remarks
-0x01 			Uncompressed 	Horizontal 				No 				-			 		-
-0x0E .. 0x12 	1st method 		Vertical 				No 				0x0A			 	-
-0x18 .. 0x1C 	1st method 		Horizontal 				No 				0x14			 	-
-0x22 .. 0x26 	1st method 		Vertical 				Yes 			0x1E			 	-
-0x2C .. 0x30 	1st method 		Horizontal 				Yes 			0x28			 	-
-0x40 .. 0x44 	2nd method 		Horizontal 				No 				0x3C			 	-
-0x54 .. 0x58 	2nd method 		Horizontal 				Yes 			0x51			 	-
-0x68 .. 0x6C 	2nd method 		Horizontal 				Yes 			0x64			 	Same as 0x54 .. 0x58
-0x7C .. 0x80 	2nd method 		Horizontal 				No 				0x78			 	Same as 0x40 .. 0x44
-
-"""
-def getDecoderSettings( compressionId ):
-	method    = None
-	direction = None
-	transparent = None
-	parSub = None
-
-	if compressionId == 0x01:
-		method      = "Uncompressed"
-		direction   = "Horizontal"
-		transparent = "No"
-		parSub      = 0
-	elif compressionId >= 0x0E and compressionId <= 0x12:
-		method      = "1st"
-		direction   = "Vertical"
-		transparent = "No"
-		parSub      = 0x0A
-	elif compressionId >= 0x18 and compressionId <= 0x1C:
-		method      = "1st"
-		direction   = "Horizontal"
-		transparent = "No"
-		parSub      = 0x14
-	elif compressionId >= 0x22 and compressionId <= 0x26:
-		method      = "1st"
-		direction   = "Vertical"
-		transparent = "Yes"
-		parSub      = 0x1E
-	elif compressionId >= 0x2C and compressionId <= 0x30:
-		method      = "1st"
-		direction   = "Horizontal"
-		transparent = "Yes"
-		parSub      = 0x28
-	elif compressionId >= 0x40 and compressionId <= 0x44:
-		method      = "2nd"
-		direction   = "Horizontal"
-		transparent = "No"
-		parSub      = 0x3C
-	elif compressionId >= 0x54 and compressionId <= 0x58:
-		method      = "2nd"
-		direction   = "Horizontal"
-		transparent = "Yes"
-		parSub      = 0x51
-	elif compressionId >= 0x68 and compressionId <= 0x6C:
-		method      = "2nd"
-		direction   = "Horizontal"
-		transparent = "Yes"
-		parSub      = 0x64
-	elif compressionId >= 0x7C and compressionId <= 0x80:
-		method      = "2nd"
-		direction   = "Horizontal"
-		transparent = "No"
-		parSub      = 0x78
-
-	return (method,direction,transparent,parSub)
-
-
-class BitReaderLSB:
-	def __init__(self, byte_stream):
-
-		self.stream = byte_stream
-		self.current_byte = 0           # Byte actually beeing read
-		self.bit_position = 8           # bit position (8 means load a new byte)
-
-	def read_bit(self):
-		if self.bit_position == 8:      # if all the bit of the current byte have been read
-			byte = self.stream.read(1)  # Read the next byte
-			if not byte:                # if we don't have no more availalbe bytes
-				raise EOFError("End of stream")
-			self.current_byte = ord(byte)  # get the byte as integer
-			self.bit_position = 0          # Reset bit position
-
-		# Extract current least significative bit
-		bit = (self.current_byte >> self.bit_position) & 1
-		#print(f"read bit {bit}")
-		self.bit_position += 1
-		return bit
-
-	def read_bits(self, n):
-		# read n bit and return them as an integer
-		# with the last bit read ad LSB.
-		value = 0
-		for i in range(n):
-			bit = self.read_bit()
-			# Place every bit which has been read in the correct position (last bis as LSB)
-			value |= (bit << i)
-		return value
+# (PIL is only imported where images are made, so that the scan of a file,
+# see scan.py, doesn't have to load it)
+
+# images are scaled, encoded and written by a pool of background threads
+# when an output pipeline is active (see the main section)
+output_pipeline = None
+
+# decoded strips and palette images, by content (see contentstore.py)
+content_store = None
+
+# sounds are small files, written in batches (see BatchWriter)
+sound_writer = None
+
+# room number -> name, from the index file (see extract)
+room_names = {}
+
+# PNG images are written one row at a time (see streaming.py)
+stream_images = False
+
+# the packed dataset being written (see dataset.py)
+dataset_writer = None
+
+def outputImage( filename, image, scale_factor ):
+	if output_pipeline is not None:
+		output_pipeline.submit( filename, image, scale_factor )
+	else:
+		saveImage( filename, image, scale_factor )
+
+def outputTask( function, filename, *args ):
+	# any other way of writing a file: function(filename, *args)
+	if output_pipeline is not None:
+		output_pipeline.submitTask( function, filename, *args )
+	else:
+		function( filename, *args )
+
+def outputBytes( filename, data ):
+	# an already encoded image
+	if output_pipeline is not None:
+		output_pipeline.submitBytes( filename, data )
+	else:
+		writeBytes( filename, data )
+
+def outputBuffers( filename, buffers ):
+	# a file made of a list of buffers, written without joining them
+	global sound_writer
+	if sound_writer is None:
+		sound_writer = BatchWriter( output_pipeline )
+	sound_writer.write( filename, buffers )
+
+def makeContentStore( folder ):
+	if CONTENT_STORE_BUDGET <= 0:
+		return None
+	return ContentStore( CONTENT_STORE_BUDGET, folder )
+
+def paletteBytes( COLOR_LIST ):
+	# flat [r,g,b, r,g,b, ...] list, as expected by `Image.putpalette`
+	return bytes( component for color in COLOR_LIST for component in color )
+
+def drawCLUT( filename, COLOR_LIST, width, height, scale_factor, image_format="png" ):
+	# every pixel of the palette image is simply the palette index x + (y*width)
+	palette = paletteBytes( COLOR_LIST )
+
+	# rooms sharing the same palette share the same PNG file content: it is
+	# encoded once, then just written
+	key = None
+	if content_store is not None:
+		key = content_store.key( "palette_png", palette, width, height, scale_factor, image_format )
+		data = content_store.get( "palette_png", key )
+		if data is not None:
+			outputBytes( filename, data )
+			return
+
+	from PIL import Image
+	image = Image.frombytes("P", (width, height), bytes( range( width*height ) ))
+	image.putpalette( palette )
+
+	if key is None:
+		# Scale (nearest neighbor) and save the image
+		outputImage( filename, image, scale_factor )
+		return
+	data = encodeImage( image, scale_factor, image_format )
+	content_store.put( "palette_png", key, data )
+	outputBytes( filename, data )
+
 
 class StripeImageWriter:
+	# The image is kept as a flat buffer of palette indices (row by row) and
+	# it is saved as a palettized ("P" mode) image, with the room color
+	# palette inside.
 	def __init__(self, w, h):
 		self.width = w
 		self.height = h
-		# strip offset is a variable to keep track of the
-		# horizontal position of the current stripe
-		self.stripOffset = 0
-		# x is always moving between 0 and 7 (8 pixels)
-		self.x = 0
-		# y is moving between 0 and height
-		self.y = 0
-		self.color = None
-		self.image = Image.new("RGB", (self.width, self.height), "black")  # Default to black background
-		# Load the pixel map
-		self.pixels = self.image.load()
-		self.pixelPerStripDrawn = 0
-
-	def write_pixel(self, stripeID, color, number, direction):
-		self.color = color
-		counter = 0
-
-		while counter < number:
-			#print(f"strip {stripeID}, drawing pixel at position {self.stripOffset+self.x}x{self.y}")
-			# first draw the current colore to the corrent x, y position
-			self.pixels[ self.stripOffset+self.x, self.y] = self.color
-
-			# then move the pixel position (taking care of wrapping accordingly to the directions)
-			self.pixelPerStripDrawn += 1
-			#print(f"strip {stripeID}, Drawn {self.pixelPerStripDrawn} in current strip")
-			counter += 1
-			if direction == "Horizontal":
-				self.y = int(self.pixelPerStripDrawn / 8)
-				self.x = self.pixelPerStripDrawn % 8
-				#print(f"strip {stripeID}, horizontal movement: changing pen position to {self.stripOffset+self.x}x{self.y}")
-			else:
-				# vertical
-				self.x = int(self.pixelPerStripDrawn / self.height)
-				self.y = self.pixelPerStripDrawn % self.height
-				#print(f"strip {stripeID}, Vertical movement: changing pen position to {self.stripOffset+self.x}x{self.y}")
-
-	def moveToNextStrip(self):
-		#print("\nmoving to next Strip")
-		self.pixelPerStripDrawn = 0
-		self.stripOffset += 8
-		self.x = 0
-		self.y = 0
+		self.indices = bytearray( w * h )
+		self.palette = None
+		self.transparent_index = None
+
+	def write_strip(self, stripeID, indices):
+		# copy the 8 x height block of palette indices of a decoded strip
+		# (row by row) at the horizontal position of the strip
+		x = stripeID * 8
+		if x + 8 > self.width:
+			return
+		frame = memoryview( self.indices )
+		strip = memoryview( indices )
+		width = self.width
+		for y in range(self.height):
+			frame[ y*width + x : y*width + x + 8 ] = strip[ y*8 : y*8 + 8 ]
+
+	def set_palette(self, COLOR_LIST):
+		self.palette = paletteBytes( COLOR_LIST )
+
+	def set_transparency(self, transparent_index):
+		# pixels with this palette index are saved as transparent
+		self.transparent_index = transparent_index
+
+	def get_image(self):
+		from PIL import Image
+		image = Image.frombytes("P", (self.width, self.height), bytes( self.indices ))
+		if self.palette is not None:
+			image.putpalette( self.palette )
+		if self.transparent_index is not None:
+			image.info["transparency"] = self.transparent_index
+		return image
 
 	def save(self, filename, SCALE_FACTOR):
-		# Calculate new dimensions
-		new_width = self.image.width * SCALE_FACTOR
-		new_height = self.image.height * SCALE_FACTOR
-
-		# Resize using nearest neighbor (no antialiasing)
-		self.scaled_image = self.image.resize((new_width, new_height), Image.NEAREST)
-		self.scaled_image.save( filename )
-
-
-def readRoomData(file, size, room_number, room_abs_offset, current_dir):
-	counter = 0
-	print( f"Reading room data for room number {room_number}, abs offset {room_abs_offset} - expected size is {size}" )
+		if stream_images and filename.lower().endswith(".png"):
+			outputTask( writePNGRows, filename, self.indices, self.width, self.height, self.palette, self.transparent_index, SCALE_FACTOR )
+			return
+		outputImage( filename, self.get_image(), SCALE_FACTOR )
+
+
+# OUTPUTS **********************************************************************
+# Every output (palette, background, ...) comes with its settings (folder,
+# scale factor, format, ...): `outputs` maps the outputs to produce to their
+# settings, and the name of every file follows from them.
+OUTPUT_TYPES = ("palette", "background", "objects", "cycles", "sounds", "zplanes", "dataset")
+
+# the outputs which need the room palette
+PALETTE_OUTPUTS = {"palette", "background", "objects", "cycles", "dataset"}
+
+IMAGE_FORMATS = ("png", "gif", "bmp", "tiff")
+
+def roomLabel( room_number ):
+	# "room12", or "room12_beach" when the name of the room is known
+	name = room_names.get( room_number )
+	if not name:
+		return f"room{room_number}"
+	name = "".join( c if c.isalnum() or c in "-_" else "_" for c in name )
+	return f"room{room_number}_{name}"
+
+def outputFilename( output_dir, settings, name ):
+	return os.path.join( output_dir, settings["folder"], name )
+
+def paletteFilename( output_dir, settings, room_number, room_abs_offset ):
+	return outputFilename( output_dir, settings, f"{roomLabel( room_number )}_off{room_abs_offset}.{settings['format']}" )
+
+def backgroundFilename( output_dir, settings, room_number, room_abs_offset ):
+	return outputFilename( output_dir, settings, f"{roomLabel( room_number )}_off{room_abs_offset}.{settings['format']}" )
+
+def cycleAnimationFilename( output_dir, settings, room_number, room_abs_offset ):
+	return outputFilename( output_dir, settings, f"{roomLabel( room_number )}_off{room_abs_offset}.{settings['format']}" )
+
+def soundFilename( output_dir, settings, room_number, soun_number, block_name, extension ):
+	# SOUN blocks are numbered in the order they are found in the LFLF block
+	return outputFilename( output_dir, settings, f"{roomLabel( room_number )}_soun{soun_number:03d}_{block_name}.{extension}" )
+
+def objectImageFilename( output_dir, settings, room_number, room_abs_offset, obim_number, image_number ):
+	# objects are numbered in the order their OBIM blocks are found in the room
+	return outputFilename( output_dir, settings, f"{roomLabel( room_number )}_off{room_abs_offset}_obj{obim_number:03d}_im{image_number:02d}.{settings['format']}" )
+
+def zplaneFilename( output_dir, settings, room_number, room_abs_offset, zplane_number ):
+	return outputFilename( output_dir, settings, f"{roomLabel( room_number )}_off{room_abs_offset}_zp{zplane_number:02d}.{settings['format']}" )
+
+def defaultOutputs():
+	# the outputs enabled by the SAVE_... constants
+	enabled_outputs = {
+		"palette": SAVE_PALLETES,
+		"background": SAVE_BACKGROUND_IMAGE,
+		"objects": SAVE_OBJECT_IMAGES,
+		"cycles": SAVE_CYCLE_ANIMATIONS,
+		"sounds": SAVE_SOUNDS,
+		"zplanes": SAVE_ZPLANES,
+		"dataset": SAVE_DATASET,
+	}
+	return [ output for output in OUTPUT_TYPES if enabled_outputs[ output ] ]
+
+def outputSettings( outputs=None, scale=None, palette_scale=None, image_format=None, cycle_format=None, sound_wrappers=None ):
+	# the outputs to produce (the default ones if None), and what each of
+	# them depends on besides the room data itself (used to tell if an output
+	# has to be produced again). Settings left to None get their default.
+	if outputs is None:
+		outputs = defaultOutputs()
+	image_format = image_format or IMAGE_FORMAT
+	settings = {}
+	if "palette" in outputs:
+		settings["palette"] = { "folder": PALETTE_FOLDER, "scale": palette_scale or PALETTE_IMAGE_SCALE_FACTOR, "format": image_format }
+	if "background" in outputs:
+		settings["background"] = { "folder": BACKGROUND_IMAGES_FOLDER, "scale": scale or BACKGROUND_IMAGE_SCALE_FACTOR, "format": image_format, "decoder": DECODER_VERSION }
+	if "objects" in outputs:
+		settings["objects"] = { "folder": OBJECT_IMAGES_FOLDER, "scale": scale or OBJECT_IMAGE_SCALE_FACTOR, "format": image_format, "decoder": DECODER_VERSION }
+	if "cycles" in outputs:
+		settings["cycles"] = { "folder": CYCLE_ANIMATIONS_FOLDER, "format": cycle_format or CYCLE_ANIMATION_FORMAT, "scale": scale or CYCLE_ANIMATION_SCALE_FACTOR, "frames": CYCLE_MAX_FRAMES, "decoder": DECODER_VERSION }
+	if "sounds" in outputs:
+		settings["sounds"] = { "folder": SOUNDS_FOLDER, "wrappers": SOUND_WRAPPERS if sound_wrappers is None else sound_wrappers }
+	if "zplanes" in outputs:
+		settings["zplanes"] = { "folder": ZPLANES_FOLDER, "scale": scale or ZPLANE_IMAGE_SCALE_FACTOR, "format": image_format, "decoder": ZPLANE_DECODER_VERSION }
+	if "dataset" in outputs:
+		# a single file, right in the output folder
+		settings["dataset"] = { "folder": "", "file": DATASET_FILENAME, "decoder": DECODER_VERSION, "zplane_decoder": ZPLANE_DECODER_VERSION }
+	return settings
+
+def outputFiles( output_dir, outputs, room_number, room_abs_offset, num_z_planes=0, object_images=(), sound_files=() ):
+	# the files each output of a room is saved to
+	# (`object_images` lists the (object number, image number) of the room,
+	# `sound_files` the (SOUN number, block name, extension) of its sounds;
+	# a room without color cycling has no animation file, see ExtractionManifest.update)
+	files = {}
+	for output, settings in outputs.items():
+		if output == "palette":
+			files[ output ] = [ paletteFilename( output_dir, settings, room_number, room_abs_offset ) ]
+		elif output == "background":
+			files[ output ] = [ backgroundFilename( output_dir, settings, room_number, room_abs_offset ) ]
+		elif output == "cycles":
+			files[ output ] = [ cycleAnimationFilename( output_dir, settings, room_number, room_abs_offset ) ]
+		elif output == "objects":
+			files[ output ] = [ objectImageFilename( output_dir, settings, room_number, room_abs_offset, obim_number, image_number ) for obim_number, image_number in object_images ]
+		elif output == "zplanes":
+			files[ output ] = [ zplaneFilename( output_dir, settings, room_number, room_abs_offset, i ) for i in range(1, num_z_planes + 1) ]
+		elif output == "sounds":
+			files[ output ] = [ soundFilename( output_dir, settings, room_number, *sound_file ) for sound_file in sound_files ]
+		elif output == "dataset":
+			files[ output ] = [ outputFilename( output_dir, settings, settings["file"] ) ]
+	return files
+
+def soundFileList( file, index, room_number, outputs ):
+	# (SOUN number, block name, extension) of every file saved for the sounds
+	# of the room (see the block index)
+	if index is None or "sounds" not in outputs:
+		return []
+	sound_files = []
+	for soun_number, position in enumerate( index.room_blocks.get( (room_number, "SOUN"), [] ) ):
+		soun = index.blocks[ position ]
+		for block_name, data in soundBlocks( readView( file, soun.offset + 8, soun.size - 8 ) ):
+			for extension, buffers in soundFiles( block_name, data, outputs["sounds"]["wrappers"] ):
+				sound_files.append( (soun_number, block_name, "raw" if extension == block_name else extension) )
+	return sound_files
+
+def objectImageList( index, room_number ):
+	# (object number, image number) of every IMnn block inside the OBIM
+	# blocks of the room (see the block index)
+	if index is None:
+		return []
+	object_images = []
+	for obim_number, position in enumerate( index.room_blocks.get( (room_number, "OBIM"), [] ), 1 ):
+		for block in index.children( position ):
+			if block.name.startswith("IM") and block.name != "IMHD":
+				object_images.append( (obim_number, int( block.name[2:], 16 )) )
+	return object_images
+
+def zplaneCount( index, room_number ):
+	# number of ZP0n blocks of the room background (see the block index)
+	positions = index.room_blocks.get( (room_number, "IM00") ) if index is not None else None
+	if not positions:
+		return 0
+	return sum( 1 for block in index.children( positions[0] ) if block.name.startswith("ZP") )
+
+
+def readObjectImages( file, obim, room_number, obim_number, COLOR_LOOKUP_TABLE, trasparent_index, output_dir, room_abs_offset, settings ):
+	# OBIM
+	# "IMHD" header, then one image block (IM01 .. IMnn) for every state of
+	# the object, each one holding a SMAP block (and the z-planes of the
+	# object) just like IM00 does for the room background.
+	# IMHD (all the values are LE words, but flags and unknown which are bytes):
+	#   object id, number of images, number of z-planes, flags, unknown,
+	#   x, y, width, height
+	obim_blocks = obim.children()
+	imhd = next( obim_blocks, None )
+	if imhd is None or imhd.name != "IMHD":
+		log( ERROR, f"room {room_number}: OBIM at offset {obim.offset} doesn't start with IMHD, skipping it" )
+		return
+
+	data = imhd.payload
+	obj_id = int.from_bytes( data[0:2], byteorder='little', signed=False)
+	num_images = int.from_bytes( data[2:4], byteorder='little', signed=False)
+	width  = int.from_bytes( data[12:14], byteorder='little', signed=False)
+	height = int.from_bytes( data[14:16], byteorder='little', signed=False)
+	log( DEBUG, f"object {obj_id} (OBIM #{obim_number}): {num_images} images of {width}x{height} pixels" )
+
+	if width < 8 or height == 0:
+		return
+
+	for image_block in obim_blocks:
+		if not image_block.name.startswith("IM"):
+			continue
+		smap = next( image_block.children(), None )
+		if smap is None or smap.name != "SMAP":
+			continue
+
+		smap_data = readView( file, smap.offset, smap.size )
+		num_stripes = width // 8
+		stripe_offsets = [ int.from_bytes( smap_data[ 8 + 4*i : 12 + 4*i ], byteorder='little', signed=False) for i in range(num_stripes) ]
+		strips = stripSlices( smap_data, stripe_offsets )
+
+		# states of the same object share most of their strips: those are
+		# decoded once, through the content store
+		decoded_strips = decodeStrips( strips, height, STRIP_WORKERS, room_number, content_store )
+
+		image_writer = StripeImageWriter( width, height )
+		for i, indices in enumerate(decoded_strips):
+			image_writer.write_strip( i, indices )
+		image_writer.set_palette( COLOR_LOOKUP_TABLE )
+		if trasparent_index is not None:
+			image_writer.set_transparency( trasparent_index )
+		filename = objectImageFilename( output_dir, settings, room_number, room_abs_offset, obim_number, int( image_block.name[2:], 16 ) )
+		image_writer.save( filename, settings["scale"] )
+
+
+def readRoomData(file, size, room_number, room_abs_offset, output_dir, outputs=None):
+	# `file` is positioned right after the ROOM block header,
+	# `outputs` maps the outputs to produce to their settings (the default
+	# ones if None, see outputSettings)
+	room_offset = file.tell() - 8
+	if outputs is None:
+		outputs = outputSettings()
+	log( INFO, f"Reading room data for room number {room_number}, abs offset {room_abs_offset} - expected size is {size}" )
 
 	# general variables for the current room (wiil be filled reading the room data)
 	width    = 0
@@ -241,81 +491,33 @@ def readRoomData(file, size, room_number, room_abs_offset, current_dir):
 	room_cycles = []
 	trasparent_index = None
 	num_z_planes = 0
+	z_planes = []   # bit-packed masks (see zplane.py)
 	COLOR_LOOKUP_TABLE = []
 	BACKGROUND_IMAGE = None
+	obim_number = 0
 
-	while counter < size-8:
-		block_name, block_size = readBlockHeader(file)
-		counter += 8
+	# blocks we are not interested in are skipped with a single seek
+	for block in walkBlocks( file, room_offset + 8, room_offset + size ):
+		block_name = block.name
 
 		# RMHD *****************************************************************
 		# contains: width, height, number of objsects
 		if block_name == "RMHD":
-			width = file.read(2)
-			width = int.from_bytes( width, byteorder='little', signed=False)
-
-			height = file.read(2)
-			height = int.from_bytes( height, byteorder='little', signed=False)
-
-			num_objs = file.read(2)
-			num_objs = int.from_bytes( num_objs, byteorder='little', signed=False)
+			data = block.payload
+			width    = int.from_bytes( data[0:2], byteorder='little', signed=False)
+			height   = int.from_bytes( data[2:4], byteorder='little', signed=False)
+			num_objs = int.from_bytes( data[4:6], byteorder='little', signed=False)
 
-			print( f"Room has {width}x{height} pixels dimension and {num_objs} number of objects inside it")
-			counter +=6
+			log( DEBUG, f"Room has {width}x{height} pixels dimension and {num_objs} number of objects inside it" )
 
 			image_writer = StripeImageWriter( width, height)
 
-			"""
 		# CYCL *****************************************************************
-		# TODO: implement this Color cycling extraction functionality
-		#       leaving this comment her for later imrpovements
-		elif block_name == "CYCL":
-			#cycles  : variable length
-			#	idx   : 8 (valid range is [1-16])
-			#	unk   : 16 Th
-			#	freq  : 16be (delay = 16384/freq)
-			#	flags : 16be
-			#	start : 8 (start/end entries in the palette)
-			#	end   : 8
-			#close   : 8 must be set to 0 to end the block
-
-			byte = file.read(1)
-			print( byte )
-			counter +=1
-
-			while byte != b'\x00':
-				cycle = {}
-
-				cycle["idx"] = int.from_bytes( byte, byteorder='little', signed=False)
-
-				byte = file.read(2)
-				cycle["unk"] = int.from_bytes( byte, byteorder='little', signed=False)
-
-				byte = file.read(2)
-				cycle["freq"] = int.from_bytes( byte, byteorder='big', signed=False)
-
-				byte = file.read(2)
-				cycle["flags"] = int.from_bytes( byte, byteorder='big', signed=False)
-
-				byte = file.read(1)
-				cycle["start"] = int.from_bytes( byte, byteorder='little', signed=False)
-
-				byte = file.read(1)
-				cycle["end"] = int.from_bytes( byte, byteorder='little', signed=False)
-
-				room_cycles.append( cycle )
-				print( cycle )
-
-				byte = file.read(1)
-				counter += 9
-
-			print(f"this is the end of the CYCL block")
-
-			for c in room_cycles:
-				#for k,v in c:
-				#	print(f"cycle {k} --> {v}")
-				print(c)
-		"""
+		# the palette ranges animated by color cycling (see colorcycle.py)
+		elif block_name == "CYCL" and "cycles" in outputs:
+			room_cycles = parseCycles( block.payload )
+			for cycle in room_cycles:
+				log( DEBUG, f"color cycle {cycle}" )
 
 		# TRNS *****************************************************************
 		# TRNS stores the transparency information of a room, namely, the palette
@@ -326,325 +528,158 @@ def readRoomData(file, size, room_number, room_abs_offset, current_dir):
 		# wIndex	word	Transparent palette index (LE)
 
 		elif block_name == "TRNS":
-			trasparent_index = file.read(2)
-			trasparent_index = int.from_bytes( trasparent_index, byteorder='little', signed=False)
-			print(f"this the transparent palette index color: {trasparent_index}")
-			counter += 2
+			trasparent_index = int.from_bytes( block.payload[0:2], byteorder='little', signed=False)
+			log( DEBUG, f"this the transparent palette index color: {trasparent_index}" )
 
 
 		# COLOR LOOK UP TABLE **************************************************
-		elif block_name == "CLUT":
-			print(f"CLUT: this the (VGA) color lookup table")
-
-			for i in range(256):
-				r = file.read(1)
-				g = file.read(1)
-				b = file.read(1)
-				r = int.from_bytes( r, byteorder='little', signed=False)
-				g = int.from_bytes( g, byteorder='little', signed=False)
-				b = int.from_bytes( b, byteorder='little', signed=False)
-				COLOR_LOOKUP_TABLE.append( (r,g,b) )
-
-				#print(f"color {i}: [{r},{g},{b}]")
-				counter +=3
-
-			if SAVE_PALLETES:
-				filename = os.path.join(current_dir, f"{PALETTE_FOLDER}/room{room_number}_off{room_abs_offset}.png")
+		elif block_name == "CLUT" and PALETTE_OUTPUTS.intersection( outputs ):
+			log( DEBUG, f"CLUT: this the (VGA) color lookup table" )
+
+			with phase("clut_parse", room_number):
+				data = block.payload
+				for i in range(256):
+					r, g, b = data[ i*3 : i*3 + 3 ]
+					COLOR_LOOKUP_TABLE.append( (r,g,b) )
+
+			if "palette" in outputs:
+				settings = outputs["palette"]
+				filename = paletteFilename( output_dir, settings, room_number, room_abs_offset )
 				# filename, COLOR_LIST, width, height, scale_factor
-				drawCLUT( filename, COLOR_LOOKUP_TABLE, 16,16, PALETTE_IMAGE_SCALE_FACTOR )
+				drawCLUT( filename, COLOR_LOOKUP_TABLE, 16,16, settings["scale"], settings["format"] )
 
 		# Actual background image data and z-planes ****************************
-		elif block_name == "RMIM":
+		elif block_name == "RMIM" and ("background" in outputs or "cycles" in outputs or "zplanes" in outputs or "dataset" in outputs):
+			rmim_blocks = block.children()
 
 			# RMIH *************************************************************
 			# only stores the number of z-planes for the background image
-			block_name, block_size = readBlockHeader(file)
-			assert block_name == "RMIH"
-			counter += 8
+			rmih = next( rmim_blocks )
+			assert rmih.name == "RMIH"
 
-			num_z_planes = file.read(2)
-			num_z_planes = int.from_bytes( num_z_planes, byteorder='little', signed=False)
-			print(f"number of z-planes (guessed) is : {num_z_planes}")
-			counter += 2
+			num_z_planes = int.from_bytes( rmih.payload[0:2], byteorder='little', signed=False)
+			log( DEBUG, f"number of z-planes (guessed) is : {num_z_planes}" )
 
 			# IM00 *************************************************************
-			block_name, block_size = readBlockHeader(file)
-			assert block_name == "IM00"
-			counter += 8
-
+			im00 = next( rmim_blocks )
+			assert im00.name == "IM00"
+			im00_blocks = im00.children()
 
 			# SMAP *************************************************************
-			#ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
-			#ref: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
-
-
-			# What's in a Strip?
-			# OK, so we find the strip offsets, we follow them one by one, but what
-			# do we do when we get to a strip? OK, here's the information on what
-			# is actually stored in the strip definitions.
+			# (see smap.py for what's inside a strip)
+			smap = next( im00_blocks )
+			assert smap.name == "SMAP"
 
-			# The first byte in the strip data is the compression ID. This is a
-			# number between 1 and 128 (0x80). We'll get to that in a second.
-			# The next byte is the color of the first pixel in the strip, and also
-			# the initial palette index. I.e., the palette index we continue
-			# drawing with until we're told otherwise. After these two bytes
-			# follow the actual compressed data.
-
-			SMAP_REF_POSITION = file.tell()
-
-			block_name, block_size = readBlockHeader(file)
-			assert block_name == "SMAP"
-			#counter += 8
+			# the whole SMAP block at once: strip offsets are relative to the
+			# beginning of its header
+			smap_data = readView( file, smap.offset, smap.size )
 
 			# first we will find the offset table
 			num_stripes = int(width/8)
-			print(f"Image width is '{width}' so we will have {num_stripes} stripes offsets")
+			log( DEBUG, f"Image width is '{width}' so we will have {num_stripes} stripes offsets" )
 
 			stripe_offsets = []
 			for i in range(num_stripes):
-				offset = file.read(4)
+				offset = smap_data[ 8 + 4*i : 12 + 4*i ]
 				offset = int.from_bytes( offset, byteorder='little', signed=False)
-				#counter +=4
 				stripe_offsets.append( offset )
 
-			print( stripe_offsets )
-
-			#try to rewind the file pointer
-			#file.seek( -((4*num_stripes)+8), 1)  # 1 is `io.SEEK_CUR`
-			#counter -= ((4*num_stripes)+8)
-			file.seek( SMAP_REF_POSITION, 0)
-
-
-			for i, so in enumerate(stripe_offsets):
-				#move pointer to offset
-				print(f"\nDrawing strip {i}, move forward by {so}")
-				file.seek( so, 1 )
-
-				# starting value for each strip for subtraction_variable is 1
-				subtraction_var = 1
-
-				compression_id = file.read(1)
-				compression_id = int.from_bytes(compression_id, byteorder='little', signed=False)
-				assert compression_id >= 1 and compression_id <= 128
-				print(f"compression id of strip {i} is {compression_id} ({intToHex(compression_id)})")
-
-				method, direction, transparent, parSub = getDecoderSettings( compression_id )
-				palette_index_size = compression_id - parSub
-				print(f"\ncodec info - compression ID: {intToHex(compression_id)}, method: {method}, direction: {direction}, tranparent: {transparent}, par-sub: {parSub}, so palette index size is {palette_index_size} bits\n")
-
-				first_pixel_color_index = file.read(1)
-				first_pixel_color_index = int.from_bytes(first_pixel_color_index, byteorder='little', signed=False)
-				assert first_pixel_color_index <= 255
-				print(f"first_pixel_color_index is {first_pixel_color_index}")
-
-				# create an instance of the BitReader
-				bitReader = BitReaderLSB( file )
-
-				#remaining pixels to draw to the image
-				pixel_left = 8 * height
-				print(f"remaining {pixel_left} pixels to draw w/ {direction} method")
-
-				color_index = first_pixel_color_index
-
-				# Write the first pixel (always on the upper left corner)
-				image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], 1, direction )
-				pixel_left -= 1
-
-				if method == "1st":
-					print(f"CODEC METHOD 1")
-
-					# The elegant implementation for this decoder can be found here
-					# ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
-					# This is known as 'UnkB'
-
-					#uint8_t color = read_bits(csh);
-					#uint8_t inc = -1;
-					#while(pixel_left) {
-					#  write_pixel(color,1);
-					#  if(read_bit()) {
-					#    if(!read_bit()) {
-					#      color = read_bits(csh);
-					#      inc = -1;
-					#    } else {
-					#      if(read_bit()) inc = -inc;
-					#      color += inc;
-					#    }
-					#  }
-					#}
-
-					inc = -1
-
-					while pixel_left > 0:
-
-
-						if bitReader.read_bit():
-							if not bitReader.read_bit():
-								color_index = bitReader.read_bits( palette_index_size )
-								inc = -1
-							else:
-								if bitReader.read_bit():
-									inc = -inc
-								color_index += inc
-
-						image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], 1, direction )
-						pixel_left -= 1
-
-					"""
-					# Below is a more cluncky implementation of mine
-					while pixel_left > 0:
-						n = 1  # Default number of pixels to write
-						if bitReader.read_bit():
-							print("bit is one - looking for next code")
-							#There are three codes that start in a 1
-							#so we need the next bit to find out more
-
-
-							if not bitReader.read_bit():
-								print("found code 10 - read a new palette index")
-								# bit is 0 so we have just encoutered the code '10'
-								# code 10, which means we should read a new palette index
-								# The code 10 also tells us to set the subtraction variable to 1 (it already is 1, as that's its initial value)
-								color_index = bitReader.read_bits( palette_index_size )
-								print( f"color index is {color_index}")
-								assert color_index <= 255
-								#if not color_index <=255:
-								#	print(f"\nERROR: codec info - compression ID: {intToHex(compression_id)}, method: {method}, direction: {direction}, tranparent: {transparent}, par-sub: {parSub}, so palette index size is {palette_index_size} bits\n")
-								#	color_index = 0
-								subtraction_var = 1
-								print(f"setting subtraction var to {subtraction_var}")
-								# draw next pixel
-								image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], n, direction )
-							else:
-								#second bit is also 1: we have two different cases here
-								if not bitReader.read_bit():
-									print("found code 110")
-									# we have encountered the code '110'
-									#  110: Subtract the subtraction variable from the palette index, and draw the next pixel.
-									color_index -= subtraction_var
-									print( f"new color index is {color_index}")
-									assert color_index <= 255
-									#if not color_index <=255:
-									#	print(f"\nERROR: codec info - compression ID: {intToHex(compression_id)}, method: {method}, direction: {direction}, tranparent: {transparent}, par-sub: {parSub}, so palette index size is {palette_index_size} bits\n")
-									#	color_index = 0
-									image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], n, direction )
-								else:
-									print("found code 111 - negate subtraction var")
-									# we have encountered the code '111'
-									# 111: Negate the subtraction variable (i.e., if it's 1, change it to -1, if it's -1, change it to 1). Subtract it from the palette index, and draw the next pixel.
-									subtraction_var = (-1)*subtraction_var
-									print(f"negate the subtraction var which now is {subtraction_var}")
-									color_index -= subtraction_var
-									print( f"new color index is {color_index}")
-									assert color_index <= 255
-									#if not color_index <=255:
-									#	print(f"\nERROR: codec info - compression ID: {intToHex(compression_id)}, method: {method}, direction: {direction}, tranparent: {transparent}, par-sub: {parSub}, so palette index size is {palette_index_size} bits\n")
-									#	color_index = 0
-									image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], n, direction )
-						else:
-							#print("bit is zero - drawing a pixel")
-							image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], n, direction )
-
-						pixel_left -= 1
-					"""
-				elif method == "2nd":
-					print(f"CODEC METHOD 2")
-					# as described here: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
-					# 0:  Draw next pixel with current palette index.
-					# 10: Read a new palette index from the bitstream (i.e., the
-					#     number of bits specified by the parameter), and draw the next pixel.
-					# 11: Read the next 3 bit value, and perform an action, depending on the value:
-					#     000 (0): Increase current palette index by 4.
-					#     001 (1): Increase current palette index by 3.
-					#     010 (2): Increase current palette index by 2.
-					#     011 (3): Increase current palette index by 1.
-					#     100 (4): Read next 8 bits. Draw the number of pixels
-					#              specified by these 8 bits with the current palette
-					#              index (somewhat similar to RLE).
-					#     101 (5): Decrease current palette index by 1.
-					#     110 (6): Decrease current palette index by 2.
-					#     111 (7): Decrease current palette index by 3.
-
-					# This seem a method to decode which is the one described as UnkA @
-					# ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
-					# Trying this algo because the ine described here:
-					# ref: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
-					# seems not to work
-
-					while pixel_left > 0:
-						n = 1
-						if bitReader.read_bit():
-							if not bitReader.read_bit():
-								color_index = bitReader.read_bits( palette_index_size )
-							else:
-								inc = (bitReader.read_bits(3) - 4)
-								if inc:
-									color_index += inc
-								else:
-									n = bitReader.read_bits( 8 )
-						if SAVE_BACKGROUND_IMAGE:
-							image_writer.write_pixel( i, COLOR_LOOKUP_TABLE[ color_index ], n, direction )
-						pixel_left -= 1
-
-				file.seek( SMAP_REF_POSITION, 0)
-				image_writer.moveToNextStrip( )
-
-
-			if SAVE_BACKGROUND_IMAGE:
-				# TODO: save image as bitmap image (with color palette inside)
-				filename = os.path.join(current_dir, f"{BACKGROUND_IMAGES_FOLDER}/room{room_number}_off{room_abs_offset}.png")
-				image_writer.save( filename, BACKGROUND_IMAGE_SCALE_FACTOR)
-
-			# now, we are at the beginning of the SMAP block,
-			# we have already processed it, so skip it
-			file.seek( block_size, 1)
-			counter += block_size
-
-			"""
-			block_name, block_size = readBlockHeader(file)
-			assert block_name == "SMAP"
-			counter += 8
-
-			#skip actual sub-block data
-			for i in range(block_size-8):
-				byte = file.read(1)
-				#print( byte )
-				counter += 1
-			"""
+			if enabled(TRACE):
+				print( stripe_offsets )
+
+			# the background is needed for the color cycling animation too
+			save_cycles = "cycles" in outputs and activeCycles( room_cycles )
+			if "background" in outputs or save_cycles or "dataset" in outputs:
+				strips = stripSlices( smap_data, stripe_offsets )
+
+				if enabled(TRACE):
+					for i, strip in enumerate(strips):
+						compression_id = strip[0]
+						method, direction, transparent, parSub = getDecoderSettings( compression_id )
+						print(f"codec info of strip {i} - compression ID: {intToHex(compression_id)}, method: {method}, direction: {direction}, tranparent: {transparent}, par-sub: {parSub}")
+
+				# every strip is decoded on its own (by a pool of processes for
+				# very wide rooms), then they are put together in the image
+				decoded_strips = decodeStrips( strips, height, STRIP_WORKERS, room_number, content_store )
+
+				for i, indices in enumerate(decoded_strips):
+					image_writer.write_strip( i, indices )
+				BACKGROUND_IMAGE = image_writer.indices
+
+				# the image is saved as a palettized image, with the room
+				# color palette inside
+				image_writer.set_palette( COLOR_LOOKUP_TABLE )
+				if "background" in outputs:
+					settings = outputs["background"]
+					filename = backgroundFilename( output_dir, settings, room_number, room_abs_offset )
+					image_writer.save( filename, settings["scale"] )
+
+				# every frame of the animation is the same background with a
+				# rotated palette
+				if save_cycles:
+					settings = outputs["cycles"]
+					frames = cycleFrames( image_writer.palette, room_cycles, settings["frames"] )
+					filename = cycleAnimationFilename( output_dir, settings, room_number, room_abs_offset )
+					log( DEBUG, f"color cycling animation: {len(frames)} frames" )
+					outputTask( saveCycleAnimation, filename, bytes( image_writer.indices ), width, height, frames, settings["scale"] )
+			else:
+				instrumentation.count( room_number, "bytes_skipped", smap.size )
 
 			# ZP0n *************************************************************
-			print(f"Room has {num_z_planes} num z-planes")
-			for i in range(num_z_planes):
-				block_name, block_size = readBlockHeader(file)
-				counter += 8
-
-				assert block_name == f"ZP0{i+1}"
-				#skip actual sub-block data
-				for i in range(block_size-8):
-					file.read(1)
-					counter += 1
+			log( DEBUG, f"Room has {num_z_planes} num z-planes" )
+			for i, zplane in enumerate( im00_blocks ):
+				assert zplane.name == f"ZP0{i+1}"
+				if "zplanes" not in outputs and "dataset" not in outputs:
+					#skip actual sub-block data (nothing to read)
+					instrumentation.count( room_number, "bytes_skipped", zplane.size )
+					continue
+
+				with phase("zplane_decode", room_number):
+					mask = decodeZPlane( readView( file, zplane.offset, zplane.size ), width, height )
+				z_planes.append( mask )
+				if "zplanes" in outputs:
+					settings = outputs["zplanes"]
+					filename = zplaneFilename( output_dir, settings, room_number, room_abs_offset, i+1 )
+					outputImage( filename, zplaneImage( mask, width, height ), settings["scale"] )
+
+		# OBIM *****************************************************************
+		# object images (one for every state of the object)
+		elif block_name == "OBIM":
+			obim_number += 1
+			if "objects" in outputs:
+				readObjectImages( file, block, room_number, obim_number, COLOR_LOOKUP_TABLE, trasparent_index, output_dir, room_abs_offset, outputs["objects"] )
+			else:
+				instrumentation.count( room_number, "bytes_skipped", block.size )
 
 		else:
-			#skip actual sub-block data
-			for i in range(block_size-8):
-				file.read(1)
-				counter += 1
+			# not interested in this block
+			instrumentation.count( room_number, "bytes_skipped", block.size )
 
+	# the decoded planes of the room go straight into the packed dataset
+	if "dataset" in outputs and dataset_writer is not None:
+		clut = paletteBytes( COLOR_LOOKUP_TABLE ) if COLOR_LOOKUP_TABLE else None
+		with phase("dataset_write", room_number):
+			dataset_writer.addRoom( room_number, width, height, BACKGROUND_IMAGE, clut, trasparent_index, [ zplanePixels( mask ) for mask in z_planes ], room_names.get( room_number ) )
+
+	# continue right after the ROOM block
+	file.seek( room_offset + size, 0 )
 	return size
 
 
-def readLFLF( file, room_number, current_dir ):
+def readLFLF( file, room_number, output_dir, outputs=None ):
 	SOUN_IDX = 0 #every lflf may have zero or more SOUN block, we use this counter to keep track of them
 	COST_IDX = 0
 	SCRP_IDX = 0
 	CHAR_IDX = 0
-	counter = 0
 
 	abs_offset = file.tell()
+	if outputs is None:
+		outputs = outputSettings()
 
-	print( f"LFLF abs offset {abs_offset}\t(room number {room_number})" )
+	log( DEBUG, f"LFLF abs offset {abs_offset}\t(room number {room_number})" )
 
-	_, lflf_block_size = readBlockHeader(file)
-	counter += 8
+	lflf = readBlock( file, abs_offset )
+	lflf_blocks = lflf.children()
 
 	# ROOM
 	# The ROOM block is the container for everything that makes up the appearance
@@ -654,34 +689,36 @@ def readLFLF( file, room_number, current_dir ):
 	# followed by sub-blocks (the order and amount varies from game to game):
 	# RMHD, CYCL, PALS, TRNS, EPAL, BOXD, BOXM, CLUT, SCAL, RMIM / IMAG, OBCD, EXCD, ENCD, NLSC, LSCR
 
-	_, room_block_size = readBlockHeader(file)
-	counter += 8
-
-	# for now, skip all this content.
-	# I think block size takes into account also:
-	# * the 4 bytes for the block name;
-	# * the 4 bytes for the block size itself;
-	# so removing it because we already have traversed them
-
-	size = readRoomData(file, room_block_size, room_number, abs_offset, current_dir)
-	print(f"Size read is {size}")
-	assert size == room_block_size
-	counter += room_block_size
+	room = next( lflf_blocks )
+
+	if set( outputs ) - {"sounds"}:
+		# I think block size takes into account also:
+		# * the 4 bytes for the block name;
+		# * the 4 bytes for the block size itself;
+		# so removing it because we already have traversed them
+		file.seek( room.offset + 8, 0 )
+		size = readRoomData(file, room.size, room_number, abs_offset, output_dir, outputs)
+		log( DEBUG, f"Size read is {size}" )
+		assert size == room.size
+	else:
+		# nothing wanted from the room itself
+		instrumentation.count( room_number, "bytes_skipped", room.size )
 
 	#do we have more bytes to read?
-	print(f"remaining {lflf_block_size - counter} bytes to be read - skipping")
+	log( DEBUG, f"remaining {lflf.end - room.end} bytes to be read - skipping" )
+	if "sounds" not in outputs:
+		# sounds are the only thing we look for after the ROOM block
+		instrumentation.count( room_number, "bytes_skipped", lflf.end - room.end )
+		log( DEBUG, "end of LFLF block\n" )
+		return
 
 	# now we can expect different type of sub blocks
 	# like: SRC, SOUN, AKOS / COST, CHAR, SCRP
-	while counter < lflf_block_size:
-		absolute_offset = file.tell()
-		#print()
-		block_name, block_size = readBlockHeader(file) #SOUN, SCRP, COST, etc...
-		counter += 8
-		#print(f"remaining {lflf_block_size - counter} bytes to be read")
+	for block in lflf_blocks:
+		block_name = block.name #SOUN, SCRP, COST, etc...
 
 		if block_name == "SOUN":
-			#print( f"SOUN abs offset: {absolute_offset}" )
+			#print( f"SOUN abs offset: {block.offset}" )
 			# ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Sound_resources
 			# Going from Monkey Island 2 (MI2), music blocks are stored in LFLF blocks,
 			# outside of the ROOMs, so they can be accessed globally. The containing sound block looks like this:
@@ -691,76 +728,263 @@ def readLFLF( file, room_number, current_dir ):
 			# Block size         4 bytes
 			# Music block        variable
 
-			# "SOU "
-			sou_block_name, sou_block_size = readBlockHeader(file)
-			counter += 8
-			#print(f"remaining {lflf_block_size - counter} bytes to be read")
-
 			# The music block may contain any combination of ROL (Roland MT-32), ADL (AdLib/OPL FM),
 			# or SPK (PC speaker) blocks. They can also store a single SBL block for digitized sound
 			# (described in a later section). Aside from SBL, each of these blocks follow the same basic pattern.
 			# Block name        4 bytes ("ROL ", or "ADL ", or "SPK ")
 			# Block size        4 bytes
 			# MIDI data         variable
-
-
-			sou_counter = 0
-			while sou_counter <= sou_block_size-8:
-				# It seems to me that this block doesn't consider the 8 bytes of Block Name and Block Size
-				sub_block_name, sub_block_size = readBlockHeader(file)
-				#print(f"{sub_block_name} - size {sub_block_size}")
-
-				file.seek(-8, 1) # rewind file pointer 8 bytes back from current position
-
-				data_to_be_saved_as_MIDI = file.read( sub_block_size + 4 + 4 )
-
-				sou_counter += (sub_block_size+8)
-				#print(f"counter {counter} against parent block size {block_size}")
+			# (see sound.py)
+
+			if "sounds" in outputs:
+				# slices of the block payload go straight to the files
+				for block_name, data in soundBlocks( block.payload ):
+					log( DEBUG, f"SOUN {SOUN_IDX}: {block_name} block, {len(data)} bytes" )
+					for extension, buffers in soundFiles( block_name, data, outputs["sounds"]["wrappers"] ):
+						if extension == block_name:
+							extension = "raw"
+						outputBuffers( soundFilename( output_dir, outputs["sounds"], room_number, SOUN_IDX, block_name, extension ), buffers )
+			else:
+				instrumentation.count( room_number, "bytes_skipped", block.size )
 			SOUN_IDX += 1
 			#print( "end of SOUN")
 
-			counter = counter + sou_block_size
-			#print(f"remaining {lflf_block_size - counter} bytes to be read")
-
 		elif block_name == "COST":
-			#print(f"This is a COST resource - size {block_size}, skipping")
+			#print(f"This is a COST resource - size {block.size}, skipping")
 			#skip this resource for now
-			file.read(block_size-8)
-			counter += block_size
+			COST_IDX += 1
+			instrumentation.count( room_number, "bytes_skipped", block.size )
 
 		elif block_name == "SCRP":
-			#print(f"This is a SCRP resource - size {block_size}, skipping")
+			#print(f"This is a SCRP resource - size {block.size}, skipping")
 			#skip this resource for now
-			file.read(block_size-8)
-			counter += block_size
+			SCRP_IDX += 1
+			instrumentation.count( room_number, "bytes_skipped", block.size )
 
 		elif block_name == "CHAR":
-			#print(f"This is a CHAR resource - size {block_size}, skipping")
+			#print(f"This is a CHAR resource - size {block.size}, skipping")
 			#skip this resource for now
-			file.read(block_size-8)
-			counter += block_size
+			CHAR_IDX += 1
+			instrumentation.count( room_number, "bytes_skipped", block.size )
 
 		else:
-			print("readLFLF method: pass")
-			pass
-		#print(f"counter {counter} against lflf block size {lflf_block_size}")
-
-	print("end of LFLF block\n")
-
-
-# MAIN #########################################################################
-if __name__ == "__main__":
-	# Get the absolute path of the current directory
-	current_dir = os.getcwd() # Get the current working directory
-
-	# I'm actually storing my game files in the parent folder
-	os.chdir("..")
-	parent_dir = os.getcwd() # Get the current working directory
-	FILE_001 = os.path.join(parent_dir, FILE_001)  # Construct the full path
+			log( DEBUG, f"readLFLF method: skipping {block_name}" )
+			instrumentation.count( room_number, "bytes_skipped", block.size )
+
+	log( DEBUG, "end of LFLF block\n" )
+
+
+# REGIONS AND PREVIEWS *********************************************************
+# A part of a room background (e.g. what a 320 pixels wide viewport shows of a
+# scrolling room), or a smaller preview of it, for viewers and thumbnails:
+# the few blocks needed are found through the block index and only the strips
+# covering the part (or sampled for the preview) are decoded (see smap.py).
+def roomBackground( file, index, room_number ):
+	# width, height, palette (bytes) and SMAP data of the room background,
+	# None if the room has no background
+	rmhd = index.find( room_number, "RMHD" )
+	smap = roomBackgroundBlock( index, room_number, "SMAP" )
+	if rmhd is None or smap is None:
+		return None
+	data = readView( file, rmhd.offset + 8, 4 )
+	width  = int.from_bytes( data[0:2], byteorder='little', signed=False)
+	height = int.from_bytes( data[2:4], byteorder='little', signed=False)
+	clut = index.find( room_number, "CLUT" )
+	palette = bytes( readView( file, clut.offset + 8, 768 ) ) if clut is not None else None
+	return width, height, palette, readView( file, smap.offset, smap.size )
+
+def backgroundWriter( width, height, indices, palette ):
+	# (like the whole background, parts of it are not transparent: only
+	# objects are)
+	image_writer = StripeImageWriter( width, height )
+	image_writer.indices = indices
+	image_writer.palette = palette
+	return image_writer
+
+def readBackgroundRegion( file, index, room_number, box ):
+	# a StripeImageWriter (palette included) with the `box` (left, top,
+	# right, bottom) part of the room background, None if the room has no
+	# background
+	background = roomBackground( file, index, room_number )
+	if background is None:
+		return None
+	width, height, palette, smap_data = background
+	with phase("room_region", room_number):
+		indices = decodeRegion( smap_data, width, height, box, room_number )
+	left, top, right, bottom = box
+	return backgroundWriter( right - left, bottom - top, indices, palette )
+
+def readBackgroundPreview( file, index, room_number, step ):
+	# a StripeImageWriter with a preview `step` times smaller than the room
+	# background (one strip and one row out of `step`)
+	background = roomBackground( file, index, room_number )
+	if background is None:
+		return None
+	width, height, palette, smap_data = background
+	with phase("room_preview", room_number):
+		preview_width, preview_height, indices = decodePreview( smap_data, width, height, step, room_number )
+	return backgroundWriter( preview_width, preview_height, indices, palette )
+
+
+# PARALLEL EXTRACTION **********************************************************
+# Every room lives in its own LFLF block, so rooms can be extracted
+# independently from each other. Each worker process opens its own
+# (memory-mapped, lazily decoded) view of the resource file once, so only
+# room numbers and offsets travel between processes.
+_worker_file = None
+
+# (file path, xor key) -> reader, for workers serving several files (see
+# extractGameRoom)
+_worker_files = {}
+
+def initExtractionWorker( file_path, log_level=INFO, profile=False, content_store_folder=None, names=None, xor_key=XOR_KEY ):
+	global _worker_file, output_pipeline, content_store, sound_writer, room_names
+	_worker_file = XorFileReader( file_path, xor_key ) if file_path is not None else None
+	room_names = names or {}
+	# every worker has its own content store (sharing the folder, if any)
+	content_store = makeContentStore( content_store_folder )
+	# worker processes are already running in parallel: they save their
+	# images by themselves (and the threads of a pipeline inherited from
+	# the parent process wouldn't be running anyway)
+	output_pipeline = None
+	sound_writer = None
+	instrumentation.setLogLevel( log_level )
+	if profile:
+		instrumentation.startProfiling()
+	else:
+		instrumentation.stopProfiling()
+
+def extractRoom( room_number, room_abs_offset, output_dir, outputs=None ):
+	# returns the room number, the profile of the room (when profiling) and
+	# the content store stats
+	LFLF_ABS_OFFSET = room_abs_offset - 8
+	_worker_file.seek( LFLF_ABS_OFFSET, 0 )
+	with phase("room", room_number):
+		readLFLF( _worker_file, room_number, output_dir, outputs )
+	if sound_writer is not None:
+		sound_writer.flush()
+		for filename, e in sound_writer.errors:
+			log( ERROR, f"Error saving {filename}: {e}" )
+		sound_writer.errors.clear()
+	store_stats = content_store.takeStats() if content_store is not None else None
+	if instrumentation.profiler is None:
+		return room_number, None, store_stats
+	profile = instrumentation.profiler.toDict()
+	instrumentation.startProfiling()
+	return room_number, profile, store_stats
+
+def extractGameRoom( file_path, xor_key, names, room_number, room_abs_offset, output_dir, outputs=None ):
+	# extractRoom, for a room of any resource file (see batch.py); the time
+	# spent on the room is added to what extractRoom returns
+	global _worker_file, room_names
+	file = _worker_files.get( (file_path, xor_key) )
+	if file is None:
+		file = XorFileReader( file_path, xor_key )
+		_worker_files[ (file_path, xor_key) ] = file
+	_worker_file = file
+	room_names = names
+	start_time = time.perf_counter()
+	result = extractRoom( room_number, room_abs_offset, output_dir, outputs )
+	return result + ( time.perf_counter() - start_time, )
+
+def extractRoomsInParallel( file_path, tasks, output_dir, workers, room_sizes=None, xor_key=XOR_KEY ):
+	# `tasks` is a list of (room number, room abs offset, outputs)
+	if workers <= 0:
+		workers = os.cpu_count() or 1
+
+	# bigger rooms first, so that small ones fill the gaps at the end
+	# and no worker is left alone with a huge room
+	tasks = list( tasks )
+	if room_sizes:
+		tasks.sort( key=lambda task: room_sizes.get( task[0], 0 ), reverse=True )
+
+	failed_rooms = []
+	profile = instrumentation.profiler is not None
+	content_store_folder = content_store.folder if content_store is not None else None
+	with ProcessPoolExecutor( max_workers=workers, initializer=initExtractionWorker, initargs=(file_path, instrumentation.log_level, profile, content_store_folder, room_names, xor_key) ) as pool:
+		futures = { pool.submit( extractRoom, task[0], task[1], output_dir, task[2] ): task[0] for task in tasks }
+		for future in as_completed( futures ):
+			try:
+				room_number, room_profile, store_stats = future.result()
+				if room_profile is not None:
+					instrumentation.profiler.merge( room_profile )
+				if store_stats is not None and content_store is not None:
+					content_store.mergeStats( store_stats )
+			except Exception as e:
+				log( ERROR, f"Error extracting room {futures[future]}: {e}" )
+				failed_rooms.append( futures[future] )
+	return failed_rooms
+
+
+# EXTRACTION *******************************************************************
+def parseRoomList( text ):
+	# "1,3,10-20" -> [1, 3, 10, 11, ..., 20]
+	rooms = set()
+	for part in text.split(","):
+		part = part.strip()
+		if not part:
+			continue
+		first, dash, last = part.partition("-")
+		first = int( first )
+		last = int( last ) if dash else first
+		if first > last:
+			raise ValueError(f"invalid room range {part!r}")
+		rooms.update( range(first, last + 1) )
+	return sorted( rooms )
+
+def indexFilePath( file_path ):
+	# ATLANTIS.001 -> ATLANTIS.000 (None if the name doesn't end with a number)
+	base, extension = os.path.splitext( file_path )
+	if not extension[1:].isdigit():
+		return None
+	return base + "." + "0" * len(extension[1:])
 
-	file = BytesIO( xor( FILE_001 ) )
+def loadRoomNames( index_path, xor_key=XOR_KEY ):
+	# room number -> name, {} if there's no index file
+	if index_path is None or not os.path.exists( index_path ):
+		return {}
+	try:
+		return readIndexFile( index_path, xor_key ).room_names
+	except Exception as e:
+		log( ERROR, f"Unable to read index file {index_path}: {e}" )
+		return {}
+
+class ExtractionPlan:
+	# what is left to do for the rooms of a resource file: `tasks` lists the
+	# (room number, room abs offset, outputs) to be extracted
+	def __init__(self):
+		self.index = None
+		self.tasks = []
+		self.up_to_date = []
+		self.missing_rooms = set()
+		self.manifest = None
+		self.room_hashes = {}
+		# room number -> {output: hash of the blocks outside the ROOM block it is made of}
+		self.data_hashes = {}
+
+	def roomSizes(self):
+		# room number -> size of its LFLF block
+		if self.index is None:
+			return None
+		return { room: self.index.blocks[lflf].size for room, lflf in self.index.rooms.items() }
+
+	def updateManifest(self, file, output_dir, output_settings, failed_rooms, output_errors):
+		# remember what has been extracted (with incremental extraction)
+		if self.manifest is None:
+			return
+		for ROOM_NUMBER, ROOM_AB_OFFSET, outputs in self.tasks:
+			if ROOM_NUMBER in failed_rooms:
+				continue
+			output_files = outputFiles( output_dir, output_settings, ROOM_NUMBER, ROOM_AB_OFFSET - 8, zplaneCount( self.index, ROOM_NUMBER ), objectImageList( self.index, ROOM_NUMBER ), soundFileList( file, self.index, ROOM_NUMBER, output_settings ) )
+			self.manifest.update( ROOM_NUMBER, self.room_hashes[ ROOM_NUMBER ], output_settings, output_files, outputs, self.data_hashes.get( ROOM_NUMBER ) )
+		self.manifest.forgetFiles( filename for filename, e in output_errors )
+		self.manifest.save()
+
+def planExtraction( file, file_path, output_dir, rooms, output_settings, incremental, force=False ):
+	# the ExtractionPlan of the given `rooms` (all of them if None)
+	plan = ExtractionPlan()
 	reference_position = file.tell()
-	print(f"ref pos: {reference_position}")
+	log( DEBUG, f"ref pos: {reference_position}" )
 
 	# info taken from internal documentation of ScummEX software:
 
@@ -773,49 +997,309 @@ if __name__ == "__main__":
 	# loop
 	#	* blLFLF
 	# end of loop
-	_, lecf_size = readBlockHeader(file)
 
 	# LOFF block
 	# The LOFF block contains the offsets to each LFLF block in the file
-	# "LOFF" (dword) Block identifier
-	# dwSize (dword) Size in bytes (BE)
-	# nRooms (byte) Number of LFLF offsets
-	# loop nRooms
-	#	* nRoomNumber (byte) Room Number
-	#	* dwOffset (dword) LFLF offset (LE)
-	# enf of loop
+	# (see `readLOFF`). Together with the position of every other block, it is
+	# read once and saved in a block index next to the resource file, so
+	# later runs don't have to walk the file again (when only some rooms are
+	# wanted, only those rooms are walked).
 	room_number_and_offset = []
 	try:
-		_, loff_size = readBlockHeader(file)
-		nRoomsOffsets_byte = file.read(1)
-		nRoomsOffsets = int.from_bytes(nRoomsOffsets_byte, 'little')
-		print(f"total number of rooms: {nRoomsOffsets}")
-
-		for room in range(nRoomsOffsets):
-			roomNumber_byte = file.read(1)
-			roomNumber = int.from_bytes(roomNumber_byte, 'little')
-			offset_bytes = file.read(4)
-			offset = int.from_bytes(offset_bytes, 'little')
-			room_number_and_offset.append( [roomNumber, offset] )
-
+		plan.index = loadOrBuildIndex( file, file_path, room_numbers=rooms )
+		room_number_and_offset = plan.index.roomNumberAndOffset()
+		log( INFO, f"total number of rooms: {len(room_number_and_offset)}" )
 	except Exception as e:
-		print(f"Error: {e}")
+		log( ERROR, f"Error: {e}" )
+
+	if rooms is not None:
+		room_number_and_offset = [ entry for entry in room_number_and_offset if entry[0] in rooms ]
+		plan.missing_rooms = set( rooms ) - { room_number for room_number, offset in room_number_and_offset }
+		if plan.missing_rooms:
+			log( ERROR, f"No such rooms: {sorted(plan.missing_rooms)}" )
+
+	# work out what is left to do for every room: with incremental extraction,
+	# only outputs whose room data or settings changed since the last run
+	if incremental:
+		plan.manifest = ExtractionManifest.load( os.path.join(output_dir, MANIFEST_FILENAME) )
+
+	manifest = plan.manifest
+	room_hashes = plan.room_hashes
+	for ROOM_NUMBER, ROOM_AB_OFFSET in room_number_and_offset:
+		outputs = output_settings
+		if manifest is not None:
+			room = readBlock( file, ROOM_AB_OFFSET )
+			room_hashes[ ROOM_NUMBER ] = hashRoom( file, room.offset, room.size )
+			if "sounds" in output_settings and plan.index is not None:
+				# sounds come from the SOUN blocks, outside the ROOM block
+				plan.data_hashes[ ROOM_NUMBER ] = { "sounds": hashBlocks( file, plan.index.findAll( ROOM_NUMBER, "SOUN" ) ) }
+			todo = set( output_settings ) if force else manifest.outputsToRedo( ROOM_NUMBER, room_hashes[ ROOM_NUMBER ], output_settings, plan.data_hashes.get( ROOM_NUMBER ) )
+			if "dataset" in output_settings:
+				# the dataset file is written again as a whole
+				todo.add( "dataset" )
+			if not todo:
+				log( INFO, f"room {ROOM_NUMBER} is up to date, skipping" )
+				plan.up_to_date.append( ROOM_NUMBER )
+				continue
+			outputs = { output: output_settings[ output ] for output in todo }
+		plan.tasks.append( (ROOM_NUMBER, ROOM_AB_OFFSET, outputs) )
+
+	return plan
+
+def closeOutputs():
+	# wait for whatever is still being written, returns the list of
+	# (filename, exception) of the files which couldn't be saved
+	shutdownStripPool()
+
+	if sound_writer is not None:
+		# the last batch of sounds
+		sound_writer.flush()
+
+	output_errors = []
+	if output_pipeline is not None:
+		# wait for the last images to be written
+		output_errors = output_pipeline.close()
+	if dataset_writer is not None:
+		# entries and header go in last
+		try:
+			dataset_writer.close()
+			log( INFO, f"{len(dataset_writer.entries)} rooms packed in {dataset_writer.path}" )
+		except OSError as e:
+			output_errors.append( (dataset_writer.path, e) )
+	if sound_writer is not None:
+		output_errors += sound_writer.errors
+		log( INFO, f"{sound_writer.written} sound files saved" )
+	for filename, e in output_errors:
+		log( ERROR, f"Error saving {filename}: {e}" )
+	return output_errors
+
+def extractionSummary( rooms, up_to_date, failed_rooms, missing_rooms, output_errors ):
+	global output_pipeline, content_store, sound_writer, room_names, stream_images, dataset_writer
+	dedup = content_store.dedupReport() if content_store is not None else {}
+	for kind, stats in dedup.items():
+		log( INFO, f"{kind}: {stats['hits']} of {stats['lookups']} reused ({stats['dedup_ratio']:.1%}), {stats['computed']} computed" )
+
+	# nothing is left behind for the next call
+	output_pipeline = None
+	content_store = None
+	sound_writer = None
+	room_names = {}
+	stream_images = False
+	dataset_writer = None
+
+	return {
+		"rooms": rooms,
+		"up_to_date": up_to_date,
+		"failed_rooms": sorted( failed_rooms ),
+		"missing_rooms": sorted( missing_rooms ),
+		"output_errors": [ (filename, str(e)) for filename, e in output_errors ],
+		"dedup": dedup,
+	}
+
+def extractStreaming( file_path, output_dir, rooms, outputs, xor_key=XOR_KEY ):
+	# extract the rooms one after the other, as they come from the file (or
+	# from stdin, if `file_path` is "-"), see streaming.py
+	global output_pipeline, stream_images
+	stream_images = True
+	if OUTPUT_WORKERS > 0:
+		output_pipeline = OutputPipeline( OUTPUT_WORKERS, OUTPUT_QUEUE_SIZE )
+
+	extracted = []
+	failed_rooms = []
+	stream = sys.stdin.buffer if file_path == "-" else open(file_path, 'rb')
+	try:
+		for ROOM_NUMBER, ROOM_AB_OFFSET, reader in streamRooms( stream, xor_key, room_numbers=rooms ):
+			reader.seek( ROOM_AB_OFFSET - 8, 0 )
+			try:
+				with phase("room", ROOM_NUMBER):
+					readLFLF( reader, ROOM_NUMBER, output_dir, outputs )
+				extracted.append( ROOM_NUMBER )
+			except Exception as e:
+				log( ERROR, f"Error extracting room {ROOM_NUMBER}: {e}" )
+				failed_rooms.append( ROOM_NUMBER )
+			# sounds are slices of the room: they are written before the
+			# next room comes in, so only one room at a time is kept
+			if sound_writer is not None:
+				sound_writer.flush()
+	finally:
+		if stream is not sys.stdin.buffer:
+			stream.close()
+	log( INFO, f"total number of rooms: {len(extracted) + len(failed_rooms)}" )
+
+	missing_rooms = set()
+	if rooms is not None:
+		missing_rooms = set( rooms ) - set( extracted ) - set( failed_rooms )
+		if missing_rooms:
+			log( ERROR, f"No such rooms: {sorted(missing_rooms)}" )
+
+	output_errors = closeOutputs()
+	return extractionSummary( extracted, [], failed_rooms, missing_rooms, output_errors )
+
+def extract( file_path=FILE_001, output_dir=".", rooms=None, outputs=None, scale=None, palette_scale=None, image_format=None, cycle_format=None, sound_wrappers=None, workers=None, incremental=None, force=False, index_path=None, streaming=None, xor_key=None ):
+	# Extract `outputs` (see OUTPUT_TYPES; the default ones if None) of the
+	# given `rooms` (all of them if None) of the resource file at
+	# `file_path`, saving them in the folders of `output_dir`. Settings left
+	# to None get their default (see the constants at the top); with
+	# `force`, what is up to date is extracted again too. Room names are
+	# read from `index_path` (by default, the index file next to
+	# `file_path`). With `streaming` (always, if `file_path` is "-" for
+	# stdin), the file is read once, a room at a time (see STREAMING).
+	# Its bytes are XORed with `xor_key` (XOR_KEY by default).
+	# Returns a summary: rooms extracted, rooms up to date, rooms which
+	# couldn't be extracted (or don't exist), files which couldn't be saved
+	# and the dedup ratios of the content store.
+	global output_pipeline, content_store, sound_writer, room_names, dataset_writer
+	workers = EXTRACTION_WORKERS if workers is None else workers
+	xor_key = XOR_KEY if xor_key is None else xor_key
+	room_names = {}
+	if ROOM_NAMES_IN_FILENAMES:
+		room_names = loadRoomNames( index_path or indexFilePath( file_path ), xor_key )
+	incremental = INCREMENTAL_EXTRACTION if incremental is None else incremental
+	output_dir = os.path.abspath( output_dir )
+	output_settings = outputSettings( outputs, scale, palette_scale, image_format, cycle_format, sound_wrappers )
+	for settings in output_settings.values():
+		os.makedirs( os.path.join( output_dir, settings["folder"] ), exist_ok=True )
+
+	content_store = makeContentStore( os.path.join(output_dir, CONTENT_STORE_FOLDER) if CONTENT_STORE_FOLDER else None )
+
+	if "dataset" in output_settings:
+		settings = output_settings["dataset"]
+		dataset_writer = DatasetWriter( outputFilename( output_dir, settings, settings["file"] ) )
+		if workers != 1:
+			log( INFO, "the packed dataset is written by this process only: rooms are extracted one at a time" )
+			workers = 1
+
+	if (STREAMING if streaming is None else streaming) or file_path == "-":
+		return extractStreaming( file_path, output_dir, rooms, output_settings, xor_key )
+
+	# the file is memory-mapped and decoded lazily, page by page,
+	# only when the parser actually touches it
+	file = XorFileReader( file_path, xor_key )
+	plan = planExtraction( file, file_path, output_dir, rooms, output_settings, incremental, force )
+	tasks = plan.tasks
 
 	# rewind pointer to the start of the file
 	file.seek(0)
 
-	# do that for all the rooms
-	for ro in room_number_and_offset :
-		ROOM_NUMBER     = ro[0]
-		ROOM_AB_OFFSET  = ro[1]
-		LFLF_ABS_OFFSET = ROOM_AB_OFFSET - 8
-		current_offset = file.tell()
+	failed_rooms = []
+	if workers != 1 and len(tasks) > 1:
+		# hand rooms over to a pool of worker processes
+		failed_rooms = extractRoomsInParallel( file_path, tasks, output_dir, workers, plan.roomSizes(), xor_key )
+		if failed_rooms:
+			log( ERROR, f"Extraction failed for rooms: {sorted(failed_rooms)}" )
+
+	else:
+		if OUTPUT_WORKERS > 0:
+			output_pipeline = OutputPipeline( OUTPUT_WORKERS, OUTPUT_QUEUE_SIZE )
+
+		# do that for all the rooms
+		for ROOM_NUMBER, ROOM_AB_OFFSET, outputs in tasks:
+			LFLF_ABS_OFFSET = ROOM_AB_OFFSET - 8
+
+			# move file pointer to the correct location in file
+			file.seek( LFLF_ABS_OFFSET, 0)
+			log( DEBUG, file.tell() )
+
+			with phase("room", ROOM_NUMBER):
+				readLFLF( file, ROOM_NUMBER, output_dir, outputs )
 
-		# move file pointer to the correct location in file
-		file.seek( LFLF_ABS_OFFSET, 0)
-		print( file.tell() )
+			# rewind file pointer
+			file.seek(0)
 
-		readLFLF( file, ROOM_NUMBER, current_dir)
+	output_errors = closeOutputs()
 
-		# rewind file pointer
-		file.seek(0)
+	plan.updateManifest( file, output_dir, output_settings, failed_rooms, output_errors )
+	file.close()
+
+	return extractionSummary( [ task[0] for task in tasks if task[0] not in failed_rooms ], plan.up_to_date, failed_rooms, plan.missing_rooms, output_errors )
+
+
+# MAIN #########################################################################
+def roomListArgument( text ):
+	try:
+		return parseRoomList( text )
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"expected room numbers and ranges like 1,3,10-20, got {text!r}")
+
+def xorKeyArgument( text ):
+	try:
+		xor_key = int( text, 0 )
+	except ValueError:
+		xor_key = -1
+	if not 0 <= xor_key <= 255:
+		raise argparse.ArgumentTypeError(f"expected a byte value like 0x69, got {text!r}")
+	return xor_key
+
+def outputListArgument( text ):
+	outputs = [ output.strip() for output in text.split(",") if output.strip() ]
+	for output in outputs:
+		if output not in OUTPUT_TYPES:
+			raise argparse.ArgumentTypeError(f"unknown resource type {output!r} (choose from {', '.join(OUTPUT_TYPES)})")
+	return outputs
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description="Extract room backgrounds, palettes, objects, z-planes and sounds from a SCUMM v5 resource file" )
+	parser.add_argument( "file", nargs="?", default=FILE_001, help=f"resource file, - for stdin (default: {FILE_001})" )
+	parser.add_argument( "--xor-key", type=xorKeyArgument, help=f"XOR key of the resource file, e.g. 0x69 (default: {XOR_KEY:#04x})" )
+	parser.add_argument( "--index-file", help="index file with the room names (default: the .000 file next to FILE)" )
+	parser.add_argument( "-o", "--output-dir", default=".", help="where the output folders are (default: the current folder)" )
+	parser.add_argument( "-r", "--rooms", type=roomListArgument, help="rooms to extract, e.g. 1,3,10-20 (default: all of them)" )
+	parser.add_argument( "-t", "--types", type=outputListArgument, help=f"what to extract, among {', '.join(OUTPUT_TYPES)} (default: {', '.join(defaultOutputs())})" )
+	parser.add_argument( "--scale", type=int, help="scale factor of backgrounds, objects, z-planes and animations" )
+	parser.add_argument( "--palette-scale", type=int, help=f"scale factor of the palette images (default: {PALETTE_IMAGE_SCALE_FACTOR})" )
+	parser.add_argument( "--format", choices=IMAGE_FORMATS, help=f"image format (default: {IMAGE_FORMAT})" )
+	parser.add_argument( "--cycle-format", choices=("gif", "png"), help=f"color cycling animation format (default: {CYCLE_ANIMATION_FORMAT})" )
+	parser.add_argument( "--no-sound-wrappers", action="store_true", help="only save sounds as they are (no MIDI, VOC or WAV files)" )
+	parser.add_argument( "-j", "--workers", type=int, help=f"worker processes, 0 means one per CPU (default: {EXTRACTION_WORKERS})" )
+	parser.add_argument( "--stream", action="store_true", help="read the file once, a room at a time, in constant memory (always done for stdin)" )
+	parser.add_argument( "--force", action="store_true", help="extract everything again, even what is up to date" )
+	parser.add_argument( "-v", "--verbose", action="count", default=0, help="print more (repeat for even more)" )
+	parser.add_argument( "-q", "--quiet", action="store_true", help="only print errors" )
+	parser.add_argument( "--profile", nargs="?", const=PROFILE_REPORT, metavar="REPORT", help=f"time every phase and write a report (default: {PROFILE_REPORT})" )
+	parser.add_argument( "--scan", nargs="?", const=SCAN_CATALOGUE, metavar="CATALOGUE", help=f"decode nothing, only write the catalogue of the rooms (default: {SCAN_CATALOGUE})" )
+	args = parser.parse_args()
+
+	instrumentation.setLogLevel( ERROR if args.quiet else LOG_LEVEL + args.verbose )
+	if args.profile:
+		instrumentation.startProfiling()
+	start_time = time.perf_counter()
+
+	if args.file != "-" and not os.path.exists( args.file ):
+		log( ERROR, f"File {args.file} not found." )
+		raise SystemExit(1)
+
+	if args.scan:
+		# sizes, objects, z-planes and codecs of the rooms, without decoding them
+		if args.file == "-":
+			log( ERROR, "--scan needs a file, not stdin" )
+			raise SystemExit(1)
+		xor_key = XOR_KEY if args.xor_key is None else args.xor_key
+		names = loadRoomNames( args.index_file or indexFilePath( args.file ), xor_key )
+		catalogue = scanFile( args.file, args.rooms, xor_key, names )
+		catalogue_path = os.path.join( args.output_dir, args.scan )
+		saveCatalogue( catalogue, catalogue_path )
+		totals = catalogue["totals"]
+		log( ERROR, f"{totals['rooms']} rooms scanned in {time.perf_counter() - start_time:.3f} s, estimated decode time {totals['estimated_decode_seconds']:.2f} s ({totals['decode_speeds_from']}), catalogue saved to {catalogue_path}" )
+		raise SystemExit(1 if catalogue["missing_rooms"] else 0)
+
+	summary = extract( args.file, args.output_dir, args.rooms, args.types,
+		scale=args.scale,
+		palette_scale=args.palette_scale,
+		image_format=args.format,
+		cycle_format=args.cycle_format,
+		sound_wrappers=False if args.no_sound_wrappers else None,
+		workers=args.workers,
+		force=args.force,
+		streaming=True if args.stream else None,
+		index_path=args.index_file,
+		xor_key=args.xor_key,
+	)
+
+	if instrumentation.profiler is not None:
+		report_path = os.path.join( args.output_dir, args.profile )
+		instrumentation.profiler.save( report_path, time.perf_counter() - start_time, { "dedup": summary["dedup"] } )
+		instrumentation.profiler.printSummary()
+		log( ERROR, f"profile report saved to {report_path}" )
+
+	if summary["failed_rooms"] or summary["missing_rooms"] or summary["output_errors"]:
+		raise SystemExit(1)
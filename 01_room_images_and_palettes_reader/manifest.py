@@ -0,0 +1,104 @@
+# Incremental extraction
+#
+# The manifest remembers, for every room, the hash of its ROOM block and the
+# settings every output (palette image, background image, ...) has been
+# produced with. On the next run, an output is produced again only if the
+# room data, the settings of that output (scale factor, decoder version, ...)
+# or the file itself changed; rooms with nothing left to do are skipped
+# entirely.
+#
+# Some outputs are not made of the ROOM block alone: sounds come from the
+# SOUN blocks, next to it in the LFLF block. For them, the hash of those
+# blocks is kept too (`data_hashes`), and the output is produced again when
+# it changes, even if the ROOM block didn't.
+
+import hashlib
+import json
+import os
+
+from blocks import readView
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = "extraction_manifest.json"
+
+def hashRoom( file, room_offset, room_size ):
+	return hashlib.sha1( readView( file, room_offset, room_size ) ).hexdigest()
+
+def hashBlocks( file, blocks ):
+	# a single hash of the content of several blocks (e.g. every SOUN block
+	# of a room), in their order
+	sha1 = hashlib.sha1()
+	for block in blocks:
+		sha1.update( readView( file, block.offset, block.size ) )
+	return sha1.hexdigest()
+
+
+class ExtractionManifest:
+	def __init__(self, path, rooms=None):
+		self.path = path
+		# room number (as a string) -> {"room_hash": ..., "outputs": {output: {"settings": ..., "files": [...], "data_hash": ...}}}
+		# ("data_hash" only for outputs made of blocks outside the ROOM block)
+		self.rooms = rooms if rooms is not None else {}
+
+	@classmethod
+	def load(cls, path):
+		try:
+			with open(path, 'r') as f:
+				data = json.load( f )
+		except (OSError, ValueError):
+			return cls( path )
+		if data.get("version") != MANIFEST_VERSION:
+			return cls( path )
+		return cls( path, data.get("rooms", {}) )
+
+	def save(self):
+		tmp_path = self.path + ".tmp"
+		with open(tmp_path, 'w') as f:
+			json.dump( { "version": MANIFEST_VERSION, "rooms": self.rooms }, f, indent=1 )
+		os.replace( tmp_path, self.path )
+
+	def outputsToRedo(self, room_number, room_hash, output_settings, data_hashes=None):
+		# `output_settings` maps every wanted output to its settings,
+		# `data_hashes` the outputs made of blocks outside the ROOM block to
+		# the hash of those blocks
+		data_hashes = data_hashes or {}
+		entry = self.rooms.get( str(room_number) )
+		if entry is None or entry.get("room_hash") != room_hash:
+			return set( output_settings )
+
+		todo = set()
+		for output, settings in output_settings.items():
+			done = entry["outputs"].get( output )
+			if done is None or done.get("settings") != settings:
+				todo.add( output )
+			elif output in data_hashes and done.get("data_hash") != data_hashes[ output ]:
+				todo.add( output )
+			elif not all( os.path.exists( filename ) for filename in done.get("files", []) ):
+				todo.add( output )
+		return todo
+
+	def update(self, room_number, room_hash, output_settings, output_files, outputs, data_hashes=None):
+		# remember that `outputs` have been produced for the room, together
+		# with the files they have been saved to (and the hash of their
+		# blocks, see `outputsToRedo`)
+		data_hashes = data_hashes or {}
+		entry = self.rooms.get( str(room_number) )
+		if entry is None or entry.get("room_hash") != room_hash:
+			entry = { "room_hash": room_hash, "outputs": {} }
+			self.rooms[ str(room_number) ] = entry
+		for output in outputs:
+			entry["outputs"][ output ] = {
+				"settings": output_settings[ output ],
+				# (a room without e.g. a CLUT block doesn't produce any file)
+				"files": [ filename for filename in output_files.get( output, [] ) if os.path.exists( filename ) ],
+			}
+			if output in data_hashes:
+				entry["outputs"][ output ]["data_hash"] = data_hashes[ output ]
+
+	def forgetFiles(self, filenames):
+		# outputs whose files couldn't be written will be produced again
+		filenames = set( filenames )
+		for entry in self.rooms.values():
+			for output, done in list( entry["outputs"].items() ):
+				if filenames.intersection( done["files"] ):
+					del entry["outputs"][ output ]
@@ -0,0 +1,194 @@
+# Background output stage
+#
+# Scaling an image up, compressing it as PNG and writing it on disk takes a
+# good share of the time spent on every room, and it doesn't need to happen
+# on the thread which is parsing and decoding the resource file.
+# Images are handed over to a small pool of threads instead (PIL releases the
+# GIL while resizing and compressing). The number of images waiting to be
+# saved is bounded: when the queue is full, whoever is submitting a new image
+# waits for a slot, so memory usage stays bounded even if decoding is faster
+# than writing.
+# Errors are collected and reported when the pipeline is closed.
+#
+# Small files (sounds, thousands of them) are gathered by a BatchWriter
+# instead, and handed over to the pipeline a batch at a time (one task, not
+# one per file).
+# A MemoryOutput takes the place of the pipeline when images are wanted in
+# memory instead of on disk.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import instrumentation
+
+class OutputPipeline:
+	def __init__(self, workers=2, max_pending=8):
+		self.executor = ThreadPoolExecutor( max_workers=workers, thread_name_prefix="output" )
+		self.slots = threading.BoundedSemaphore( max_pending )
+		self.lock = threading.Lock()
+		self.errors = []
+		self.saved = 0
+
+	def submit(self, filename, image, scale_factor=1):
+		# blocks while `max_pending` images are already waiting to be saved
+		self.submitTask( saveImage, filename, image, scale_factor )
+
+	def submitBytes(self, filename, data):
+		# an already encoded image
+		self.submitTask( writeBytes, filename, data )
+
+	def submitTask(self, function, filename, *args):
+		# any other way of writing `filename`: function(filename, *args)
+		self.slots.acquire()
+		try:
+			self.executor.submit( self._save, function, filename, *args )
+		except BaseException:
+			self.slots.release()
+			raise
+
+	def _save(self, function, filename, *args):
+		try:
+			function( filename, *args )
+			with self.lock:
+				self.saved += 1
+		except Exception as e:
+			with self.lock:
+				self.errors.append( (filename, e) )
+		finally:
+			self.slots.release()
+
+	def close(self):
+		# wait for all the pending images, then return the list of
+		# (filename, exception) for the ones which couldn't be saved
+		self.executor.shutdown( wait=True )
+		return self.errors
+
+
+class MemoryOutput:
+	# The interface of OutputPipeline, but nothing is saved: images (not
+	# scaled) and encoded files are kept, by file name, as they come (see
+	# roomserver.py)
+	def __init__(self):
+		self.images = {}    # filename -> (image, scale factor)
+		self.files = {}     # filename -> bytes
+		self.errors = []
+
+	def submit(self, filename, image, scale_factor=1):
+		self.images[ filename ] = (image, scale_factor)
+
+	def submitBytes(self, filename, data):
+		self.files[ filename ] = bytes( data )
+
+	def submitTask(self, function, filename, *args):
+		self.errors.append( (filename, ValueError("only images and encoded files are kept in memory")) )
+
+	def close(self):
+		return self.errors
+
+
+def scaleImage( image, scale_factor=1 ):
+	if scale_factor != 1:
+		# Resize using nearest neighbor (no antialiasing)
+		from PIL import Image
+		new_size = (image.width * scale_factor, image.height * scale_factor)
+		image = image.resize( new_size, Image.NEAREST )
+	return image
+
+def saveImage( filename, image, scale_factor=1 ):
+	with instrumentation.phase("image_save"):
+		scaleImage( image, scale_factor ).save( filename )
+
+def encodeImage( image, scale_factor=1, image_format="png" ):
+	# the image file (PNG, GIF, ...) of an image, in memory
+	with instrumentation.phase("image_save"):
+		buffer = BytesIO()
+		scaleImage( image, scale_factor ).save( buffer, format=image_format )
+		return buffer.getvalue()
+
+def writeBytes( filename, data ):
+	with open(filename, 'wb') as f:
+		f.write( data )
+
+
+# BATCHED WRITES ***************************************************************
+# A file is a list of buffers (headers, memoryview slices of the decoded
+# resource file, ...) which are written as they are with writev: nothing is
+# joined or copied. Buffers are only referenced until their batch is written,
+# and a batch is flushed as soon as it holds `max_files` files or `max_bytes`
+# bytes.
+# Every file still costs an open, a writev and a close: what a batch saves
+# is the handover to the pipeline (a single task and queue slot for the whole
+# batch) and, where the system allows it, the lookup of the folder of every
+# file, which is opened once per batch and the files opened relative to it.
+DIR_FD = os.open in os.supports_dir_fd and hasattr( os, "O_DIRECTORY" )
+
+class BatchWriter:
+	def __init__(self, pipeline=None, max_files=256, max_bytes=4 << 20):
+		self.pipeline = pipeline
+		self.max_files = max_files
+		self.max_bytes = max_bytes
+		self.batch = []
+		self.batch_bytes = 0
+		self.lock = threading.Lock()
+		self.errors = []    # (filename, exception)
+		self.written = 0
+
+	def write(self, filename, buffers):
+		self.batch.append( (filename, buffers) )
+		self.batch_bytes += sum( len(buffer) for buffer in buffers )
+		if len(self.batch) >= self.max_files or self.batch_bytes >= self.max_bytes:
+			self.flush()
+
+	def flush(self):
+		# with a pipeline, the batch is written by one of its threads
+		# (errors are collected here, file by file)
+		batch, self.batch, self.batch_bytes = self.batch, [], 0
+		if not batch:
+			return
+		if self.pipeline is not None:
+			self.pipeline.submitTask( self._writeBatch, batch[0][0], batch )
+		else:
+			self._writeBatch( batch[0][0], batch )
+
+	def _writeBatch(self, first_filename, batch):
+		dir_fds = {}    # folder -> file descriptor
+		with instrumentation.phase("file_write"):
+			try:
+				for filename, buffers in batch:
+					try:
+						if DIR_FD:
+							folder, name = os.path.split( filename )
+							if folder not in dir_fds:
+								dir_fds[ folder ] = os.open( folder or ".", os.O_RDONLY | os.O_DIRECTORY )
+							writeBuffers( name, buffers, dir_fds[ folder ] )
+						else:
+							writeBuffers( filename, buffers )
+					except OSError as e:
+						with self.lock:
+							self.errors.append( (filename, e) )
+						continue
+					with self.lock:
+						self.written += 1
+			finally:
+				for fd in dir_fds.values():
+					os.close( fd )
+
+def writeBuffers( filename, buffers, dir_fd=None ):
+	# `filename` is relative to the folder open as `dir_fd`, if any
+	buffers = [ buffer for buffer in buffers if len(buffer) ]
+	flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr( os, "O_BINARY", 0 )
+	fd = os.open( filename, flags, 0o666 ) if dir_fd is None else os.open( filename, flags, 0o666, dir_fd=dir_fd )
+	try:
+		while buffers:
+			# both writev and write may write less than asked: go on from
+			# where they stopped
+			written = os.writev( fd, buffers ) if hasattr( os, "writev" ) else os.write( fd, buffers[0] )
+			while buffers and written >= len(buffers[0]):
+				written -= len(buffers[0])
+				buffers.pop(0)
+			if buffers and written:
+				buffers[0] = memoryview( buffers[0] )[ written: ]
+	finally:
+		os.close( fd )
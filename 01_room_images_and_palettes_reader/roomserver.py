@@ -0,0 +1,397 @@
+# Room images on demand, over HTTP (localhost)
+#
+# Instead of extracting every room on disk, the images of a room are decoded
+# when they are first asked for, by the very same readers main.py uses
+# (readLFLF and readRoomData), with a MemoryOutput in place of the output
+# pipeline:
+#
+# GET /rooms                                 rooms, with their names (JSON)
+# GET /room/<n>                              images of room n (JSON)
+# GET /room/<n>/background.png
+# GET /room/<n>/background.png?box=L,T,R,B   only that part of it (left, top,
+#                                            right, bottom), e.g. a viewport
+# GET /room/<n>/preview.png?step=N           a preview N times smaller (one
+#                                            strip and one row out of N)
+# GET /room/<n>/palette.png
+# GET /room/<n>/zplane/<k>.png               k = 1, 2, ...
+# GET /room/<n>/object/<obj>/<image>.png     obj: the OBIM number in the room,
+#                                            image: the state (1, 2, ...)
+# GET /stats                                 cache lookups and hits (JSON)
+#
+# Every image takes `?scale=N` (by default, the scale factors of main.py).
+#
+# Rooms are decoded by a pool of worker processes, so the event loop is never
+# blocked and several rooms can be decoded at the same time; requests for a
+# room which is already being decoded wait for that same decode. Decoded
+# pixels and encoded PNG files are kept in a content store (see
+# contentstore.py, least recently used out first) up to SERVER_CACHE_BUDGET
+# bytes: once a room is there, an image is a dictionary lookup away.
+# Parts of backgrounds and previews of rooms never decoded only cost the
+# strips they need (see main.readBackgroundRegion), and they don't bring the
+# whole room in; once the room is there, they're cut out of it.
+#
+# usage: python roomserver.py [FILE] [--port 8000] [-j WORKERS]
+
+import argparse
+import asyncio
+import json
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+import main
+import instrumentation
+from instrumentation import log, ERROR, INFO, DEBUG
+from xorfile import XorFileReader
+from blockindex import loadOrBuildIndex
+from contentstore import ContentStore
+from outputpipeline import MemoryOutput, encodeImage
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+
+# worker processes decoding rooms
+SERVER_WORKERS = 2
+
+# bytes of decoded pixels and encoded PNG files kept in memory
+SERVER_CACHE_BUDGET = 64 << 20
+
+MAX_SCALE = 16
+
+# `preview.png` is that many times smaller than the background, by default
+PREVIEW_STEP = 4
+MAX_PREVIEW_STEP = 64
+
+# what a room is decoded into, and the output (see main.py) giving the
+# default scale factor of every kind of image
+ROOM_OUTPUTS = ("palette", "background", "objects", "zplanes")
+IMAGE_OUTPUTS = { "palette": "palette", "background": "background", "preview": "background", "object": "objects", "zplane": "zplanes" }
+
+IMAGE_PATH = re.compile(r"^/room/(\d+)/(background|palette|preview|zplane/(\d+)|object/(\d+)/(\d+))\.png$")
+ROOM_PATH = re.compile(r"^/room/(\d+)/?$")
+
+HTTP_REASONS = { 200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error" }
+
+# a decoded image: its pixels are kept in the content store, apart from the rest
+RoomImage = namedtuple("RoomImage", "mode width height pixels palette transparency")
+
+# DECODING (worker processes) **************************************************
+_worker_index = None
+
+def initServerWorker( file_path, log_level=INFO ):
+	global _worker_index
+	main.initExtractionWorker( file_path, log_level )
+	# palettes are wanted as images, not as encoded files: no content store
+	main.content_store = None
+	_worker_index = loadOrBuildIndex( main._worker_file, file_path )
+
+def imageName( filename ):
+	# the path of an image in the URLs (e.g. "zplane/1"), from the name of
+	# the file it would have been saved to
+	folder, name = os.path.split( filename )
+	if folder == "palettes":
+		return "palette"
+	if folder == "backgrounds":
+		return "background"
+	match = re.search( r"_zp(\d+)\.", name )
+	if folder == "zplanes" and match:
+		return f"zplane/{int( match.group(1) )}"
+	match = re.search( r"_obj(\d+)_im(\d+)\.", name )
+	if folder == "objects" and match:
+		return f"object/{int( match.group(1) )}/{int( match.group(2) )}"
+	return None
+
+def decodeRoomImages( room_number, room_abs_offset ):
+	# {image name: RoomImage} of every image of a room, not scaled
+	memory = MemoryOutput()
+	main.output_pipeline = memory
+	try:
+		outputs = main.outputSettings( ROOM_OUTPUTS, scale=1, palette_scale=1, image_format="png" )
+		main._worker_file.seek( room_abs_offset - 8, 0 )
+		main.readLFLF( main._worker_file, room_number, "", outputs )
+	finally:
+		main.output_pipeline = None
+
+	images = {}
+	for filename, (image, scale_factor) in memory.images.items():
+		name = imageName( filename )
+		if name is None:
+			continue
+		palette = image.getpalette() if image.mode == "P" else None
+		images[ name ] = RoomImage( image.mode, image.width, image.height, image.tobytes(), bytes( palette ) if palette else None, image.info.get("transparency") )
+	return images
+
+def writerImage( image_writer ):
+	return RoomImage( "P", image_writer.width, image_writer.height, bytes( image_writer.indices ), image_writer.palette, image_writer.transparent_index )
+
+def decodeBackgroundPart( room_number, box=None, step=None ):
+	# a part (`box`) or the preview (`step`) of a room background, as a
+	# RoomImage, None if the room has no background
+	if box is not None:
+		image_writer = main.readBackgroundRegion( main._worker_file, _worker_index, room_number, box )
+	else:
+		image_writer = main.readBackgroundPreview( main._worker_file, _worker_index, room_number, step )
+	return writerImage( image_writer ) if image_writer is not None else None
+
+def cropImage( image, box ):
+	# the same part of a background, out of its decoded pixels
+	left, top, right, bottom = box
+	if not (0 <= left < right <= image.width and 0 <= top < bottom <= image.height):
+		raise ValueError(f"box {box} is not inside the {image.width}x{image.height} image")
+	pixels = b"".join( image.pixels[ y*image.width + left : y*image.width + right ] for y in range( top, bottom ) )
+	return image._replace( width=right - left, height=bottom - top, pixels=pixels )
+
+def previewImage( image, step ):
+	# the same preview as smap.decodePreview, out of the decoded pixels
+	preview_width = 8 * len( range( 0, image.width // 8, step ) )
+	rows = [ image.pixels[ y*image.width : (y+1)*image.width ] for y in range( 0, image.height, step ) ]
+	pixels = b"".join( row[ x : x + 8 ] for row in rows for x in range( 0, preview_width * step, 8 * step ) )
+	return image._replace( width=preview_width, height=len(rows), pixels=pixels )
+
+def encodeRoomImage( image, scale_factor ):
+	pil_image = Image.frombytes( image.mode, (image.width, image.height), image.pixels )
+	if image.palette is not None:
+		pil_image.putpalette( image.palette )
+	if image.transparency is not None:
+		pil_image.info["transparency"] = image.transparency
+	return encodeImage( pil_image, scale_factor, "png" )
+
+
+# SERVER ***********************************************************************
+class RoomServer:
+	def __init__(self, file_path, workers=SERVER_WORKERS, cache_budget=SERVER_CACHE_BUDGET):
+		with XorFileReader( file_path ) as file:
+			index = loadOrBuildIndex( file, file_path )
+			self.room_offsets = dict( index.roomNumberAndOffset() )
+		self.room_names = main.loadRoomNames( main.indexFilePath( file_path ) )
+		self.cache = ContentStore( cache_budget )
+		self.rooms = {}     # room number -> {image name: RoomImage, without pixels}
+		self.decoding = {}  # room number -> future of its decode
+		self.default_scales = { name: settings["scale"] for name, settings in main.outputSettings( ROOM_OUTPUTS ).items() }
+		self.executor = ProcessPoolExecutor( max_workers=workers, initializer=initServerWorker, initargs=(file_path, instrumentation.log_level) )
+
+	def close(self):
+		self.executor.shutdown( wait=True )
+
+	async def roomImages(self, room_number):
+		# decode a room: whoever asks for it while it's being decoded waits
+		# for that same decode
+		future = self.decoding.get( room_number )
+		if future is None:
+			future = asyncio.ensure_future( self._decode( room_number ) )
+			self.decoding[ room_number ] = future
+			future.add_done_callback( lambda f: self.decoding.pop( room_number, None ) )
+		# a client going away doesn't cancel the decode for the others
+		return await asyncio.shield( future )
+
+	async def _decode(self, room_number):
+		log( INFO, f"decoding room {room_number}" )
+		loop = asyncio.get_running_loop()
+		images = await loop.run_in_executor( self.executor, decodeRoomImages, room_number, self.room_offsets[ room_number ] )
+		for name, image in images.items():
+			self.cache.put( "room_pixels", f"{room_number}/{name}", image.pixels )
+		self.rooms[ room_number ] = { name: image._replace( pixels=None ) for name, image in images.items() }
+		return images
+
+	async def image(self, room_number, name, scale_factor):
+		# the PNG file of an image, None if there's no such image
+		key = f"{room_number}/{name}/{scale_factor}"
+		data = self.cache.get( "room_png", key )
+		if data is not None:
+			return data
+
+		if room_number in self.rooms and name not in self.rooms[ room_number ]:
+			return None
+		image = self.rooms.get( room_number, {} ).get( name )
+		pixels = self.cache.get( "room_pixels", f"{room_number}/{name}" ) if image is not None else None
+		if pixels is not None:
+			image = image._replace( pixels=pixels )
+		else:
+			# never decoded, or its pixels were evicted
+			image = (await self.roomImages( room_number )).get( name )
+			if image is None:
+				return None
+
+		loop = asyncio.get_running_loop()
+		data = await loop.run_in_executor( None, encodeRoomImage, image, scale_factor )
+		self.cache.put( "room_png", key, data )
+		return data
+
+	async def backgroundPart(self, room_number, scale_factor, box=None, step=None):
+		# the PNG file of a part (`box`) or of the preview (`step`) of the
+		# background, None if the room has no background
+		name = f"background/{','.join( map( str, box ) )}" if box is not None else f"preview/{step}"
+		key = f"{room_number}/{name}/{scale_factor}"
+		data = self.cache.get( "room_png", key )
+		if data is not None:
+			return data
+
+		loop = asyncio.get_running_loop()
+		background = self.rooms.get( room_number, {} ).get( "background" )
+		pixels = self.cache.get( "room_pixels", f"{room_number}/background" ) if background is not None else None
+		if pixels is not None:
+			# the whole room is already there: cut the part out of it
+			background = background._replace( pixels=pixels )
+			image = cropImage( background, box ) if box is not None else previewImage( background, step )
+		elif room_number in self.rooms:
+			return None
+		else:
+			image = await loop.run_in_executor( self.executor, decodeBackgroundPart, room_number, box, step )
+			if image is None:
+				return None
+
+		data = await loop.run_in_executor( None, encodeRoomImage, image, scale_factor )
+		self.cache.put( "room_png", key, data )
+		return data
+
+	# HTTP *********************************************************************
+	async def respond(self, method, target):
+		# (status, content type, body)
+		if method != "GET":
+			return 405, "text/plain", b"only GET is supported\n"
+		url = urlsplit( target )
+		path = url.path
+		query = parse_qs( url.query )
+
+		if path in ("/", "/rooms"):
+			rooms = [ { "room": room_number, "name": self.room_names.get( room_number ), "offset": offset } for room_number, offset in sorted( self.room_offsets.items() ) ]
+			return 200, "application/json", json.dumps( rooms ).encode('utf-8')
+
+		if path == "/stats":
+			stats = { "cache_bytes": self.cache.size, "cache_budget": self.cache.byte_budget, "cache": self.cache.dedupReport(), "decoded_rooms": sorted( self.rooms ) }
+			return 200, "application/json", json.dumps( stats ).encode('utf-8')
+
+		match = ROOM_PATH.match( path )
+		if match:
+			room_number = int( match.group(1) )
+			if room_number not in self.room_offsets:
+				return 404, "text/plain", f"no room {room_number}\n".encode('ascii')
+			if room_number not in self.rooms:
+				await self.roomImages( room_number )
+			images = { name: { "mode": image.mode, "width": image.width, "height": image.height } for name, image in sorted( self.rooms[ room_number ].items() ) }
+			return 200, "application/json", json.dumps( { "room": room_number, "name": self.room_names.get( room_number ), "images": images } ).encode('utf-8')
+
+		match = IMAGE_PATH.match( path )
+		if match is None:
+			return 404, "text/plain", b"not found\n"
+		room_number = int( match.group(1) )
+		if room_number not in self.room_offsets:
+			return 404, "text/plain", f"no room {room_number}\n".encode('ascii')
+		name = match.group(2)
+		if match.group(3) is not None:
+			name = f"zplane/{int( match.group(3) )}"
+		elif match.group(4) is not None:
+			name = f"object/{int( match.group(4) )}/{int( match.group(5) )}"
+
+		scale_factor = self.default_scales[ IMAGE_OUTPUTS[ name.split("/")[0] ] ]
+		if "scale" in query:
+			try:
+				scale_factor = int( query["scale"][0] )
+			except ValueError:
+				scale_factor = 0
+			if not 1 <= scale_factor <= MAX_SCALE:
+				return 400, "text/plain", f"scale must be between 1 and {MAX_SCALE}\n".encode('ascii')
+
+		if name == "preview" or (name == "background" and "box" in query):
+			box = None
+			step = PREVIEW_STEP
+			try:
+				if name == "background":
+					box = tuple( int( value ) for value in query["box"][0].split(",") )
+					if len(box) != 4:
+						raise ValueError
+				elif "step" in query:
+					step = int( query["step"][0] )
+			except ValueError:
+				return 400, "text/plain", b"box must be LEFT,TOP,RIGHT,BOTTOM and step a number\n"
+			if not 1 <= step <= MAX_PREVIEW_STEP:
+				return 400, "text/plain", f"step must be between 1 and {MAX_PREVIEW_STEP}\n".encode('ascii')
+			try:
+				data = await self.backgroundPart( room_number, scale_factor, box, step )
+			except ValueError as e:
+				return 400, "text/plain", f"{e}\n".encode('utf-8')
+			name = "background"
+		else:
+			data = await self.image( room_number, name, scale_factor )
+		if data is None:
+			return 404, "text/plain", f"room {room_number} has no {name}\n".encode('ascii')
+		return 200, "image/png", data
+
+	async def handle(self, reader, writer):
+		# HTTP/1.1 requests on a connection, one after the other
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line:
+					break
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if line in (b"\r\n", b"\n", b""):
+						break
+					header, _, value = line.decode('latin-1').partition(":")
+					headers[ header.strip().lower() ] = value.strip()
+
+				parts = request_line.decode('latin-1').split()
+				if len(parts) != 3:
+					status, content_type, body = 400, "text/plain", b"bad request\n"
+					keep_alive = False
+				else:
+					method, target, version = parts
+					try:
+						status, content_type, body = await self.respond( method, target )
+					except Exception as e:
+						log( ERROR, f"{method} {target}: {e}" )
+						status, content_type, body = 500, "text/plain", f"{e}\n".encode('utf-8', 'replace')
+					keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+					log( DEBUG, f"{method} {target} {status} ({len(body)} bytes)" )
+
+				writer.write( b"".join((
+					f"HTTP/1.1 {status} {HTTP_REASONS.get( status, '' )}\r\n".encode('ascii'),
+					f"Content-Type: {content_type}\r\n".encode('ascii'),
+					f"Content-Length: {len(body)}\r\n".encode('ascii'),
+					b"Connection: keep-alive\r\n" if keep_alive else b"Connection: close\r\n",
+					b"\r\n",
+					body,
+				)) )
+				await writer.drain()
+				if not keep_alive:
+					break
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+async def serve( file_path, host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS, cache_budget=SERVER_CACHE_BUDGET ):
+	room_server = RoomServer( file_path, workers, cache_budget )
+	try:
+		server = await asyncio.start_server( room_server.handle, host, port )
+		log( ERROR, f"serving {len(room_server.room_offsets)} rooms of {file_path} on http://{host}:{port}/" )
+		async with server:
+			await server.serve_forever()
+	finally:
+		room_server.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description="Serve the room images of a SCUMM v5 resource file over HTTP" )
+	parser.add_argument( "file", nargs="?", default=main.FILE_001, help=f"resource file (default: {main.FILE_001})" )
+	parser.add_argument( "--host", default=SERVER_HOST, help=f"address to listen on (default: {SERVER_HOST})" )
+	parser.add_argument( "--port", type=int, default=SERVER_PORT, help=f"port to listen on (default: {SERVER_PORT})" )
+	parser.add_argument( "-j", "--workers", type=int, default=SERVER_WORKERS, help=f"worker processes decoding rooms (default: {SERVER_WORKERS})" )
+	parser.add_argument( "--cache-size", type=int, default=SERVER_CACHE_BUDGET >> 20, help=f"MB of decoded rooms and images kept in memory (default: {SERVER_CACHE_BUDGET >> 20})" )
+	parser.add_argument( "-v", "--verbose", action="count", default=0, help="print more (repeat for even more)" )
+	args = parser.parse_args()
+
+	instrumentation.setLogLevel( main.LOG_LEVEL + args.verbose )
+	if not os.path.exists( args.file ):
+		log( ERROR, f"File {args.file} not found." )
+		raise SystemExit(1)
+	try:
+		asyncio.run( serve( args.file, args.host, args.port, max( 1, args.workers ), args.cache_size << 20 ) )
+	except KeyboardInterrupt:
+		pass
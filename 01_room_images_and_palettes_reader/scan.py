@@ -0,0 +1,208 @@
+# Scan of a resource file: a catalogue of its rooms, without decoding them
+#
+# Everything needed to plan an extraction is in a few small blocks of every
+# room, found through the block index (see blockindex.py):
+#
+# * RMHD: width, height and number of objects;
+# * TRNS: transparent palette index;
+# * RMIH: number of z-planes;
+# * SMAP: the table of strip offsets and, for every strip, its first byte
+#   (the compression ID, see smap.py).
+#
+# Only those bytes are read (and XOR decoded): not a single pixel is decoded,
+# and neither PIL nor NumPy are imported, so a whole game is scanned in a
+# fraction of a second.
+#
+# The decode time of every room is estimated from its pixels and how fast
+# every codec is: the figures of the last benchmark run (see benchmark.py),
+# when there is one, or the DECODE_SPEEDS below.
+#
+# The catalogue is saved as JSON (rooms and totals) or, if its name ends with
+# .csv, as a table with one row per room.
+
+import csv
+import json
+import os
+import time
+
+from instrumentation import log, ERROR, INFO, DEBUG
+from xorfile import XorFileReader
+from blockindex import loadOrBuildIndex
+from blocks import readView
+from smap import codecName
+
+# pixels decoded per second by every codec (and by the z-plane decoder),
+# when there is no benchmark history to take them from
+DECODE_SPEEDS = {
+	"uncompressed": 500e6,
+	"method1_vertical": 1.8e6,
+	"method1_horizontal": 4.4e6,
+	"method2_horizontal": 2.7e6,
+	"zplane": 300e6,
+}
+
+# written by benchmark.py, next to this file
+BENCHMARK_HISTORY = os.path.join( os.path.dirname( os.path.abspath(__file__) ), "benchmark_history.jsonl" )
+
+# codec columns of the CSV catalogue
+CODEC_NAMES = ("uncompressed", "method1_vertical", "method1_horizontal", "method2_horizontal", "unknown")
+
+def decodeSpeeds( history_path=BENCHMARK_HISTORY ):
+	# DECODE_SPEEDS, updated with the figures of the last benchmark run
+	speeds = dict( DECODE_SPEEDS )
+	if history_path is None or not os.path.exists( history_path ):
+		return speeds, "defaults"
+	try:
+		with open(history_path, 'r') as f:
+			entries = [ json.loads( line ) for line in f if line.strip() ]
+	except (OSError, ValueError) as e:
+		log( ERROR, f"Unable to read benchmark history {history_path}: {e}" )
+		return speeds, "defaults"
+	for entry in reversed( entries ):
+		results = entry.get("results", {})
+		measured = { key[len("codec_"):-len("_px_s")]: value for key, value in results.items() if key.startswith("codec_") and key.endswith("_px_s") }
+		if "zplane_px_s" in results:
+			measured["zplane"] = results["zplane_px_s"]
+		if measured:
+			speeds.update( measured )
+			return speeds, f"benchmark of {entry.get('date', '?')}"
+	return speeds, "defaults"
+
+def littleEndian( data, start=0 ):
+	return int.from_bytes( data[ start : start + 2 ], byteorder='little', signed=False )
+
+
+# ROOMS ************************************************************************
+def roomBackgroundBlock( index, room_number, block_name ):
+	# the block of the room background image (RMIM > RMIH, or RMIM > IM00 >
+	# SMAP), not the ones of the object images with the same name
+	for block in index.findAll( room_number, block_name ):
+		parent = index.blocks[ block.parent ]
+		if parent.name == "RMIM" or (parent.name == "IM00" and index.blocks[ parent.parent ].name == "RMIM"):
+			return block
+	return None
+
+def stripCompressionIds( file, smap, num_strips ):
+	# the first byte of every strip (None for offsets outside the block)
+	offsets = readView( file, smap.offset + 8, 4 * num_strips )
+	compression_ids = []
+	for i in range( len(offsets) // 4 ):
+		offset = int.from_bytes( offsets[ 4*i : 4*i + 4 ], byteorder='little', signed=False )
+		if offset < 8 or offset >= smap.size:
+			compression_ids.append( None )
+			continue
+		compression_ids.append( readView( file, smap.offset + offset, 1 )[0] )
+	return compression_ids
+
+def scanRoom( file, index, room_number, speeds, name=None ):
+	lflf = index.blocks[ index.rooms[ room_number ] ]
+	room = index.find( room_number, "ROOM" )
+	entry = {
+		"room": room_number,
+		"name": name,
+		"offset": lflf.offset + 8,
+		"size": room.size if room is not None else 0,
+		"width": 0,
+		"height": 0,
+		"objects": 0,
+		"zplanes": 0,
+		"transparent": None,
+		"strips": 0,
+		"codecs": {},
+		"compression_ids": {},
+		"estimated_decode_seconds": 0.0,
+	}
+
+	rmhd = index.find( room_number, "RMHD" )
+	if rmhd is not None:
+		data = readView( file, rmhd.offset + 8, 6 )
+		entry["width"], entry["height"], entry["objects"] = littleEndian( data, 0 ), littleEndian( data, 2 ), littleEndian( data, 4 )
+
+	trns = index.find( room_number, "TRNS" )
+	if trns is not None:
+		entry["transparent"] = littleEndian( readView( file, trns.offset + 8, 2 ) )
+
+	rmih = roomBackgroundBlock( index, room_number, "RMIH" )
+	if rmih is not None:
+		entry["zplanes"] = littleEndian( readView( file, rmih.offset + 8, 2 ) )
+
+	smap = roomBackgroundBlock( index, room_number, "SMAP" )
+	if smap is not None:
+		compression_ids = stripCompressionIds( file, smap, entry["width"] // 8 )
+		entry["strips"] = len( compression_ids )
+		for compression_id in compression_ids:
+			codec = codecName( compression_id ) if compression_id is not None else "unknown"
+			entry["codecs"][ codec ] = entry["codecs"].get( codec, 0 ) + 1
+			if compression_id is not None:
+				key = f"0x{compression_id:02X}"
+				entry["compression_ids"][ key ] = entry["compression_ids"].get( key, 0 ) + 1
+		if None in compression_ids:
+			log( ERROR, f"room {room_number}: {compression_ids.count( None )} strip offsets point outside the SMAP block" )
+
+	# strips of unknown codecs can't be decoded at all: they cost nothing
+	strip_pixels = 8 * entry["height"]
+	seconds = sum( count * strip_pixels / speeds[ codec ] for codec, count in entry["codecs"].items() if codec in speeds )
+	seconds += entry["width"] * entry["height"] * entry["zplanes"] / speeds["zplane"]
+	entry["estimated_decode_seconds"] = round( seconds, 6 )
+	return entry
+
+def scanFile( file_path, rooms=None, xor_key=0x69, names=None, history_path=BENCHMARK_HISTORY ):
+	# the catalogue of the rooms of a resource file (all of them if `rooms`
+	# is None), `names` maps room numbers to room names
+	start_time = time.perf_counter()
+	names = names or {}
+	speeds, speeds_source = decodeSpeeds( history_path )
+	with XorFileReader( file_path, xor_key ) as file:
+		index = loadOrBuildIndex( file, file_path, None, rooms )
+		room_numbers = sorted( index.rooms ) if rooms is None else [ room for room in sorted( rooms ) if room in index.rooms ]
+		missing_rooms = [] if rooms is None else sorted( set( rooms ) - set( index.rooms ) )
+		for room_number in missing_rooms:
+			log( ERROR, f"room {room_number} not found in {file_path}" )
+
+		catalogue = []
+		for room_number in room_numbers:
+			entry = scanRoom( file, index, room_number, speeds, names.get( room_number ) )
+			log( INFO, f"room {room_number}: {entry['width']}x{entry['height']}, {entry['objects']} objects, {entry['zplanes']} z-planes, "
+				f"{entry['strips']} strips, ~{entry['estimated_decode_seconds'] * 1000:.1f} ms to decode" )
+			log( DEBUG, f"room {room_number} codecs: {entry['codecs']}, compression IDs: {entry['compression_ids']}" )
+			catalogue.append( entry )
+
+	codecs = {}
+	for entry in catalogue:
+		for codec, count in entry["codecs"].items():
+			codecs[ codec ] = codecs.get( codec, 0 ) + count
+	return {
+		"file": file_path,
+		"rooms": catalogue,
+		"missing_rooms": missing_rooms,
+		"totals": {
+			"rooms": len( catalogue ),
+			"pixels": sum( entry["width"] * entry["height"] for entry in catalogue ),
+			"strips": sum( entry["strips"] for entry in catalogue ),
+			"codecs": codecs,
+			"estimated_decode_seconds": round( sum( entry["estimated_decode_seconds"] for entry in catalogue ), 6 ),
+			"decode_speeds": speeds,
+			"decode_speeds_from": speeds_source,
+			"scan_seconds": round( time.perf_counter() - start_time, 6 ),
+		},
+	}
+
+
+# CATALOGUE ********************************************************************
+def saveCatalogue( catalogue, path ):
+	# JSON, or CSV if `path` ends with .csv (one row per room)
+	if not path.lower().endswith(".csv"):
+		with open(path, 'w') as f:
+			json.dump( catalogue, f, indent=1 )
+		return
+
+	columns = ["room", "name", "offset", "size", "width", "height", "objects", "zplanes", "transparent", "strips"] + list( CODEC_NAMES ) + ["compression_ids", "estimated_decode_seconds"]
+	with open(path, 'w', newline='') as f:
+		writer = csv.DictWriter( f, columns, extrasaction='ignore' )
+		writer.writeheader()
+		for entry in catalogue["rooms"]:
+			row = dict( entry )
+			for codec in CODEC_NAMES:
+				row[ codec ] = entry["codecs"].get( codec, 0 )
+			row["compression_ids"] = " ".join( f"{key}:{count}" for key, count in sorted( entry["compression_ids"].items() ) )
+			writer.writerow( row )
@@ -0,0 +1,735 @@
+# SMAP strip codec
+#
+# A room background (and every object image) is made of vertical strips 8
+# pixels wide. The SMAP block starts with a table of offsets (one per strip,
+# relative to the beginning of the SMAP block header) and every strip is
+# compressed on its own, so each of them can be decoded independently from
+# the others.
+#
+#ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
+#ref: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
+
+from io import BytesIO
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+
+# to be increased whenever a change to the decoders changes decoded pixels
+# (images produced by an older decoder are then extracted again)
+DECODER_VERSION = 2
+
+# strips of rooms at least this wide are decoded by a pool of processes
+# (when more than one strip worker is configured), narrower rooms don't pay
+# back the cost of sending strips around
+MIN_STRIPS_FOR_PARALLEL_DECODING = 64
+
+"""
+#ref: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
+# IMAGE COMPRESSION TABLE ******************************************************
+IDs 			Method 			Rendering Direction 	Transparent 	Param Subtraction 	Remarks
+0x01 			Uncompressed 	Horizontal 				No 				-			 		-
+0x0E .. 0x12 	1st method 		Vertical 				No 				0x0A			 	-
+0x18 .. 0x1C 	1st method 		Horizontal 				No 				0x14			 	-
+0x22 .. 0x26 	1st method 		Vertical 				Yes 			0x1E			 	-
+0x2C .. 0x30 	1st method 		Horizontal 				Yes 			0x28			 	-
+0x40 .. 0x44 	2nd method 		Horizontal 				No 				0x3C			 	-
+0x54 .. 0x58 	2nd method 		Horizontal 				Yes 			0x51			 	-
+0x68 .. 0x6C 	2nd method 		Horizontal 				Yes 			0x64			 	Same as 0x54 .. 0x58
+0x7C .. 0x80 	2nd method 		Horizontal 				No 				0x78			 	Same as 0x40 .. 0x44
+
+"""
+def getDecoderSettings( compressionId ):
+	method    = None
+	direction = None
+	transparent = None
+	parSub = None
+
+	if compressionId == 0x01:
+		method      = "Uncompressed"
+		direction   = "Horizontal"
+		transparent = "No"
+		parSub      = 0
+	elif compressionId >= 0x0E and compressionId <= 0x12:
+		method      = "1st"
+		direction   = "Vertical"
+		transparent = "No"
+		parSub      = 0x0A
+	elif compressionId >= 0x18 and compressionId <= 0x1C:
+		method      = "1st"
+		direction   = "Horizontal"
+		transparent = "No"
+		parSub      = 0x14
+	elif compressionId >= 0x22 and compressionId <= 0x26:
+		method      = "1st"
+		direction   = "Vertical"
+		transparent = "Yes"
+		parSub      = 0x1E
+	elif compressionId >= 0x2C and compressionId <= 0x30:
+		method      = "1st"
+		direction   = "Horizontal"
+		transparent = "Yes"
+		parSub      = 0x28
+	elif compressionId >= 0x40 and compressionId <= 0x44:
+		method      = "2nd"
+		direction   = "Horizontal"
+		transparent = "No"
+		parSub      = 0x3C
+	elif compressionId >= 0x54 and compressionId <= 0x58:
+		method      = "2nd"
+		direction   = "Horizontal"
+		transparent = "Yes"
+		parSub      = 0x51
+	elif compressionId >= 0x68 and compressionId <= 0x6C:
+		method      = "2nd"
+		direction   = "Horizontal"
+		transparent = "Yes"
+		parSub      = 0x64
+	elif compressionId >= 0x7C and compressionId <= 0x80:
+		method      = "2nd"
+		direction   = "Horizontal"
+		transparent = "No"
+		parSub      = 0x78
+
+	return (method,direction,transparent,parSub)
+
+
+class BitReaderLSB:
+	def __init__(self, byte_stream):
+
+		self.stream = byte_stream
+		self.current_byte = 0           # Byte actually beeing read
+		self.bit_position = 8           # bit position (8 means load a new byte)
+
+	def read_bit(self):
+		if self.bit_position == 8:      # if all the bit of the current byte have been read
+			byte = self.stream.read(1)  # Read the next byte
+			if not byte:                # if we don't have no more availalbe bytes
+				raise EOFError("End of stream")
+			self.current_byte = ord(byte)  # get the byte as integer
+			self.bit_position = 0          # Reset bit position
+
+		# Extract current least significative bit
+		bit = (self.current_byte >> self.bit_position) & 1
+		#print(f"read bit {bit}")
+		self.bit_position += 1
+		return bit
+
+	def read_bits(self, n):
+		# read n bit and return them as an integer
+		# with the last bit read ad LSB.
+		value = 0
+		for i in range(n):
+			bit = self.read_bit()
+			# Place every bit which has been read in the correct position (last bis as LSB)
+			value |= (bit << i)
+		return value
+
+	# NOTE: this reader pays a method call for every single bit; it is kept
+	#       as a reference implementation to cross-check BufferedBitReaderLSB
+	#       (see decodeStrip's `reference` argument).
+
+
+class BufferedBitReaderLSB:
+	# Same bit order as BitReaderLSB (least significant bit first), but it
+	# works on a memoryview of the strip and keeps up to 64 bits in an
+	# accumulator, refilled several bytes at a time. Multi-bit fields are
+	# then extracted with a single shift and mask.
+	def __init__(self, data, position=0):
+		self.data = memoryview(data)
+		self.position = position        # next byte to be loaded in the accumulator
+		self.bits = 0                   # accumulator (next bit to be read is bit 0)
+		self.count = 0                  # number of valid bits in the accumulator
+
+	def refill(self):
+		num_bytes = (64 - self.count) >> 3
+		chunk = self.data[ self.position : self.position + num_bytes ]
+		self.bits |= int.from_bytes( chunk, 'little' ) << self.count
+		self.count += len(chunk) << 3
+		self.position += len(chunk)
+
+	def read_bit(self):
+		if not self.count:
+			self.refill()
+			if not self.count:
+				raise EOFError("End of stream")
+		bit = self.bits & 1
+		self.bits >>= 1
+		self.count -= 1
+		return bit
+
+	def read_bits(self, n):
+		if self.count < n:
+			self.refill()
+			if self.count < n:
+				raise EOFError("End of stream")
+		value = self.bits & ((1 << n) - 1)
+		self.bits >>= n
+		self.count -= n
+		return value
+
+
+# CODEC ENGINE *****************************************************************
+# Decoder descriptors: every compression ID is mapped once to a small integer
+# describing how its strips have to be decoded, so that the decoders don't
+# have to go through the `getDecoderSettings` string comparisons.
+#   bits 0-1 : method (see METHOD_* below)
+#   bit  2   : vertical rendering direction
+#   bit  3   : transparent
+#   bits 4-7 : palette index size (in bits)
+METHOD_NONE         = 0
+METHOD_UNCOMPRESSED = 1
+METHOD_1ST          = 2
+METHOD_2ND          = 3
+
+def makeDecoderDescriptor( compressionId ):
+	method, direction, transparent, parSub = getDecoderSettings( compressionId )
+	if method is None:
+		return METHOD_NONE
+	descriptor = { "Uncompressed": METHOD_UNCOMPRESSED, "1st": METHOD_1ST, "2nd": METHOD_2ND }[ method ]
+	if direction == "Vertical":
+		descriptor |= 4
+	if transparent == "Yes":
+		descriptor |= 8
+	descriptor |= ( (compressionId - parSub) & 0x0F ) << 4
+	return descriptor
+
+DECODER_TABLE = [ makeDecoderDescriptor( compressionId ) for compressionId in range(256) ]
+
+def codecName( compressionId ):
+	# short name of the method and direction of a compression ID,
+	# e.g. "method1_vertical" (used by the profiler and the benchmarks)
+	descriptor = DECODER_TABLE[ compressionId ]
+	method = descriptor & 3
+	if method == METHOD_NONE:
+		return "unknown"
+	if method == METHOD_UNCOMPRESSED:
+		return "uncompressed"
+	return ("method1" if method == METHOD_1ST else "method2") + ("_vertical" if descriptor & 4 else "_horizontal")
+
+# Prefix lookup tables
+# The decoders don't read codes one bit at a time: they peek the next
+# WINDOW_BITS bits and look them up in a table which tells, for that bit
+# pattern, all the short codes it starts with (`0`, `110`, `111` for the
+# 1st method, `0`, `11xxx` for the 2nd one):
+#   * how many bits they take;
+#   * the palette index offsets (relative to the current index) of the pixels
+#     they draw, as bytes, so that they can be turned into palette indices
+#     with a single `translate` call;
+#   * how much the palette index changes overall;
+#   * what comes right after: nothing decodable inside the window, a new
+#     palette index (`10`) or, for the 2nd method, a run (`11100`).
+# Whatever is longer than a window (new palette indices, runs) is read
+# directly from the bit reader.
+WINDOW_BITS = 12
+WINDOW_MASK = (1 << WINDOW_BITS) - 1
+# a window followed by the longest code read outside of the tables (a run:
+# 5 bits of code and 8 bits of length)
+FAST_PATH_BITS = WINDOW_BITS + 13
+
+STOP_NONE      = 0
+STOP_NEW_COLOR = 1
+STOP_RUN       = 2
+
+def buildMethod1Table( inc ):
+	# entries: (bits consumed, offsets, index change, inc afterwards, stop)
+	table = []
+	for window in range(1 << WINDOW_BITS):
+		position = 0
+		offset = 0
+		offsets = bytearray()
+		current_inc = inc
+		stop = STOP_NONE
+		while position + 1 <= WINDOW_BITS:
+			if not (window >> position) & 1:
+				# 0: draw next pixel with current palette index
+				offsets.append( offset & 0xFF )
+				position += 1
+				continue
+			if position + 2 > WINDOW_BITS:
+				break
+			if not (window >> (position + 1)) & 1:
+				# 10: new palette index follows
+				stop = STOP_NEW_COLOR
+				break
+			if position + 3 > WINDOW_BITS:
+				break
+			# 110: add inc, 111: negate inc and add it
+			if (window >> (position + 2)) & 1:
+				current_inc = -current_inc
+			offset += current_inc
+			offsets.append( offset & 0xFF )
+			position += 3
+		table.append( (position, bytes(offsets), offset, current_inc, stop) )
+	return table
+
+def buildMethod2Table():
+	# entries: (bits consumed, offsets, index change, stop)
+	table = []
+	for window in range(1 << WINDOW_BITS):
+		position = 0
+		offset = 0
+		offsets = bytearray()
+		stop = STOP_NONE
+		while position + 1 <= WINDOW_BITS:
+			if not (window >> position) & 1:
+				# 0: draw next pixel with current palette index
+				offsets.append( offset & 0xFF )
+				position += 1
+				continue
+			if position + 2 > WINDOW_BITS:
+				break
+			if not (window >> (position + 1)) & 1:
+				# 10: new palette index follows
+				stop = STOP_NEW_COLOR
+				break
+			if position + 5 > WINDOW_BITS:
+				break
+			inc = ( (window >> (position + 2)) & 7 ) - 4
+			if not inc:
+				# 11100: run length follows
+				stop = STOP_RUN
+				break
+			offset += inc
+			offsets.append( offset & 0xFF )
+			position += 5
+		table.append( (position, bytes(offsets), offset, stop) )
+	return table
+
+# tables are built on first use
+_method1_tables = None
+_method2_table = None
+# ADD_TABLES[c] maps an offset to the palette index c + offset
+_add_tables = None
+
+def getCodecTables():
+	global _method1_tables, _method2_table, _add_tables
+	if _add_tables is None:
+		_method1_tables = { -1: buildMethod1Table( -1 ), 1: buildMethod1Table( 1 ) }
+		_method2_table = buildMethod2Table()
+		_add_tables = [ bytes( (c + i) & 0xFF for i in range(256) ) for c in range(256) ]
+	return _method1_tables, _method2_table, _add_tables
+
+
+# What's in a Strip?
+# OK, so we find the strip offsets, we follow them one by one, but what
+# do we do when we get to a strip? OK, here's the information on what
+# is actually stored in the strip definitions.
+
+# The first byte in the strip data is the compression ID. This is a
+# number between 1 and 128 (0x80). We'll get to that in a second.
+# The next byte is the color of the first pixel in the strip, and also
+# the initial palette index. I.e., the palette index we continue
+# drawing with until we're told otherwise. After these two bytes
+# follow the actual compressed data.
+def decodeStrip( strip_data, height, reference=False, stats=None, rows=None ):
+	# Decode a single strip. `strip_data` starts with the compression ID.
+	# Returns the 8 x height palette indices of the strip, row by row
+	# (pixel x,y is at position x + 8*y).
+	# With `reference` set, codes are read one bit at a time with the
+	# original reader (to cross-check the table driven decoders).
+	# If a `stats` dict is given, the number of bits read is stored in
+	# stats["bits_read"].
+	# With `rows`, only the first `rows` rows are returned (8 x rows palette
+	# indices) and decoding stops as soon as they are known: right after
+	# them for horizontal strips, in the last column for vertical ones.
+	if rows is None or rows > height:
+		rows = height
+	compression_id = strip_data[0]
+	assert compression_id >= 1 and compression_id <= 128
+
+	descriptor = DECODER_TABLE[ compression_id ]
+	method = descriptor & 3
+	palette_index_size = descriptor >> 4
+	vertical = descriptor & 4
+	pixel_count = 7 * height + rows if vertical else 8 * rows
+
+	if method == METHOD_UNCOMPRESSED:
+		# raw palette indices, row by row, starting right after the ID
+		pixels = bytearray( strip_data[ 1 : 1 + pixel_count ] )
+		if stats is not None:
+			stats["bits_read"] = 8 * len(pixels)
+		pixels.extend( bytes( pixel_count - len(pixels) ) )
+		return pixels
+
+	color_index = strip_data[1]
+
+	if method == METHOD_NONE:
+		# unknown compression: only the first pixel is known
+		pixels = bytearray( (color_index,) )
+	else:
+		if reference:
+			bitReader = BitReaderLSB( BytesIO( bytes( strip_data[2:] ) ) )
+		else:
+			bitReader = BufferedBitReaderLSB( strip_data, 2 )
+		decoder = decodeMethod1 if method == METHOD_1ST else decodeMethod2
+		pixels = decoder( bitReader, color_index, pixel_count, palette_index_size, not reference )
+		if stats is not None and not reference:
+			stats["bits_read"] = 8 * (bitReader.position - 2) - bitReader.count
+
+	# truncated strip: what is left stays at palette index 0
+	pixels.extend( bytes( pixel_count - len(pixels) ) )
+
+	if vertical:
+		# vertical strips are decoded column by column: transpose them
+		transposed = bytearray( 8 * rows )
+		for x in range(8):
+			transposed[ x::8 ] = pixels[ x*height : x*height + rows ]
+		pixels = transposed
+
+	return pixels
+
+def decodeMethod1( bitReader, color_index, pixel_count, palette_index_size, use_tables=True ):
+	# The elegant implementation for this decoder can be found here
+	# ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
+	# This is known as 'UnkB'
+
+	#uint8_t color = read_bits(csh);
+	#uint8_t inc = -1;
+	#while(pixel_left) {
+	#  write_pixel(color,1);
+	#  if(read_bit()) {
+	#    if(!read_bit()) {
+	#      color = read_bits(csh);
+	#      inc = -1;
+	#    } else {
+	#      if(read_bit()) inc = -inc;
+	#      color += inc;
+	#    }
+	#  }
+	#}
+
+	# Write the first pixel (always on the upper left corner)
+	pixels = bytearray( (color_index,) )
+	pixel_left = pixel_count - 1
+	inc = -1
+
+	read_bit = bitReader.read_bit
+	read_bits = bitReader.read_bits
+
+	try:
+		if use_tables:
+			tables, _, add_tables = getCodecTables()
+			palette_index_mask = (1 << palette_index_size) - 1
+			new_color_bits = 2 + palette_index_size
+			append_pixel = pixels.append
+
+			# the accumulator of the bit reader is handled right here, in
+			# local variables, instead of going through method calls
+			data = bitReader.data
+			bits = bitReader.bits
+			count = bitReader.count
+			position = bitReader.position
+
+			while pixel_left > 0:
+				if count < FAST_PATH_BITS:
+					chunk = data[ position : position + ((64 - count) >> 3) ]
+					bits |= int.from_bytes( chunk, 'little' ) << count
+					count += len(chunk) << 3
+					position += len(chunk)
+					# near the end of the data: the last few codes are decoded
+					# one bit at a time by the loop below
+					if count < FAST_PATH_BITS:
+						break
+
+				consumed, offsets, change, new_inc, stop = tables[inc][ bits & WINDOW_MASK ]
+				bits >>= consumed
+				count -= consumed
+				if offsets:
+					run = offsets.translate( add_tables[ color_index ] )
+					if len(run) > pixel_left:
+						run = run[:pixel_left]
+					pixels += run
+					pixel_left -= len(run)
+					color_index = (color_index + change) & 0xFF
+					inc = new_inc
+				if stop == STOP_NEW_COLOR and pixel_left > 0:
+					# new palette indices tend to come one after the other
+					# (noisy images, vertical strips of images with
+					# horizontal detail): as long as the next code is a `10`
+					# too, it is read right here
+					while True:
+						append_pixel( (bits >> 2) & palette_index_mask )
+						bits >>= new_color_bits
+						count -= new_color_bits
+						pixel_left -= 1
+						if bits & 3 != 1 or pixel_left <= 0 or count < new_color_bits:
+							break
+					color_index = pixels[-1]
+					inc = -1
+
+			bitReader.bits = bits
+			bitReader.count = count
+			bitReader.position = position
+
+		while pixel_left > 0:
+			if read_bit():
+				if not read_bit():
+					color_index = read_bits( palette_index_size )
+					inc = -1
+				else:
+					if read_bit():
+						inc = -inc
+					color_index = (color_index + inc) & 0xFF
+
+			pixels.append( color_index )
+			pixel_left -= 1
+
+	except EOFError:
+		pass
+
+	return pixels
+
+def decodeMethod2( bitReader, color_index, pixel_count, palette_index_size, use_tables=True ):
+	# as described here: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
+	# 0:  Draw next pixel with current palette index.
+	# 10: Read a new palette index from the bitstream (i.e., the
+	#     number of bits specified by the parameter), and draw the next pixel.
+	# 11: Read the next 3 bit value, and perform an action, depending on the value:
+	#     000 (0): Increase current palette index by 4.
+	#     001 (1): Increase current palette index by 3.
+	#     010 (2): Increase current palette index by 2.
+	#     011 (3): Increase current palette index by 1.
+	#     100 (4): Read next 8 bits. Draw the number of pixels
+	#              specified by these 8 bits with the current palette
+	#              index (somewhat similar to RLE). A count of 0 draws
+	#              them up to the end of the strip (as ScummVM does).
+	#     101 (5): Decrease current palette index by 1.
+	#     110 (6): Decrease current palette index by 2.
+	#     111 (7): Decrease current palette index by 3.
+
+	# This seem a method to decode which is the one described as UnkA @
+	# ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
+	# Trying this algo because the ine described here:
+	# ref: https://web.archive.org/web/20090727144325/http://scumm.mixnmojo.com/?page=articles/article1
+	# seems not to work
+
+	# Write the first pixel (always on the upper left corner)
+	pixels = bytearray( (color_index,) )
+	pixel_left = pixel_count - 1
+
+	read_bit = bitReader.read_bit
+	read_bits = bitReader.read_bits
+
+	try:
+		if use_tables:
+			_, table, add_tables = getCodecTables()
+			palette_index_mask = (1 << palette_index_size) - 1
+			new_color_bits = 2 + palette_index_size
+			append_pixel = pixels.append
+
+			# (see decodeMethod1)
+			data = bitReader.data
+			bits = bitReader.bits
+			count = bitReader.count
+			position = bitReader.position
+
+			while pixel_left > 0:
+				if count < FAST_PATH_BITS:
+					chunk = data[ position : position + ((64 - count) >> 3) ]
+					bits |= int.from_bytes( chunk, 'little' ) << count
+					count += len(chunk) << 3
+					position += len(chunk)
+					if count < FAST_PATH_BITS:
+						break
+
+				consumed, offsets, change, stop = table[ bits & WINDOW_MASK ]
+				bits >>= consumed
+				count -= consumed
+				if offsets:
+					run = offsets.translate( add_tables[ color_index ] )
+					if len(run) > pixel_left:
+						run = run[:pixel_left]
+					pixels += run
+					pixel_left -= len(run)
+					color_index = (color_index + change) & 0xFF
+					if pixel_left <= 0:
+						break
+				if stop == STOP_NEW_COLOR:
+					# (see decodeMethod1)
+					while True:
+						append_pixel( (bits >> 2) & palette_index_mask )
+						bits >>= new_color_bits
+						count -= new_color_bits
+						pixel_left -= 1
+						if bits & 3 != 1 or pixel_left <= 0 or count < new_color_bits:
+							break
+					color_index = pixels[-1]
+				elif stop == STOP_RUN:
+					bits >>= 5
+					# a run never goes past the end of the strip, and one
+					# of length 0 goes right up to it
+					n = min( (bits & 0xFF) or pixel_left, pixel_left )
+					bits >>= 8
+					count -= 13
+					pixels += bytes( (color_index,) ) * n
+					pixel_left -= n
+
+			bitReader.bits = bits
+			bitReader.count = count
+			bitReader.position = position
+
+		while pixel_left > 0:
+			n = 1
+			if read_bit():
+				if not read_bit():
+					color_index = read_bits( palette_index_size )
+				else:
+					inc = (read_bits(3) - 4)
+					if inc:
+						color_index = (color_index + inc) & 0xFF
+					else:
+						# 0: up to the end of the strip
+						n = read_bits( 8 ) or pixel_left
+			# a run never goes past the end of the strip
+			n = min( n, pixel_left )
+			pixels += bytes( (color_index,) ) * n
+			pixel_left -= n
+
+	except EOFError:
+		pass
+
+	return pixels
+
+
+# STRIP SCHEDULING *************************************************************
+def stripSlices( smap_data, stripe_offsets, strip_numbers=None ):
+	# Every strip ends where the next one (in file order) begins, the last one
+	# at the end of the SMAP block. Offsets are relative to the SMAP header.
+	# With `strip_numbers`, only the slices of those strips are returned.
+	ends = sorted( set( stripe_offsets ) ) + [ len(smap_data) ]
+	next_offset = { ends[i]: ends[i+1] for i in range(len(ends) - 1) }
+	if strip_numbers is not None:
+		stripe_offsets = [ stripe_offsets[i] for i in strip_numbers ]
+	return [ bytes( smap_data[ so : next_offset[so] ] ) for so in stripe_offsets ]
+
+_strip_pool = None
+_strip_pool_workers = 0
+
+def getStripPool( workers ):
+	# the pool is created once and reused for all the rooms
+	global _strip_pool, _strip_pool_workers
+	if _strip_pool is None or _strip_pool_workers != workers:
+		if _strip_pool is not None:
+			_strip_pool.shutdown()
+		_strip_pool = ProcessPoolExecutor( max_workers=workers )
+		_strip_pool_workers = workers
+	return _strip_pool
+
+def shutdownStripPool():
+	global _strip_pool
+	if _strip_pool is not None:
+		_strip_pool.shutdown()
+		_strip_pool = None
+
+def decodeStrips( strips, height, workers=1, room_number=None, cache=None, rows=None ):
+	# decode all the strips of an image, in parallel for very wide images,
+	# and return their pixels in the same order
+	# With a `cache` (a contentstore.ContentStore), strips made of the same
+	# compressed bytes (and as tall) are decoded once: states of an object
+	# share most of their strips, objects share strips with the background,
+	# and solid strips are found everywhere. Decoded strips are then bytes.
+	# With `rows`, only the first rows of every strip are decoded (see
+	# decodeStrip), and the cache is not used.
+	if cache is not None and rows is None:
+		keys = [ cache.key( "strip", strip, height, DECODER_VERSION ) for strip in strips ]
+		decoded = {}
+		missing = {}
+		for key, strip in zip( keys, strips ):
+			if key in decoded or key in missing:
+				continue
+			pixels = cache.get( "strip", key )
+			if pixels is None:
+				missing[ key ] = strip
+			else:
+				decoded[ key ] = pixels
+		# the same strip found again in this very image
+		duplicates = len(keys) - len(decoded) - len(missing)
+		cache.record( "strip", duplicates, duplicates )
+		if missing:
+			for key, pixels in zip( missing, decodeStrips( list( missing.values() ), height, workers, room_number ) ):
+				pixels = bytes( pixels )
+				cache.put( "strip", key, pixels )
+				decoded[ key ] = pixels
+		instrumentation.count( room_number, "strip_cache_hits", len(keys) - len(missing) )
+		return [ decoded[ key ] for key in keys ]
+
+	if instrumentation.profiler is not None:
+		return decodeStripsProfiled( strips, height, room_number, rows )
+	if workers <= 0:
+		workers = os.cpu_count() or 1
+	if workers == 1 or len(strips) < MIN_STRIPS_FOR_PARALLEL_DECODING:
+		return [ decodeStrip( strip, height, rows=rows ) for strip in strips ]
+
+	pool = getStripPool( workers )
+	chunksize = max( 1, len(strips) // (4 * workers) )
+	n = len(strips)
+	return list( pool.map( decodeStrip, strips, [height] * n, [False] * n, [None] * n, [rows] * n, chunksize=chunksize ) )
+
+def decodeStripsProfiled( strips, height, room_number=None, rows=None ):
+	# every strip is decoded here, one at a time, and timed
+	profiler = instrumentation.profiler
+	# the lookup tables are built on first use: not a cost of the first strip
+	getCodecTables()
+	decoded_strips = []
+	stats = {}
+	for strip in strips:
+		stats["bits_read"] = 0
+		start = time.perf_counter()
+		pixels = decodeStrip( strip, height, stats=stats, rows=rows )
+		elapsed = time.perf_counter() - start
+		profiler.addStrip( room_number, codecName( strip[0] ), len(pixels), stats["bits_read"], elapsed )
+		decoded_strips.append( pixels )
+	return decoded_strips
+
+
+# REGIONS AND PREVIEWS *********************************************************
+# Every strip is compressed on its own and the offset table tells where each
+# of them starts, so a part of an image only costs the strips it covers: a 320
+# pixels wide viewport into a 1280 pixels wide room decodes a quarter of the
+# strips (and, for horizontal strips, stops right after the last row asked).
+def stripOffsets( smap_data, num_strips ):
+	# offset of every strip, relative to the SMAP block header
+	return [ int.from_bytes( smap_data[ 8 + 4*i : 12 + 4*i ], 'little' ) for i in range(num_strips) ]
+
+def decodeRegion( smap_data, width, height, box, room_number=None ):
+	# palette indices (row by row) of the `box` (left, top, right, bottom)
+	# part of an image, decoding only the strips covering it
+	left, top, right, bottom = box
+	if not (0 <= left < right <= width and 0 <= top < bottom <= height):
+		raise ValueError(f"box {box} is not inside the {width}x{height} image")
+	num_strips = width // 8
+	first = left // 8
+	last = min( (right - 1) // 8, num_strips - 1 )
+	strip_numbers = range( first, last + 1 )
+	strips = stripSlices( smap_data, stripOffsets( smap_data, num_strips ), strip_numbers )
+	decoded_strips = decodeStrips( strips, height, 1, room_number, rows=bottom )
+
+	# copied a column at a time: one slice assignment per column
+	region_width = right - left
+	region = bytearray( region_width * (bottom - top) )
+	for strip_number, pixels in zip( strip_numbers, decoded_strips ):
+		x = strip_number * 8
+		for column in range( max( left, x ), min( right, x + 8 ) ):
+			region[ column - left :: region_width ] = pixels[ top*8 + column - x : bottom*8 : 8 ]
+	return region
+
+def decodePreview( smap_data, width, height, step, room_number=None ):
+	# A preview `step` times smaller than the image, decoding one strip out of
+	# `step`: it's made of those strips, side by side, and of one row out of
+	# `step`. Returns its width, height and palette indices (row by row).
+	if step < 1:
+		raise ValueError(f"preview step must be at least 1, got {step}")
+	num_strips = width // 8
+	strip_numbers = range( 0, num_strips, step )
+	preview_width = 8 * len( strip_numbers )
+	preview_height = (height + step - 1) // step
+	strips = stripSlices( smap_data, stripOffsets( smap_data, num_strips ), strip_numbers )
+	decoded_strips = decodeStrips( strips, height, 1, room_number, rows=(preview_height - 1) * step + 1 )
+
+	preview = bytearray( preview_width * preview_height )
+	for i, pixels in enumerate( decoded_strips ):
+		for column in range(8):
+			preview[ 8*i + column :: preview_width ] = pixels[ column :: step*8 ]
+	return preview_width, preview_height, preview
@@ -0,0 +1,124 @@
+# Sound resources (SOUN)
+#
+# Going from Monkey Island 2 (MI2), music blocks are stored in LFLF blocks,
+# outside of the ROOMs, so they can be accessed globally:
+#
+# "SOUN"   dword   Block identifier
+# dwSize   dword   Size in bytes (BE)
+# "SOU "   dword   Block identifier
+# dwSize   dword   Size in bytes (BE), NOT counting its own 8 bytes header
+# blocks   ...     any combination of ROL (Roland MT-32), ADL (AdLib/OPL FM)
+#                  and SPK (PC speaker) blocks, or a single SBL block for
+#                  digitized sound
+#
+# ROL, ADL and SPK blocks hold MIDI data: a standard MIDI file ("MThd",
+# "MTrk" chunks) found within the first bytes of the block, after some
+# optional SCUMM specific headers ("MDhd", "MDpg").
+# A SBL block holds a "AUhd" (or "WVhd") block and a "AUdt" (or "WVdt")
+# block, whose content is Creative Voice (VOC) data without the file header:
+#   type    : 8 (1 = sound data)
+#   length  : 24le (length of what follows)
+#   rate    : 8 (sample rate = 1000000 / (256 - rate))
+#   codec   : 8 (0 = 8 bit unsigned PCM)
+#   samples : length - 2 bytes
+#ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Sound_resources
+#
+# Sounds are handed out as lists of buffers: small headers built here and
+# memoryview slices of the decoded resource file, so they can be written out
+# without ever being copied (see BatchWriter in outputpipeline.py).
+
+# where the MIDI file is looked for inside a ROL/ADL/SPK block (as ScummVM does)
+MIDI_SEARCH_LENGTH = 48
+
+VOC_HEADER = b"Creative Voice File\x1a" + (26).to_bytes(2, 'little') + (0x010A).to_bytes(2, 'little') + (0x1129).to_bytes(2, 'little')
+
+def soundBlocks( soun_payload ):
+	# (name, payload) of the music blocks of a SOUN block, as memoryviews
+	data = memoryview( soun_payload )
+	if bytes( data[:4] ) != b"SOU ":
+		# not the usual layout: the whole block is exported as it is
+		yield "soun", data
+		return
+
+	sou_block_size = int.from_bytes( data[4:8], 'big' )
+	end = min( len(data), 8 + sou_block_size )
+	position = 8
+	while position + 8 <= end:
+		name = bytes( data[ position : position + 4 ] ).decode('ascii', 'replace').strip().lower()
+		size = int.from_bytes( data[ position + 4 : position + 8 ], 'big' )
+		yield name, data[ position + 8 : min( end, position + 8 + size ) ]
+		position += 8 + size
+
+def midiFile( data ):
+	# the standard MIDI file inside a ROL/ADL/SPK block (None if there's none)
+	start = bytes( data[ :MIDI_SEARCH_LENGTH + 4 ] ).find( b"MThd" )
+	if start < 0:
+		return None
+	# MThd and then its MTrk chunks: whatever follows them is left out
+	position = start
+	while position + 8 <= len(data):
+		name = bytes( data[ position : position + 4 ] )
+		if position > start and name != b"MTrk":
+			break
+		size = int.from_bytes( data[ position + 4 : position + 8 ], 'big' )
+		if position + 8 + size > len(data):
+			break
+		position += 8 + size
+	return data[ start : position ]
+
+def vocData( data ):
+	# the VOC data (without file header) of a SBL block
+	position = 0
+	while position + 8 <= len(data):
+		name = bytes( data[ position : position + 4 ] )
+		size = int.from_bytes( data[ position + 4 : position + 8 ], 'big' )
+		if size < 8:
+			break
+		if name in (b"AUdt", b"WVdt"):
+			return data[ position + 8 : position + size ]
+		position += size
+	return None
+
+def vocParts( voc_data ):
+	# a complete .voc file: header, the data blocks and a terminator block
+	return [ VOC_HEADER, voc_data, b"\x00" ]
+
+def wavParts( voc_data ):
+	# a .wav file with the samples of the first VOC block, when it is plain
+	# 8 bit PCM (None otherwise)
+	if len(voc_data) < 6 or voc_data[0] != 1 or voc_data[5] != 0:
+		return None
+	length = int.from_bytes( voc_data[1:4], 'little' )
+	samples = voc_data[ 6 : 4 + length ]
+	rate = 1000000 // (256 - voc_data[4])
+	header = b"".join((
+		b"RIFF", (36 + len(samples)).to_bytes(4, 'little'), b"WAVE",
+		b"fmt ", (16).to_bytes(4, 'little'),
+		(1).to_bytes(2, 'little'),        # PCM
+		(1).to_bytes(2, 'little'),        # mono
+		rate.to_bytes(4, 'little'),
+		rate.to_bytes(4, 'little'),       # bytes per second
+		(1).to_bytes(2, 'little'),        # block align
+		(8).to_bytes(2, 'little'),        # bits per sample
+		b"data", len(samples).to_bytes(4, 'little'),
+	))
+	return [ header, samples ]
+
+def soundFiles( name, data, wrappers=True ):
+	# [(extension, buffers)] to be saved for a music block: the block content
+	# as it is and, if `wrappers`, the standard file formats it can be turned into
+	files = [ (name, [ data ]) ]
+	if not wrappers:
+		return files
+	if name == "sbl":
+		voc_data = vocData( data )
+		if voc_data is not None:
+			files.append( ("voc", vocParts( voc_data )) )
+			wav = wavParts( voc_data )
+			if wav is not None:
+				files.append( ("wav", wav) )
+	else:
+		midi = midiFile( data )
+		if midi is not None:
+			files.append( ("mid", [ midi ]) )
+	return files
@@ -0,0 +1,265 @@
+# Streaming access to a resource file (pipes, stdin, huge multi-disk sets)
+#
+# XorFileReader maps the whole file and jumps around in it, which needs a
+# seekable file. Here the file is read once, from the first byte to the last,
+# and decoded in chunks of CHUNK_SIZE bytes as they arrive:
+#
+# * LECF blocks are entered (several disks may be concatenated: `cat
+#   ATLANTIS.001 ATLANTIS.002 | python main.py -`), their LOFF table is kept
+#   to know which room every LFLF block holds;
+# * a LFLF block is read in memory, as a whole, only if its room is wanted,
+#   and handed over to the usual readers through a BlockReader (the same file
+#   API as XorFileReader, over that block only), then dropped;
+# * everything else is skipped a chunk at a time.
+#
+# So at most one room (plus a chunk) is in memory at any time, no matter how
+# large the archive is.
+#
+# Images go the same way: PNGStreamWriter writes a palettized PNG one row at
+# a time, scaled on the fly, so neither the scaled image nor the compressed
+# file are ever held in memory.
+#ref: https://www.w3.org/TR/png/
+
+import zlib
+
+import instrumentation
+from instrumentation import log, ERROR, DEBUG
+from xorfile import xorTable
+from blocks import isValidBlockName
+from blockindex import readLOFF
+
+CHUNK_SIZE = 1 << 16       # 64 KiB read and decoded at a time
+
+class XorStream:
+	# decoded bytes of a (not seekable) stream, read forward only
+	def __init__(self, stream, xor_key=0x69, chunk_size=CHUNK_SIZE):
+		self.stream = stream
+		self.xor_key = xor_key
+		self.table = xorTable( xor_key )
+		self.chunk_size = chunk_size
+		self.position = 0       # offset of the next byte to be read
+		self.chunk = b''
+		self.chunk_position = 0
+
+	def _nextChunk(self):
+		data = self.stream.read( self.chunk_size )
+		if self.xor_key != 0:
+			with instrumentation.phase("xor_decode"):
+				data = data.translate( self.table )
+		self.chunk = data
+		self.chunk_position = 0
+		return len(data) > 0
+
+	def readinto(self, buffer):
+		# fill `buffer` with the next bytes, returns how many bytes were read
+		# (fewer than asked only at the end of the stream)
+		view = memoryview( buffer ).cast("B")
+		filled = 0
+		while filled < len(view):
+			if self.chunk_position == len(self.chunk) and not self._nextChunk():
+				break
+			n = min( len(self.chunk) - self.chunk_position, len(view) - filled )
+			view[ filled : filled + n ] = self.chunk[ self.chunk_position : self.chunk_position + n ]
+			self.chunk_position += n
+			filled += n
+		self.position += filled
+		return filled
+
+	def read(self, n):
+		buffer = bytearray( n )
+		return bytes( buffer[ : self.readinto( buffer ) ] )
+
+	def skip(self, n):
+		# drop the next `n` bytes, returns how many bytes were dropped
+		skipped = 0
+		while skipped < n:
+			if self.chunk_position == len(self.chunk) and not self._nextChunk():
+				break
+			step = min( len(self.chunk) - self.chunk_position, n - skipped )
+			self.chunk_position += step
+			skipped += step
+		self.position += skipped
+		return skipped
+
+
+class BlockReader:
+	# The file API of XorFileReader (read, seek, tell, view) over a single
+	# block kept in memory: offsets are still offsets in the resource file,
+	# so the readers of main.py work on it unchanged.
+	def __init__(self, data, offset):
+		self.data = memoryview( data )
+		self.offset = offset    # offset of data[0] in the resource file
+		self.position = offset
+		self.size = offset + len(data)
+
+	def read(self, n=-1):
+		start = self.position - self.offset
+		end = len(self.data) if n is None or n < 0 else min( start + n, len(self.data) )
+		if end <= start:
+			return b''
+		self.position = self.offset + end
+		return bytes( self.data[ start : end ] )
+
+	def seek(self, offset, whence=0):
+		if whence == 0:
+			position = offset
+		elif whence == 1:
+			position = self.position + offset
+		elif whence == 2:
+			position = self.size + offset
+		else:
+			raise ValueError(f"invalid whence ({whence})")
+		if position < self.offset:
+			raise ValueError(f"offset {position} is before the block (offset {self.offset})")
+		self.position = position
+		return self.position
+
+	def tell(self):
+		return self.position
+
+	def view(self, offset, size):
+		start = offset - self.offset
+		return self.data[ start : start + size ]
+
+	def close(self):
+		self.data = None
+
+
+def streamRooms( stream, xor_key=0x69, room_numbers=None, chunk_size=CHUNK_SIZE ):
+	# Yield (room number, room abs offset, reader) for every LFLF block of the
+	# stream, in file order; only the rooms in `room_numbers` (all of them if
+	# None). Offsets are relative to the beginning of the disk (LECF block)
+	# holding the room, just like in the disk file itself. The reader is only
+	# valid until the next room is asked for.
+	xor_stream = XorStream( stream, xor_key, chunk_size )
+	wanted = set( room_numbers ) if room_numbers is not None else None
+	disk_start = 0
+	rooms_at = {}   # LFLF offset -> room number, from the LOFF table
+
+	while wanted is None or wanted:
+		header = xor_stream.read(8)
+		if len(header) < 8:
+			if header:
+				log( ERROR, f"streamRooms: truncated block header at offset {xor_stream.position - len(header)}" )
+			return
+		name = header[:4]
+		size = int.from_bytes( header[4:8], 'big' )
+		offset = xor_stream.position - 8
+		if not isValidBlockName( name ) or size < 8:
+			log( ERROR, f"streamRooms: unexpected data at offset {offset}, stopping" )
+			return
+		name = name.decode('ascii')
+		log( DEBUG, f"{name} at offset {offset} ({size} bytes)" )
+
+		if name == "LECF":
+			# a new disk: its blocks follow (offsets start over)
+			disk_start = offset
+			rooms_at = {}
+			continue
+
+		if name == "LOFF":
+			data = bytearray( size )
+			data[:8] = header
+			xor_stream.readinto( memoryview( data )[8:] )
+			loff = BlockReader( data, offset - disk_start )
+			rooms_at = { room_offset - 8: room_number for room_number, room_offset in readLOFF( loff, loff.offset ) }
+			continue
+
+		room_number = rooms_at.get( offset - disk_start ) if name == "LFLF" else None
+		if name == "LFLF" and room_number is None:
+			log( ERROR, f"streamRooms: LFLF block at offset {offset} is not in the LOFF table, skipping it" )
+		if room_number is None or (wanted is not None and room_number not in wanted):
+			xor_stream.skip( size - 8 )
+			continue
+
+		data = bytearray( size )
+		data[:8] = header
+		if xor_stream.readinto( memoryview( data )[8:] ) < size - 8:
+			log( ERROR, f"streamRooms: room {room_number} is truncated, stopping" )
+			return
+		if wanted is not None:
+			wanted.discard( room_number )
+		lflf_offset = offset - disk_start
+		yield room_number, lflf_offset + 8, BlockReader( data, lflf_offset )
+
+
+# OUTPUT ***********************************************************************
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# compressed data is written out in IDAT chunks of (at least) that many bytes
+IDAT_SIZE = 1 << 16
+
+def pngChunk( chunk_type, data ):
+	return b"".join((
+		len(data).to_bytes(4, 'big'),
+		chunk_type,
+		data,
+		zlib.crc32( data, zlib.crc32( chunk_type ) ).to_bytes(4, 'big'),
+	))
+
+class PNGStreamWriter:
+	# A 8 bit palettized PNG written one row (of palette indices) at a time.
+	# Rows are scaled (nearest neighbor) as they come.
+	def __init__(self, filename, width, height, palette=None, transparent_index=None, scale_factor=1, compress_level=6):
+		self.width = width
+		self.scale_factor = scale_factor
+		self.compressor = zlib.compressobj( compress_level )
+		self.pending = []
+		self.pending_size = 0
+		self.file = open(filename, 'wb')
+
+		if palette is None:
+			# no CLUT: grayscale, as PIL would do
+			palette = bytes( value for value in range(256) for component in range(3) )
+		ihdr = b"".join((
+			(width * scale_factor).to_bytes(4, 'big'),
+			(height * scale_factor).to_bytes(4, 'big'),
+			bytes( (8, 3, 0, 0, 0) ),     # 8 bits, palette, deflate, no filter, no interlace
+		))
+		chunks = [ PNG_SIGNATURE, pngChunk( b"IHDR", ihdr ), pngChunk( b"PLTE", bytes( palette ) ) ]
+		if transparent_index is not None:
+			# alpha of the palette entries up to the transparent one
+			chunks.append( pngChunk( b"tRNS", b"\xff" * transparent_index + b"\x00" ) )
+		self.file.write( b"".join( chunks ) )
+
+	def writeRow(self, row):
+		if self.scale_factor != 1:
+			scaled = bytearray( len(row) * self.scale_factor )
+			for i in range( self.scale_factor ):
+				scaled[ i :: self.scale_factor ] = row
+			row = scaled
+		# every row starts with its filter type (0, none)
+		line = b"\x00" + bytes( row )
+		for i in range( self.scale_factor ):
+			self._push( self.compressor.compress( line ) )
+
+	def _push(self, data):
+		if data:
+			self.pending.append( data )
+			self.pending_size += len(data)
+		if self.pending_size >= IDAT_SIZE:
+			self._writeIDAT()
+
+	def _writeIDAT(self):
+		if self.pending_size:
+			self.file.write( pngChunk( b"IDAT", b"".join( self.pending ) ) )
+		self.pending = []
+		self.pending_size = 0
+
+	def close(self):
+		self.pending.append( self.compressor.flush() )
+		self.pending_size += len( self.pending[-1] )
+		self._writeIDAT()
+		self.file.write( pngChunk( b"IEND", b"" ) )
+		self.file.close()
+
+def writePNGRows( filename, indices, width, height, palette=None, transparent_index=None, scale_factor=1 ):
+	# save a flat buffer of palette indices (row by row) as a PNG, one row at a time
+	with instrumentation.phase("image_save"):
+		writer = PNGStreamWriter( filename, width, height, palette, transparent_index, scale_factor )
+		try:
+			rows = memoryview( indices )
+			for y in range(height):
+				writer.writeRow( rows[ y*width : (y+1)*width ] )
+		finally:
+			writer.close()
@@ -0,0 +1,459 @@
+# Synthetic SCUMM v5 resource files
+#
+# Writes small but valid resource files (XOR encoded LECF > LOFF + LFLF >
+# ROOM > RMHD, CYCL, TRNS, CLUT, RMIM > RMIH, IM00 > SMAP, ZP0n; OBIM, OBCD;
+# SCRP, SOUN), with
+# strips encoded using every compression ID known to the decoder, so that the
+# extractor can be run, measured and checked without a copy of the original
+# game files.
+#
+# The matching index file (RNAM, MAXS, DROO, DSCR, DSOU, DCOS, DCHR, DOBJ,
+# see indexfile.py) can be written too.
+#
+# usage: python synthetic.py OUTPUT_FILE [--rooms N] [--width W] [--height H] [--zplanes Z] [--objects O] [--cycles C] [--palettes P] [--seed S] [--index INDEX_FILE]
+
+import argparse
+import random
+from collections import namedtuple
+
+from smap import DECODER_TABLE, METHOD_NONE, METHOD_UNCOMPRESSED, METHOD_1ST, METHOD_2ND
+
+# every compression ID the decoder knows about
+COMPRESSION_IDS = [ compression_id for compression_id in range(1, 129) if DECODER_TABLE[ compression_id ] & 3 != METHOD_NONE ]
+
+# what the extractor should find in a room: the palette indices of the
+# background (row by row), its z-plane masks (bit-packed), for every
+# object (object id, width, height, palette indices of every state) and its
+# color cycles as (freq, flags, start, end)
+SyntheticRoom = namedtuple("SyntheticRoom", "width height indices zplanes objects cycles")
+
+def block( name, payload ):
+	return name.encode('ascii') + (len(payload) + 8).to_bytes(4, 'big') + bytes(payload)
+
+
+# STRIP ENCODERS ***************************************************************
+class BitWriterLSB:
+	# counterpart of smap.BitReaderLSB: bits are stored least significant first
+	def __init__(self):
+		self.data = bytearray()
+		self.bits = 0
+		self.count = 0
+
+	def write_bits(self, value, n):
+		self.bits |= (value & ((1 << n) - 1)) << self.count
+		self.count += n
+		while self.count >= 8:
+			self.data.append( self.bits & 0xFF )
+			self.bits >>= 8
+			self.count -= 8
+
+	def getvalue(self):
+		data = bytearray( self.data )
+		if self.count:
+			data.append( self.bits & 0xFF )
+		return bytes( data )
+
+def encodeMethod1( pixels, palette_index_size ):
+	# 1st method ('UnkB'), `pixels` in drawing order
+	writer = BitWriterLSB()
+	color = pixels[0]
+	inc = -1
+	for pixel in pixels[1:]:
+		if pixel == color:
+			writer.write_bits( 0b0, 1 )
+		elif pixel == (color + inc) & 0xFF:
+			writer.write_bits( 0b011, 3 )   # 110: add inc
+			color = pixel
+		elif pixel == (color - inc) & 0xFF:
+			writer.write_bits( 0b111, 3 )   # 111: negate inc and add it
+			inc = -inc
+			color = pixel
+		else:
+			writer.write_bits( 0b01, 2 )    # 10: new palette index
+			writer.write_bits( pixel, palette_index_size )
+			color = pixel
+			inc = -1
+	return writer.getvalue()
+
+def encodeMethod2( pixels, palette_index_size, use_runs=True ):
+	# 2nd method ('UnkA'), `pixels` in drawing order
+	writer = BitWriterLSB()
+	color = pixels[0]
+	position = 1
+	while position < len(pixels):
+		pixel = pixels[position]
+		if pixel == color:
+			run = 1
+			while position + run < len(pixels) and pixels[position + run] == color:
+				run += 1
+			if use_runs and run >= 3 and position + run == len(pixels):
+				# a run of length 0 goes up to the end of the strip
+				writer.write_bits( 0b11, 2 )
+				writer.write_bits( 4, 3 )
+				writer.write_bits( 0, 8 )
+				break
+			run = min( run, 255 )
+			if use_runs and run >= 3:
+				writer.write_bits( 0b11, 2 )      # 11 + 100: run length follows
+				writer.write_bits( 4, 3 )
+				writer.write_bits( run, 8 )
+				position += run
+				continue
+			writer.write_bits( 0b0, 1 )
+		elif -4 <= ((pixel - color + 128) & 0xFF) - 128 <= 3 and pixel != color:
+			inc = ((pixel - color + 128) & 0xFF) - 128
+			writer.write_bits( 0b11, 2 )
+			writer.write_bits( inc + 4, 3 )
+			color = pixel
+		else:
+			writer.write_bits( 0b01, 2 )      # 10: new palette index
+			writer.write_bits( pixel, palette_index_size )
+			color = pixel
+		position += 1
+	return writer.getvalue()
+
+def encodeStrip( indices, height, compression_id ):
+	# `indices` holds the 8 x height palette indices of the strip, row by
+	# row; they must fit in the palette index size of the compression ID
+	descriptor = DECODER_TABLE[ compression_id ]
+	method = descriptor & 3
+	palette_index_size = descriptor >> 4
+
+	if method == METHOD_UNCOMPRESSED:
+		return bytes( (compression_id,) ) + bytes( indices )
+
+	if descriptor & 4:
+		# vertical strips are drawn column by column
+		pixels = [ indices[ x + 8*y ] for x in range(8) for y in range(height) ]
+	else:
+		pixels = list( indices )
+
+	if method == METHOD_1ST:
+		data = encodeMethod1( pixels, palette_index_size )
+	elif method == METHOD_2ND:
+		data = encodeMethod2( pixels, palette_index_size )
+	else:
+		raise ValueError(f"unknown compression ID {compression_id}")
+	# a few padding bytes, as the decoders may read ahead
+	return bytes( (compression_id, pixels[0]) ) + data + bytes(4)
+
+
+def encodeZPlaneStrip( column ):
+	# RLE of a z-plane strip (see zplane.py): runs of 3 or more equal bytes
+	# are stored as runs, anything else as literals
+	data = bytearray()
+	literals = bytearray()
+	position = 0
+	while position < len(column):
+		run = 1
+		while run < 127 and position + run < len(column) and column[ position + run ] == column[ position ]:
+			run += 1
+		if run >= 3:
+			if literals:
+				data += bytes( (len(literals),) ) + literals
+				literals = bytearray()
+			data += bytes( (0x80 | run, column[ position ]) )
+			position += run
+			continue
+		literals.append( column[ position ] )
+		if len(literals) == 127:
+			data += bytes( (len(literals),) ) + literals
+			literals = bytearray()
+		position += 1
+	if literals:
+		data += bytes( (len(literals),) ) + literals
+	return bytes( data )
+
+def makeZPlane( width, height, rng ):
+	# things in front of the actors, as in real rooms: solid shapes whose
+	# edges move a little on every row (runs of 0x00 and 0xFF, literals along
+	# the edges), railings and foliage (literals all along). Returns the ZP0n
+	# payload and the bit-packed mask (row by row, most significant bit on
+	# the left)
+	num_strips = width // 8
+	mask = bytearray( num_strips * height )
+	for i in range( rng.randint(3, 6) ):
+		kind = rng.choice( ("solid", "solid", "railing", "foliage") )
+		span = rng.randint( max(1, width // 8), max(1, width // 2) )
+		left = rng.randrange( width - span + 1 )
+		right = left + span
+		y0 = rng.randrange( height // 2 + 1 )
+		y1 = rng.randint( y0 + 1, height )
+		bars = 0
+		for x in range( 0, width, rng.randint(4, 12) ):
+			bars |= 3 << x
+		for y in range(y0, y1):
+			left = min( max( left + rng.randint(-2, 2), 0 ), width - 1 )
+			right = min( max( right + rng.randint(-2, 2), left + 1 ), width )
+			# the row as a width-bit integer, leftmost pixel as the most significant bit
+			row = ((1 << (right - left)) - 1) << (width - right)
+			if kind == "railing" and y % 16 > 2:
+				row &= bars
+			elif kind == "foliage":
+				row &= rng.getrandbits( width ) | rng.getrandbits( width )
+			for x, b in enumerate( row.to_bytes( num_strips, 'big' ) ):
+				mask[ y*num_strips + x ] |= b
+
+	# empty strips have offset 0
+	strips = []
+	offsets = []
+	position = 8 + 2 * num_strips
+	for i in range(num_strips):
+		column = mask[ i::num_strips ]
+		if not any( column ):
+			offsets.append( 0 )
+			continue
+		strip = encodeZPlaneStrip( column )
+		offsets.append( position )
+		strips.append( strip )
+		position += len(strip)
+	return b''.join( o.to_bytes(2, 'little') for o in offsets ) + b''.join( strips ), mask
+
+
+# ROOMS ************************************************************************
+def makeRoomImage( width, height, rng ):
+	# something looking vaguely like a background: horizontal bands of slowly
+	# changing colors, a few flat areas and some noise
+	indices = bytearray( width * height )
+	for y in range(height):
+		color = rng.randrange(256)
+		x = 0
+		while x < width:
+			length = rng.randint(1, 24)
+			step = rng.choice( (0, 0, 0, 1, -1, 2) )
+			for i in range(min(length, width - x)):
+				indices[ y*width + x + i ] = color & 0xFF
+				if rng.random() < 0.1:
+					color += step
+			if rng.random() < 0.2:
+				color = rng.randrange(256)
+			x += length
+	return indices
+
+def makeSMAP( image, width, height, strip_ids ):
+	# SMAP block of an image, strip i being encoded with compression ID
+	# strip_ids[i]; palette indices of `image` which don't fit in the palette
+	# index size of their strip are masked (in place)
+	num_strips = width // 8
+	strips = []
+	for i in range(num_strips):
+		compression_id = strip_ids[i]
+		mask = (1 << (DECODER_TABLE[ compression_id ] >> 4)) - 1
+		if DECODER_TABLE[ compression_id ] & 3 == METHOD_UNCOMPRESSED:
+			mask = 0xFF
+		strip = bytearray( 8 * height )
+		for y in range(height):
+			row = image[ y*width + i*8 : y*width + i*8 + 8 ]
+			strip[ y*8 : y*8 + 8 ] = bytes( c & mask for c in row )
+			image[ y*width + i*8 : y*width + i*8 + 8 ] = strip[ y*8 : y*8 + 8 ]
+		strips.append( encodeStrip( strip, height, compression_id ) )
+
+	offsets = []
+	position = 8 + 4 * num_strips
+	for strip in strips:
+		offsets.append( position )
+		position += len(strip)
+	return block( "SMAP", b''.join( o.to_bytes(4, 'little') for o in offsets ) + b''.join( strips ) )
+
+def makeObject( obj_id, room_width, room_height, rng, compression_ids, num_states ):
+	# OBIM (IMHD, IM01 .. IMnn) and OBCD blocks of an object; the states of
+	# the object only differ in a few strips, as they often do in the games.
+	# Returns the blocks and the palette indices of every state.
+	width = 8 * rng.randint( 1, min( 8, room_width // 8 ) )
+	height = rng.randint( 1, min( 64, room_height ) )
+	x = 8 * rng.randrange( (room_width - width) // 8 + 1 )
+	y = rng.randrange( room_height - height + 1 )
+	strip_ids = [ rng.choice( compression_ids ) for i in range(width // 8) ]
+
+	first_state = makeRoomImage( width, height, rng )
+	states = []
+	images = b''
+	for state in range(num_states):
+		image = bytearray( first_state )
+		if state:
+			other = makeRoomImage( width, height, rng )
+			for i in range(width // 8):
+				if rng.random() < 0.25:
+					for row in range(height):
+						image[ row*width + i*8 : row*width + i*8 + 8 ] = other[ row*width + i*8 : row*width + i*8 + 8 ]
+		smap = makeSMAP( image, width, height, strip_ids )
+		images += block( f"IM{state+1:02X}", smap )
+		states.append( image )
+
+	imhd = b''.join( value.to_bytes(2, 'little') for value in (obj_id, num_states, 0) ) + bytes(2)
+	imhd += b''.join( value.to_bytes(2, 'little') for value in (x, y, width, height) )
+	obim = block( "OBIM", block( "IMHD", imhd ) + images )
+	obcd = block( "OBCD", block( "CDHD", obj_id.to_bytes(2, 'little') + bytes(11) ) + block( "OBNA", f"object {obj_id}".encode('ascii') + b'\0' ) )
+	return obim, obcd, (obj_id, width, height, states)
+
+def makeCycles( num_cycles, rng ):
+	# CYCL payload with `num_cycles` palette ranges (see colorcycle.py)
+	cycles = []
+	data = b''
+	for i in range(num_cycles):
+		start = rng.randrange( 16, 240 )
+		end = start + rng.randint( 2, 15 )
+		freq = rng.choice( (1024, 2048, 4096, 8192) )
+		flags = rng.choice( (0, 2) )
+		cycles.append( (freq, flags, start, end) )
+		data += bytes( (i + 1,) ) + bytes(2) + freq.to_bytes(2, 'big') + flags.to_bytes(2, 'big') + bytes( (start, end) )
+	return data + bytes(1), cycles
+
+def makeRoom( width, height, rng, compression_ids=None, transparent_index=0, num_z_planes=0, num_objects=0, palette=None, num_cycles=0 ):
+	# returns the ROOM block and what the extractor should find in it
+	# (`palette` is the 768 bytes of the CLUT, a random one if None)
+	if compression_ids is None:
+		compression_ids = COMPRESSION_IDS
+	image = makeRoomImage( width, height, rng )
+	smap = makeSMAP( image, width, height, [ rng.choice( compression_ids ) for i in range(width // 8) ] )
+
+	masks = []
+	zplanes = b''
+	for i in range(num_z_planes):
+		payload, mask = makeZPlane( width, height, rng )
+		zplanes += block( f"ZP{i+1:02d}", payload )
+		masks.append( mask )
+
+	objects = []
+	obims = b''
+	obcds = b''
+	for i in range(num_objects):
+		obim, obcd, obj = makeObject( 100 + i, width, height, rng, compression_ids, rng.randint(1, 4) )
+		obims += obim
+		obcds += obcd
+		objects.append( obj )
+
+	rmim = block( "RMIM", block( "RMIH", num_z_planes.to_bytes(2, 'little') ) + block( "IM00", smap + zplanes ) )
+	rmhd = block( "RMHD", width.to_bytes(2, 'little') + height.to_bytes(2, 'little') + num_objects.to_bytes(2, 'little') )
+	trns = block( "TRNS", transparent_index.to_bytes(2, 'little') )
+	if palette is None:
+		palette = bytes( rng.randrange(256) for i in range(768) )
+	clut = block( "CLUT", palette )
+	boxd = block( "BOXD", bytes(20) )
+	cycl_data, cycles = makeCycles( num_cycles, rng )
+	cycl = block( "CYCL", cycl_data )
+
+	room = block( "ROOM", rmhd + cycl + boxd + trns + clut + rmim + obims + obcds )
+	return room, SyntheticRoom( width, height, image, masks, objects, cycles )
+
+def makeMidi( rng ):
+	# a standard MIDI file with a single track of random notes
+	track = bytearray()
+	for i in range( rng.randint(4, 32) ):
+		note = rng.randrange(128)
+		track += bytes( (0, 0x90, note, 0x40, rng.randrange(128), 0x80, note, 0) )
+	track += bytes( (0, 0xFF, 0x2F, 0) )
+	# MIDI chunk sizes don't count the chunk header
+	header = bytes( (0, 0, 0, 1, 0, 0x60) )
+	return b"MThd" + len(header).to_bytes(4, 'big') + header + b"MTrk" + len(track).to_bytes(4, 'big') + track
+
+def makeSound( rng, digitized=False ):
+	# SOUN > "SOU " > ROL, ADL (MIDI) or SBL (VOC data); the "SOU " size
+	# doesn't count its own header (see sound.py)
+	if digitized:
+		samples = bytes( rng.randrange(256) for i in range( rng.randint(64, 512) ) )
+		voc = bytes( (1,) ) + (len(samples) + 2).to_bytes(3, 'little') + bytes( (0xA6, 0) ) + samples + bytes(1)
+		payload = block( "AUhd", bytes(6) ) + block( "AUdt", voc )
+		music = b"SBL " + len(payload).to_bytes(4, 'big') + payload
+	else:
+		# like "SOU ", these blocks don't count their own header either
+		music = b''
+		for name in ("ROL ", "ADL "):
+			payload = block( "MDhd", bytes(8) ) + makeMidi( rng )
+			music += name.encode('ascii') + len(payload).to_bytes(4, 'big') + payload
+	sou = b"SOU " + len(music).to_bytes(4, 'big') + music
+	return block( "SOUN", sou )
+
+
+# INDEX FILE *******************************************************************
+ROOM_NAMES = ("beach", "lab", "jungle", "crete", "knossos", "sub", "balloon", "dig", "thera", "atlantis")
+
+def roomName( room_number ):
+	# at most 9 characters, different for every room
+	return f"{ROOM_NAMES[ room_number % len(ROOM_NAMES) ]}{room_number}"[:9]
+
+def directory( entries ):
+	# DROO, DSCR, ... payload: every entry is (room number, offset); entry 0
+	# is never used
+	entries = [ (0, 0) ] + list( entries )
+	return len(entries).to_bytes(2, 'little') + bytes( room for room, offset in entries ) + b''.join( offset.to_bytes(4, 'little') for room, offset in entries )
+
+def makeIndexFile( num_rooms, scripts, sounds, num_objects ):
+	# `scripts` and `sounds` list (room number, offset from the ROOM block)
+	rnam = b''.join( bytes( (room_number,) ) + bytes( b ^ 0xFF for b in roomName( room_number ).encode('ascii').ljust(9, b"\x00") ) for room_number in range(1, num_rooms + 1) ) + bytes(1)
+	maxs = b''.join( value.to_bytes(2, 'little') for value in (800, 16, 2048, 200, 50, 9, 100, 50, 80) )
+	# every object is in its room (owner 0x0F), in state 0
+	dobj = (num_objects + 1).to_bytes(2, 'little') + bytes( (0x0F,) ) * (num_objects + 1) + bytes( 4 * (num_objects + 1) )
+	return ( block( "RNAM", rnam ) + block( "MAXS", maxs )
+		+ block( "DROO", directory( (1, 0) for room_number in range(num_rooms) ) )
+		+ block( "DSCR", directory( scripts ) )
+		+ block( "DSOU", directory( sounds ) )
+		+ block( "DCOS", directory( [] ) )
+		+ block( "DCHR", directory( [] ) )
+		+ block( "DOBJ", dobj ) )
+
+
+# RESOURCE FILE ****************************************************************
+def generateResourceFile( path, num_rooms=4, width=320, height=144, seed=0, compression_ids=None, xor_key=0x69, num_z_planes=0, num_objects=0, num_palettes=None, num_cycles=0, index_path=None ):
+	# Write a resource file with `num_rooms` rooms of `width` x `height`
+	# pixels (`width` and `height` may also be (min, max) ranges), sharing
+	# `num_palettes` different palettes (one per room if None), and, with
+	# `index_path`, its index file.
+	# Returns {room number: SyntheticRoom}, to check what the extractor
+	# decodes.
+	rng = random.Random( seed )
+	palettes = None
+	if num_palettes:
+		palettes = [ bytes( rng.randrange(256) for i in range(768) ) for p in range(num_palettes) ]
+	rooms = {}
+	lflf_blocks = []
+	scripts = []
+	sounds = []
+	for room_number in range(1, num_rooms + 1):
+		room_width = rng.randint( *width ) // 8 * 8 if isinstance( width, tuple ) else width
+		room_height = rng.randint( *height ) if isinstance( height, tuple ) else height
+		room, rooms[ room_number ] = makeRoom( room_width, room_height, rng, compression_ids, num_z_planes=num_z_planes, num_objects=num_objects, palette=rng.choice( palettes ) if palettes else None, num_cycles=num_cycles )
+		scrp = block( "SCRP", bytes(16) )
+		music = makeSound( rng )
+		digitized = makeSound( rng, digitized=True )
+		lflf_blocks.append( block( "LFLF", room + scrp + music + digitized ) )
+		# offsets from the ROOM block, as in the index file
+		scripts.append( (room_number, len(room)) )
+		sounds.append( (room_number, len(room) + len(scrp)) )
+		sounds.append( (room_number, len(room) + len(scrp) + len(music)) )
+
+	# LOFF: room number (byte) and ROOM offset (LE dword) of every room
+	loff_size = 8 + 1 + 5 * num_rooms
+	position = 8 + loff_size
+	loff = bytearray( (num_rooms,) )
+	for room_number, lflf in enumerate( lflf_blocks, 1 ):
+		loff += bytes( (room_number,) ) + (position + 8).to_bytes(4, 'little')
+		position += len(lflf)
+
+	data = block( "LECF", block( "LOFF", loff ) + b''.join( lflf_blocks ) )
+	with open(path, 'wb') as f:
+		f.write( data.translate( bytes( b ^ xor_key for b in range(256) ) ) )
+
+	if index_path is not None:
+		max_object_id = max( [ obj[0] for room in rooms.values() for obj in room.objects ] or [0] )
+		with open(index_path, 'wb') as f:
+			f.write( makeIndexFile( num_rooms, scripts, sounds, max_object_id ).translate( bytes( b ^ xor_key for b in range(256) ) ) )
+	return rooms
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser( description="Write a synthetic SCUMM v5 resource file" )
+	parser.add_argument( "output", help="resource file to write (e.g. ATLANTIS.001)" )
+	parser.add_argument( "--rooms", type=int, default=4, help="number of rooms" )
+	parser.add_argument( "--width", type=int, default=320, help="room width in pixels (multiple of 8)" )
+	parser.add_argument( "--height", type=int, default=144, help="room height in pixels" )
+	parser.add_argument( "--zplanes", type=int, default=0, help="number of z-planes of every room" )
+	parser.add_argument( "--objects", type=int, default=0, help="number of objects of every room" )
+	parser.add_argument( "--cycles", type=int, default=0, help="number of color cycles of every room" )
+	parser.add_argument( "--palettes", type=int, default=0, help="number of different palettes (default: one per room)" )
+	parser.add_argument( "--seed", type=int, default=0, help="random seed" )
+	parser.add_argument( "--index", metavar="INDEX_FILE", help="write the index file too (e.g. ATLANTIS.000)" )
+	args = parser.parse_args()
+
+	generateResourceFile( args.output, args.rooms, args.width // 8 * 8, args.height, args.seed, num_z_planes=args.zplanes, num_objects=args.objects, num_palettes=args.palettes, num_cycles=args.cycles, index_path=args.index )
+	print(f"{args.output}: {args.rooms} rooms of {args.width // 8 * 8}x{args.height} pixels")
@@ -0,0 +1,19 @@
+# Tests run on synthetic resource files (see synthetic.py): every room comes
+# with what the extractor should find in it.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+from synthetic import generateResourceFile
+
+@pytest.fixture
+def game( tmp_path ):
+	# (resource file path, {room number: SyntheticRoom}) of a small game,
+	# with its index file (room names) next to it
+	file_path = str( tmp_path / "GAME.001" )
+	rooms = generateResourceFile( file_path, num_rooms=3, width=(64, 320), height=(16, 96), seed=11, num_z_planes=2, num_objects=2, index_path=str( tmp_path / "GAME.000" ) )
+	return file_path, rooms
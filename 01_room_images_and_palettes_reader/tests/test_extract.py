@@ -0,0 +1,151 @@
+# Extraction of a synthetic game: what is saved against what the rooms have
+# been made of, streaming against the usual extraction, and what incremental
+# extraction does again (or not) on the next run.
+
+import glob
+import os
+
+from PIL import Image
+
+import main
+from blockindex import buildIndex
+from xorfile import XorFileReader
+
+OUTPUTS = ["palette", "background", "zplanes", "objects"]
+
+def outputFile( output_dir, folder, room_number, suffix=".png" ):
+	# the single file of a room in an output folder
+	files = glob.glob( os.path.join( output_dir, folder, f"room{room_number}_*{suffix}" ) )
+	assert len(files) == 1, files
+	return files[0]
+
+def imageContent( path ):
+	# what an image shows, whatever encoder wrote it
+	image = Image.open( path )
+	return image.mode, image.size, image.tobytes(), image.getpalette(), image.info.get("transparency")
+
+def outputContents( output_dir ):
+	contents = {}
+	for path in sorted( glob.glob( os.path.join( output_dir, "*", "*" ) ) ):
+		contents[ os.path.relpath( path, output_dir ) ] = imageContent( path ) if path.endswith(".png") else open(path, 'rb').read()
+	return contents
+
+def flipByte( file_path, offset ):
+	with open(file_path, 'r+b') as f:
+		f.seek( offset )
+		value = f.read(1)[0]
+		f.seek( offset )
+		f.write( bytes( (value ^ 0xFF,) ) )
+
+def roomBlock( file_path, room_number, block_name ):
+	with XorFileReader( file_path ) as file:
+		return buildIndex( file ).find( room_number, block_name )
+
+
+def testExtractRoundTrip( game, tmp_path ):
+	file_path, rooms = game
+	output_dir = str( tmp_path / "out" )
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, scale=1, palette_scale=1, incremental=False )
+	assert summary["rooms"] == sorted( rooms ) and not summary["failed_rooms"] and not summary["output_errors"]
+
+	for room_number, room in rooms.items():
+		mode, size, pixels, palette, transparency = imageContent( outputFile( output_dir, "backgrounds", room_number ) )
+		assert (mode, size, pixels) == ("P", (room.width, room.height), bytes( room.indices ))
+		# (only objects are transparent)
+		assert transparency is None
+
+		for k, mask in enumerate( room.zplanes, 1 ):
+			image = Image.open( outputFile( output_dir, "zplanes", room_number, f"_zp{k:02d}.png" ) )
+			assert (image.mode, image.size, image.tobytes()) == ("1", (room.width, room.height), bytes( mask ))
+
+		for k, (obj_id, width, height, states) in enumerate( room.objects, 1 ):
+			for j, state in enumerate( states, 1 ):
+				image = Image.open( outputFile( output_dir, "objects", room_number, f"_obj{k:03d}_im{j:02d}.png" ) )
+				assert (image.size, image.tobytes(), image.info.get("transparency")) == ((width, height), bytes( state ), 0)
+
+		# the palette image shows the 256 colors of the CLUT, in order
+		mode, size, pixels, palette, transparency = imageContent( outputFile( output_dir, "palettes", room_number ) )
+		assert size == (16, 16) and pixels == bytes( range(256) )
+
+def testStreamingMatchesExtraction( game, tmp_path ):
+	file_path, rooms = game
+	normal_dir = str( tmp_path / "normal" )
+	stream_dir = str( tmp_path / "stream" )
+	main.extract( file_path, normal_dir, outputs=OUTPUTS, incremental=False )
+	summary = main.extract( file_path, stream_dir, outputs=OUTPUTS, incremental=False, streaming=True )
+	assert summary["rooms"] == sorted( rooms )
+	normal = outputContents( normal_dir )
+	assert normal and outputContents( stream_dir ) == normal
+
+def testIncrementalExtraction( game, tmp_path ):
+	file_path, rooms = game
+	output_dir = str( tmp_path / "out" )
+	all_rooms = sorted( rooms )
+
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, incremental=True )
+	assert summary["rooms"] == all_rooms and summary["up_to_date"] == []
+
+	# nothing changed: nothing to do
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, incremental=True )
+	assert summary["rooms"] == [] and sorted( summary["up_to_date"] ) == all_rooms
+
+	# other settings: every room again
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, scale=3, incremental=True )
+	assert summary["rooms"] == all_rooms
+
+	# a file gone: only its room
+	os.remove( outputFile( output_dir, "backgrounds", 2 ) )
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, scale=3, incremental=True )
+	assert summary["rooms"] == [2]
+	assert os.path.exists( outputFile( output_dir, "backgrounds", 2 ) )
+
+	# room data changed: only that room, and its images follow
+	clut = roomBlock( file_path, 3, "CLUT" )
+	flipByte( file_path, clut.offset + 8 )
+	before = imageContent( outputFile( output_dir, "palettes", 3 ) )
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, scale=3, incremental=True )
+	assert summary["rooms"] == [3]
+	assert imageContent( outputFile( output_dir, "palettes", 3 ) ) != before
+
+	# forced: everything
+	summary = main.extract( file_path, output_dir, outputs=OUTPUTS, scale=3, incremental=True, force=True )
+	assert summary["rooms"] == all_rooms
+
+def testIncrementalSounds( game, tmp_path ):
+	# sounds are made of the SOUN blocks, outside the ROOM block: when one of
+	# them changes, they must be saved again even if the ROOM block didn't
+	file_path, rooms = game
+	output_dir = str( tmp_path / "out" )
+	outputs = ["palette", "sounds"]
+
+	main.extract( file_path, output_dir, outputs=outputs, incremental=True )
+	sounds = sorted( glob.glob( os.path.join( output_dir, "sounds", "room2_*" ) ) )
+	assert sounds
+	before = { path: open(path, 'rb').read() for path in sounds }
+
+	soun = roomBlock( file_path, 2, "SOUN" )
+	flipByte( file_path, soun.offset + soun.size - 10 )
+	summary = main.extract( file_path, output_dir, outputs=outputs, incremental=True )
+	assert summary["rooms"] == [2]
+	assert { path: open(path, 'rb').read() for path in sounds } != before
+
+	# and only sounds are wanted: nothing left to do afterwards
+	summary = main.extract( file_path, output_dir, outputs=outputs, incremental=True )
+	assert summary["rooms"] == []
+
+def testBackgroundRegionsMatchBackground( game, tmp_path ):
+	# parts and previews look like the saved background (palette, no transparency)
+	file_path, rooms = game
+	output_dir = str( tmp_path / "out" )
+	main.extract( file_path, output_dir, outputs=["background"], scale=1, incremental=False )
+	with XorFileReader( file_path ) as file:
+		index = buildIndex( file )
+		for room_number, room in rooms.items():
+			background = Image.open( outputFile( output_dir, "backgrounds", room_number ) )
+			box = (8, 1, room.width - 3, room.height - 1)
+			region = main.readBackgroundRegion( file, index, room_number, box ).get_image()
+			assert region.tobytes() == background.crop( box ).tobytes()
+			assert region.getpalette() == background.getpalette()
+			assert region.info.get("transparency") == background.info.get("transparency")
+			preview = main.readBackgroundPreview( file, index, room_number, 2 )
+			assert (preview.width, preview.height) == (8 * len( range( 0, room.width // 8, 2 ) ), (room.height + 1) // 2)
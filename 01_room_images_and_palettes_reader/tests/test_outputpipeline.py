@@ -0,0 +1,53 @@
+# Batched writes: every file whole, however little the system writes at a
+# time, and whichever way the files are opened.
+
+import os
+
+import pytest
+
+import outputpipeline
+from outputpipeline import OutputPipeline, BatchWriter
+
+def batchFiles( folder ):
+	data = memoryview( bytes( range(256) ) * 64 )
+	return { os.path.join( folder, f"{i}.raw" ): [ b"HEAD", data[ i * 100 : i * 100 + 1000 + i ], b"", b"TAIL" ] for i in range(40) }
+
+def writeAndCheck( folder, pipeline=None ):
+	files = batchFiles( folder )
+	writer = BatchWriter( pipeline, max_files=16 )
+	for filename, buffers in files.items():
+		writer.write( filename, buffers )
+	writer.flush()
+	if pipeline is not None:
+		assert pipeline.close() == []
+	assert writer.errors == [] and writer.written == len(files)
+	for filename, buffers in files.items():
+		assert open(filename, 'rb').read() == b"".join( bytes(buffer) for buffer in buffers )
+
+@pytest.mark.parametrize( "dir_fd", [True, False] )
+def testBatchWriter( tmp_path, monkeypatch, dir_fd ):
+	monkeypatch.setattr( outputpipeline, "DIR_FD", dir_fd and outputpipeline.DIR_FD )
+	writeAndCheck( str( tmp_path ), OutputPipeline() )
+
+def testShortWrites( tmp_path, monkeypatch ):
+	# no writev, and write never takes more than 7 bytes at a time
+	write = os.write
+	monkeypatch.delattr( os, "writev", raising=False )
+	monkeypatch.setattr( os, "write", lambda fd, data: write( fd, bytes( data[:7] ) ) )
+	writeAndCheck( str( tmp_path ) )
+
+def testShortWritev( tmp_path, monkeypatch ):
+	# writev stopping in the middle of a buffer
+	if not hasattr( os, "writev" ):
+		pytest.skip( "no writev" )
+	writev = os.writev
+	monkeypatch.setattr( os, "writev", lambda fd, buffers: writev( fd, [ bytes( buffers[0][:5] ) ] ) )
+	writeAndCheck( str( tmp_path ) )
+
+def testErrorsByFile( tmp_path ):
+	writer = BatchWriter()
+	writer.write( str( tmp_path / "missing" / "a.raw" ), [ b"A" ] )
+	writer.write( str( tmp_path / "b.raw" ), [ b"B" ] )
+	writer.flush()
+	assert [ filename for filename, e in writer.errors ] == [ str( tmp_path / "missing" / "a.raw" ) ]
+	assert writer.written == 1 and open( tmp_path / "b.raw", 'rb' ).read() == b"B"
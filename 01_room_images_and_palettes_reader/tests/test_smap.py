@@ -0,0 +1,85 @@
+# Strip decoders: the table driven decoders against the reference one (a bit
+# at a time), and decoded strips, regions and previews against the pixels
+# they have been encoded from.
+
+import random
+
+import pytest
+
+from smap import decodeStrip, decodeRegion, decodePreview, stripSlices, stripOffsets
+from synthetic import COMPRESSION_IDS, makeRoomImage, makeSMAP, makeZPlane, block
+from zplane import decodeZPlane
+
+def syntheticImage( rng, width, height, strip_ids, noise=False, solid_rows=0 ):
+	# SMAP block and palette indices (as masked by makeSMAP) of an image,
+	# made of random pixels with `noise` (mostly new palette index codes),
+	# its last `solid_rows` rows of a single color (method 2 runs up to the
+	# end of the strips)
+	if noise:
+		image = bytearray( rng.choice( (rng.randrange(256), 7, 8, 9) ) for i in range( width * height ) )
+	else:
+		image = makeRoomImage( width, height, rng )
+	image[ (height - solid_rows) * width : ] = bytes( (rng.randrange(256),) ) * (solid_rows * width)
+	smap_data = makeSMAP( image, width, height, strip_ids )
+	return smap_data, bytes( image )
+
+def stripOf( image, width, height, i ):
+	return b"".join( image[ y*width + i*8 : y*width + i*8 + 8 ] for y in range(height) )
+
+@pytest.mark.parametrize( "compression_id", COMPRESSION_IDS )
+def testTableDecodersMatchReference( compression_id ):
+	rng = random.Random( compression_id )
+	for height, noise, solid_rows in ((1, False, 0), (7, True, 0), (64, False, 0), (64, True, 0), (144, False, 0), (144, True, 40)):
+		smap_data, image = syntheticImage( rng, 64, height, [ compression_id ] * 8, noise, solid_rows )
+		for strip in stripSlices( smap_data, stripOffsets( smap_data, 8 ) ):
+			decoded = decodeStrip( strip, height )
+			assert decoded == decodeStrip( strip, height, reference=True )
+			# whatever follows a strip is never read (method 2 runs of
+			# length 0 go up to the end of the strip)
+			followed = strip + bytes( (0xFF,) ) * 16
+			assert decodeStrip( followed, height ) == decodeStrip( followed, height, reference=True ) == decoded
+			# truncated strips: what's missing is left at palette index 0
+			truncated = strip[ : max( 2, len(strip) // 2 ) ]
+			assert decodeStrip( truncated, height ) == decodeStrip( truncated, height, reference=True )
+
+def testDecodedStripsMatchImage():
+	rng = random.Random( 1 )
+	width, height = 8 * len(COMPRESSION_IDS), 48
+	smap_data, image = syntheticImage( rng, width, height, COMPRESSION_IDS )
+	strips = stripSlices( smap_data, stripOffsets( smap_data, width // 8 ) )
+	for i, strip in enumerate( strips ):
+		pixels = decodeStrip( strip, height )
+		assert pixels == stripOf( image, width, height, i )
+		for rows in (1, height // 3, height):
+			assert decodeStrip( strip, height, rows=rows ) == pixels[ : 8 * rows ]
+
+def testRegionsAndPreviews():
+	rng = random.Random( 2 )
+	width, height = 320, 100
+	smap_data, image = syntheticImage( rng, width, height, [ rng.choice( COMPRESSION_IDS ) for i in range( width // 8 ) ] )
+	for i in range(30):
+		left = rng.randrange( width )
+		right = rng.randint( left + 1, width )
+		top = rng.randrange( height )
+		bottom = rng.randint( top + 1, height )
+		expected = b"".join( image[ y*width + left : y*width + right ] for y in range( top, bottom ) )
+		assert decodeRegion( smap_data, width, height, (left, top, right, bottom) ) == expected
+	for step in (1, 3, 4, 8):
+		preview_width, preview_height, preview = decodePreview( smap_data, width, height, step )
+		expected = b"".join( image[ y*width + x : y*width + x + 8 ] for y in range( 0, height, step ) for x in range( 0, width, 8 * step ) )
+		assert (preview_width, preview_height) == (8 * len( range( 0, width // 8, step ) ), len( range( 0, height, step ) ))
+		assert preview == expected
+	with pytest.raises( ValueError ):
+		decodeRegion( smap_data, width, height, (0, 0, width + 8, height) )
+
+def testZPlanesMatchMasks():
+	rng = random.Random( 3 )
+	for width, height in ((64, 16), (320, 144)):
+		payload, mask = makeZPlane( width, height, rng )
+		assert decodeZPlane( block( "ZP01", payload ), width, height ) == mask
+
+	# a repeat count of 0 stands for 256 bytes: past a 128 bytes tall strip,
+	# up to its end (what follows is never reached)
+	for height in (144, 256):
+		payload = (10).to_bytes( 2, 'little' ) + bytes( (0x80, 0x55, 0x81, 0xAA) )
+		assert decodeZPlane( block( "ZP01", payload ), 8, height ) == bytes( (0x55,) ) * height
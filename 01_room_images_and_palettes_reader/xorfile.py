@@ -0,0 +1,121 @@
+# A file-like, read-only view over a SCUMM resource file (ATLANTIS.001 & co.)
+# whose bytes are XOR-encoded (0x69 for FOA).
+#
+# Instead of reading the whole file in memory and decoding it byte by byte,
+# the file is memory-mapped and decoded lazily, one page at a time, only when
+# a page is actually touched. Decoding a page is a single `bytes.translate`
+# call (a 256-entry lookup table), so it runs at C speed.
+# Only a handful of decoded pages are kept around, which keeps the memory
+# footprint flat no matter how large the archive is.
+#
+# The object exposes the subset of the file API used by the readers in
+# main.py (read, seek, tell), so `readBlockHeader`, `readLFLF` and
+# `readRoomData` can work on it unchanged.
+
+import mmap
+import os
+from collections import OrderedDict
+
+import instrumentation
+
+PAGE_SIZE = 1 << 16        # 64 KiB of decoded data per page
+MAX_CACHED_PAGES = 64      # at most 4 MiB of decoded data kept in memory
+
+def xorTable( xor_key ):
+	# translation table mapping every byte value to its xored counterpart
+	return bytes( b ^ xor_key for b in range(256) )
+
+class XorFileReader:
+	def __init__(self, file_path, xor_key=0x69):
+		self.path = file_path
+		self.xor_key = xor_key
+		self.table = xorTable( xor_key )
+		self.position = 0
+		self.pages = OrderedDict()
+
+		self._file = open(file_path, 'rb')
+		self.size = os.fstat( self._file.fileno() ).st_size
+		# mmap refuses to map empty files
+		if self.size > 0:
+			self._mm = mmap.mmap( self._file.fileno(), 0, access=mmap.ACCESS_READ )
+		else:
+			self._mm = b''
+
+	# file API *****************************************************************
+	def read(self, n=-1):
+		if n is None or n < 0:
+			n = self.size - self.position
+		start = self.position
+		end = min( start + n, self.size )
+		if end <= start:
+			return b''
+		self.position = end
+
+		page_number, page_offset = divmod( start, PAGE_SIZE )
+		# fast path: the requested range lies inside a single page
+		if page_offset + (end - start) <= PAGE_SIZE:
+			return self._page( page_number )[ page_offset : page_offset + (end - start) ]
+
+		# larger reads are decoded in a single pass, skipping the page cache
+		return self._decode( start, end )
+
+	def seek(self, offset, whence=0):
+		if whence == 0:
+			position = offset
+		elif whence == 1:
+			position = self.position + offset
+		elif whence == 2:
+			position = self.size + offset
+		else:
+			raise ValueError(f"invalid whence ({whence})")
+		if position < 0:
+			raise ValueError(f"negative seek position {position}")
+		self.position = position
+		return self.position
+
+	def tell(self):
+		return self.position
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def close(self):
+		self.pages.clear()
+		if isinstance( self._mm, mmap.mmap ):
+			self._mm.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	# decoding *****************************************************************
+	def view(self, offset, size):
+		# decoded bytes of the [offset, offset+size) range, without moving the
+		# file pointer. With a 0x00 key there is nothing to decode at all, so
+		# we can hand out a zero-copy view of the mapped file.
+		end = min( offset + size, self.size )
+		if self.xor_key == 0 and isinstance( self._mm, mmap.mmap ):
+			return memoryview( self._mm )[ offset : end ]
+		return memoryview( self._decode( offset, end ) )
+
+	def _decode(self, start, end):
+		return self._mm[ start : end ].translate( self.table )
+
+	def _page(self, page_number):
+		page = self.pages.get( page_number )
+		if page is None:
+			start = page_number * PAGE_SIZE
+			with instrumentation.phase("xor_decode"):
+				page = self._decode( start, min( start + PAGE_SIZE, self.size ) )
+			self.pages[ page_number ] = page
+			if len( self.pages ) > MAX_CACHED_PAGES:
+				self.pages.popitem( last=False )
+		else:
+			self.pages.move_to_end( page_number )
+		return page
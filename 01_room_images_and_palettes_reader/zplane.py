@@ -0,0 +1,83 @@
+# Z-planes (ZP01, ZP02, ...)
+#
+# A z-plane is a 1 bit mask as big as the room background, telling which
+# pixels are in front of actors standing behind that plane. Like the
+# background, it is stored in strips 8 pixels wide: a strip is a column of
+# bytes, one per row, where the most significant bit is the leftmost pixel.
+#
+# "ZP0n"   dword   Block identifier
+# dwSize   dword   Size in bytes (BE)
+# offsets  word    one per strip (LE), relative to the beginning of the block
+#                  header; 0 means the strip is empty (all pixels clear)
+# strips   ...     RLE encoded columns of bytes:
+#                  byte b, if b & 0x80: the next byte is repeated b & 0x7F times
+#                                 else: the next b bytes are copied as they are
+#                  (a count of 0 stands for 256 repeated or copied bytes,
+#                  as far as the strip goes)
+#
+#ref: https://wiki.scummvm.org/index.php?title=SCUMM/Technical_Reference/Image_resources
+#
+# A decoded mask is kept bit-packed, row by row (width / 8 bytes per row), the
+# same layout as the strips themselves: the byte of strip i for row y is byte
+# y * (width / 8) + i of the mask, so every strip is copied into the mask with
+# a single slice assignment. NumPy is not required: `zplaneArray` turns a mask
+# into an array only if NumPy is installed (and only then it is imported).
+
+# to be increased whenever a change to the decoder changes decoded masks
+ZPLANE_DECODER_VERSION = 2
+
+def decodeZPlaneStrip( data, position, height ):
+	# the `height` bytes of a strip starting at `position` of `data`
+	column = bytearray()
+	end = len(data)
+	while len(column) < height and position < end:
+		b = data[ position ]
+		position += 1
+		if b & 0x80:
+			n = (b & 0x7F) or 256
+			if position >= end:
+				break
+			column += bytes( (data[ position ],) ) * n
+			position += 1
+		else:
+			n = b or 256
+			column += data[ position : position + n ]
+			position += n
+	if len(column) < height:
+		# truncated strip: what is left stays clear
+		column += bytes( height - len(column) )
+	return column[ :height ]
+
+def decodeZPlane( zplane_data, width, height ):
+	# `zplane_data` is the whole ZP0n block, header included.
+	# Returns the bit-packed mask (height rows of width / 8 bytes)
+	num_strips = width // 8
+	mask = bytearray( num_strips * height )
+	data = memoryview( zplane_data )
+	for i in range(num_strips):
+		offset = int.from_bytes( data[ 8 + 2*i : 10 + 2*i ], 'little' )
+		if offset == 0 or offset >= len(data):
+			continue
+		mask[ i::num_strips ] = decodeZPlaneStrip( data, offset, height )
+	return mask
+
+def zplaneArray( mask, width, height ):
+	# a (height, width / 8) uint8 NumPy array viewing the bit-packed mask
+	# (numpy.unpackbits(array, axis=1) gives one value per pixel)
+	try:
+		import numpy
+	except ImportError:
+		raise ImportError("NumPy is needed for z-plane arrays")
+	return numpy.frombuffer( mask, dtype=numpy.uint8 ).reshape( height, width // 8 )
+
+# the 8 pixels (0 or 1, leftmost first) of every byte of a mask
+PIXELS_OF_BYTE = [ bytes( (b >> (7 - i)) & 1 for i in range(8) ) for b in range(256) ]
+
+def zplanePixels( mask ):
+	# one byte (0 or 1) per pixel, row by row, without NumPy
+	return b"".join( PIXELS_OF_BYTE[ b ] for b in mask )
+
+def zplaneImage( mask, width, height ):
+	# 1 bit image: mode "1" uses the very same bit-packed layout
+	from PIL import Image
+	return Image.frombytes( "1", (width, height), bytes( mask ) )